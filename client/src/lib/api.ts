@@ -24,18 +24,85 @@ async function j<T>(res: Response): Promise<T> {
   return res.json();
 }
 
+// Ultime risposte di /api/compute per body: rimandiamo l'ETag e su 304 riusiamo il JSON.
+const computeCache = new Map<string, { etag: string; data: any }>();
+const COMPUTE_CACHE_MAX = 200;
+
 export async function computeScenario(s: ScenarioIn) {
-  const res = await fetch(`${API}/api/compute`, {
+  const body = JSON.stringify(s);
+  const cached = computeCache.get(body);
+  const headers: Record<string, string> = { "Content-Type": "application/json" };
+  if (cached) headers["If-None-Match"] = cached.etag;
+  const res = await fetch(`${API}/api/compute`, { method: "POST", headers, body });
+  if (res.status === 304 && cached) return cached.data;
+  const data = await j<any>(res);
+  const etag = res.headers.get("ETag");
+  if (etag) {
+    computeCache.delete(body);
+    computeCache.set(body, { etag, data });
+    if (computeCache.size > COMPUTE_CACHE_MAX) computeCache.delete(computeCache.keys().next().value as string);
+  }
+  return data;
+}
+
+export type PricingFrame = {
+  seq?: number;
+  kpis: Record<string, number>;
+  delta: Record<string, number>;
+  totals: Record<string, number>;
+  recomputed: string[];
+  cost_version: number;
+  error?: any;
+};
+
+// Sessione live: si manda solo il diff dei campi, il server tiene lo scenario e risponde con KPI e delta.
+export function openPricingSession(initial: ScenarioIn, onFrame: (f: PricingFrame) => void) {
+  const ws = new WebSocket(`${API.replace(/^http/, "ws")}/api/ws/pricing`);
+  let seq = 0;
+  const pending: Partial<ScenarioIn>[] = [initial];
+  const send = (diff: Partial<ScenarioIn>) => ws.send(JSON.stringify({ seq: ++seq, set: diff }));
+  ws.onopen = () => pending.splice(0).forEach(send);
+  ws.onmessage = ev => onFrame(JSON.parse(ev.data));
+  return {
+    update(diff: Partial<ScenarioIn>) {
+      if (ws.readyState === WebSocket.OPEN) send(diff);
+      else pending.push(diff);
+    },
+    close: () => ws.close()
+  };
+}
+
+export type CompareDest = { destination: Destination; sell_usd_per_mt?: number | null };
+
+export async function compareDestinations(scn: ScenarioIn, dests?: CompareDest[]) {
+  const res = await fetch(`${API}/api/compare`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify(s)
+    body: JSON.stringify({ scn, dests })
   });
   return j<any>(res);
 }
 
+// Copia locale del catalogo costi: chiediamo solo le differenze dalla versione che abbiamo (?since=).
+let costCatalog: { version: number; items: any[] } | null = null;
+
+const costOrder = (a: any, b: any) =>
+  a.code < b.code ? -1 : a.code > b.code ? 1 : (a.effective_from ?? "").localeCompare(b.effective_from ?? "");
+
 export async function listCosts() {
-  const res = await fetch(`${API}/api/costs`);
-  return j<any[]>(res);
+  const since = costCatalog ? costCatalog.version : -1;
+  const headers: Record<string, string> = {};
+  if (costCatalog) headers["If-None-Match"] = `"costs-${costCatalog.version}-${since}-json"`;
+  const res = await fetch(`${API}/api/costs?since=${since}`, { headers });
+  if (res.status === 304 && costCatalog) return [...costCatalog.items];
+  const delta = await j<any>(res);
+  let items: any[] = delta.items;
+  if (!delta.full && costCatalog) {
+    const touched = new Set<string>([...delta.removed, ...delta.items.map((c: any) => c.code)]);
+    items = costCatalog.items.filter((c) => !touched.has(c.code)).concat(delta.items).sort(costOrder);
+  }
+  costCatalog = { version: delta.cost_version, items };
+  return [...items];
 }
 
 export async function saveCost(item: any) {
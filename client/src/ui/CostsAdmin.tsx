@@ -3,28 +3,39 @@ import { listCosts, saveCost } from "../lib/api";
 
 type CostItem = {
   code:string; name:string;
-  behavior:"per_ton"|"per_container"|"per_truck"|"per_month"|"fixed_per_shipment"|"percent_of_value";
+  behavior:"per_ton"|"per_container"|"per_truck"|"per_month"|"fixed_per_shipment"|"percent_of_value"|"formula";
   unit_amount_usd:number; unit:string;
   qty_source:"Volume_MT"|"Containers"|"Trucks"|"Storage_Months"|"1"|"Value_USD";
   dest_scope:"LUB*"|"KIN*"|"KOL*";
   category:"product"|"logistics"|"insurance"|"finance";
+  formula?:string|null;   // solo behavior "formula", es. containers * max(0, storage_days - 14)
+  effective_from?:string|null;   // incluso; null = da sempre
+  effective_to?:string|null;     // escluso; null = versione corrente
 };
 
+// /api/costs restituisce anche lo storico: una riga = una versione (code, effective_from)
+const rowKey=(it:CostItem)=>`${it.code}@${it.effective_from ?? ""}`;
+
 export default function CostsAdmin(){
   const [items,setItems]=useState<CostItem[]>([]);
   const [saving,setSaving]=useState<string | null>(null);
+  const [error,setError]=useState<string | null>(null);
+  const edit=(it:CostItem, patch:Partial<CostItem>)=>setItems(items.map(x=>rowKey(x)===rowKey(it)?{...x,...patch}:x));
 
   async function load(){ try{ setItems(await listCosts()); } catch(e){ console.error(e); } }
   useEffect(()=>{ load(); },[]);
 
   async function save(it:CostItem){
-    setSaving(it.code);
-    try{ await saveCost(it); await load(); } finally{ setSaving(null); }
+    setSaving(rowKey(it)); setError(null);
+    try{ await saveCost(it); await load(); }
+    catch(e){ setError(`${it.code}: ${e instanceof Error ? e.message : String(e)}`); }   // es. formula non valida (422), periodi sovrapposti (409)
+    finally{ setSaving(null); }
   }
 
   return (
     <div className="section">
       <h2 className="text-lg font-semibold mb-4">Costs — Admin</h2>
+      {error && <div className="mb-3 text-sm text-red-600">{error}</div>}
       <div className="overflow-auto">
         <table className="min-w-full text-sm">
           <thead>
@@ -32,63 +43,78 @@ export default function CostsAdmin(){
               <th className="py-2 pr-3">Code</th>
               <th className="py-2 pr-3">Name</th>
               <th className="py-2 pr-3">Behavior</th>
+              <th className="py-2 pr-3">Formula</th>
               <th className="py-2 pr-3">Unit $</th>
               <th className="py-2 pr-3">Unit</th>
               <th className="py-2 pr-3">Qty Source</th>
               <th className="py-2 pr-3">Dest scope</th>
               <th className="py-2 pr-3">Category</th>
+              <th className="py-2 pr-3">From</th>
+              <th className="py-2 pr-3">To</th>
               <th className="py-2 pr-3">Action</th>
             </tr>
           </thead>
           <tbody>
-          {items.map((it,i)=>(
-            <tr key={it.code} className="border-b">
+          {items.map((it,i)=>{
+            // PUT /api/costs/{code} modifica solo la versione corrente: lo storico e' in sola lettura
+            const locked=it.effective_to!=null;
+            return (
+            <tr key={rowKey(it)} className={locked?"border-b text-gray-500":"border-b"}>
               <td className="py-1 pr-3">{it.code}</td>
               <td className="py-1 pr-3">
-                <input className="input" value={it.name} onChange={e=>setItems(items.map(x=>x.code===it.code?{...x,name:e.target.value}:x))}/>
+                <input className="input" disabled={locked} value={it.name} onChange={e=>edit(it,{name:e.target.value})}/>
               </td>
               <td className="py-1 pr-3">
-                <select className="input" value={it.behavior}
-                  onChange={e=>setItems(items.map(x=>x.code===it.code?{...x,behavior:e.target.value as any}:x))}>
+                <select className="input" disabled={locked} value={it.behavior}
+                  onChange={e=>edit(it,{behavior:e.target.value as any,
+                    formula:e.target.value==="formula"?it.formula:null})}>
                   <option>per_ton</option><option>per_container</option><option>per_truck</option>
                   <option>per_month</option><option>fixed_per_shipment</option><option>percent_of_value</option>
+                  <option>formula</option>
                 </select>
               </td>
               <td className="py-1 pr-3">
-                <input className="input" type="number" step="0.01" value={it.unit_amount_usd}
-                  onChange={e=>setItems(items.map(x=>x.code===it.code?{...x,unit_amount_usd:Number(e.target.value)}:x))}/>
+                <input className="input font-mono" value={it.formula ?? ""} disabled={locked || it.behavior!=="formula"}
+                  placeholder={it.behavior==="formula" ? "containers * max(0, storage_days - 14)" : ""}
+                  onChange={e=>edit(it,{formula:e.target.value})}/>
+              </td>
+              <td className="py-1 pr-3">
+                <input className="input" type="number" step="0.01" disabled={locked} value={it.unit_amount_usd}
+                  onChange={e=>edit(it,{unit_amount_usd:Number(e.target.value)})}/>
               </td>
               <td className="py-1 pr-3">
-                <input className="input" value={it.unit}
-                  onChange={e=>setItems(items.map(x=>x.code===it.code?{...x,unit:e.target.value}:x))}/>
+                <input className="input" disabled={locked} value={it.unit}
+                  onChange={e=>edit(it,{unit:e.target.value})}/>
               </td>
               <td className="py-1 pr-3">
-                <select className="input" value={it.qty_source}
-                  onChange={e=>setItems(items.map(x=>x.code===it.code?{...x,qty_source:e.target.value as any}:x))}>
+                <select className="input" disabled={locked} value={it.qty_source}
+                  onChange={e=>edit(it,{qty_source:e.target.value as any})}>
                   <option>Volume_MT</option><option>Containers</option><option>Trucks</option>
                   <option>Storage_Months</option><option>1</option><option>Value_USD</option>
                 </select>
               </td>
               <td className="py-1 pr-3">
-                <select className="input" value={it.dest_scope}
-                  onChange={e=>setItems(items.map(x=>x.code===it.code?{...x,dest_scope:e.target.value as any}:x))}>
+                <select className="input" disabled={locked} value={it.dest_scope}
+                  onChange={e=>edit(it,{dest_scope:e.target.value as any})}>
                   <option>LUB*</option><option>KIN*</option><option>KOL*</option>
                 </select>
               </td>
               <td className="py-1 pr-3">
-                <select className="input" value={it.category}
-                  onChange={e=>setItems(items.map(x=>x.code===it.code?{...x,category:e.target.value as any}:x))}>
+                <select className="input" disabled={locked} value={it.category}
+                  onChange={e=>edit(it,{category:e.target.value as any})}>
                   <option>product</option><option>logistics</option><option>insurance</option><option>finance</option>
                 </select>
               </td>
+              <td className="py-1 pr-3">{it.effective_from ?? "—"}</td>
+              <td className="py-1 pr-3">{it.effective_to ?? "—"}</td>
               <td className="py-1 pr-3">
                 <button className="px-3 py-1 rounded-md bg-emerald-600 text-white hover:bg-emerald-700 disabled:opacity-50"
-                        disabled={saving===it.code} onClick={()=>save(it)}>
-                  {saving===it.code? "Saving..." : "Save"}
+                        disabled={locked || saving===rowKey(it)} onClick={()=>save(it)}>
+                  {saving===rowKey(it)? "Saving..." : "Save"}
                 </button>
               </td>
             </tr>
-          ))}
+          );})}
           </tbody>
         </table>
       </div>
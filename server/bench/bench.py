@@ -0,0 +1,216 @@
+"""Benchmarks for the compute engine and the HTTP endpoints.
+
+Mix realistico LUB/KIN/KOL, da una singola chiamata fino a un book da 100k
+deal. Per ogni caso: throughput (scenari/s), latenza p50/p99 per chiamata e
+picco di allocazioni (tracemalloc, su un giro separato per non falsare i
+tempi). Con --check il run fallisce se un caso e' peggiorato oltre la
+tolleranza rispetto a bench/baselines.json.
+
+    python bench/bench.py                 # report
+    python bench/bench.py --check         # exit 1 su regressione
+    python bench/bench.py --update        # riscrive le baseline (stessa macchina!)
+    python bench/bench.py --only batch_1k --repeat 3
+"""
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEST_MIX = (("LUB", 0.45), ("KIN", 0.35), ("KOL", 0.20))
+
+
+def scenarios(n: int, seed: int = 7) -> List[Dict]:
+    rnd = random.Random(seed)
+    dests = [d for d, _ in DEST_MIX]
+    weights = [w for _, w in DEST_MIX]
+    out = []
+    for _ in range(n):
+        out.append({
+            "destination": rnd.choices(dests, weights)[0],
+            "incoterm": "CFR",
+            "volume_mt": rnd.choice([rnd.randint(1, 40) * 40, rnd.randint(1, 25) * 58, round(rnd.uniform(20, 2500), 1)]),
+            "buy_price_per_mt": round(rnd.uniform(380, 560), 2),
+            "sell_price_per_mt": round(rnd.uniform(620, 980), 2),
+            "shrinkage_pct": round(rnd.uniform(0, 1.5), 2),
+            "storage_months": rnd.choice([0, 1, 1, 2]),
+            "dpo_buy_days": rnd.choice([0, 30, 60]),
+            "dso_sell_days": rnd.choice([30, 45, 60, 90]),
+            "annual_finance_rate_pct": rnd.choice([8.0, 10.0, 12.0]),
+            "partner_profit_pct": 5.0,
+            "mt_per_container": 40,
+            "mt_per_truck": 58,
+        })
+    return out
+
+
+def _columns(rows: Sequence[Dict]) -> Dict[str, list]:
+    return {f: [r[f] for r in rows] for f in rows[0]}
+
+
+def _csv(rows: Sequence[Dict]) -> bytes:
+    buf = io.StringIO()
+    fields = ["deal_id"] + list(rows[0])
+    buf.write(",".join(fields) + "\n")
+    for i, r in enumerate(rows):
+        buf.write(",".join([str(i)] + ["" if r[f] is None else str(r[f]) for f in fields[1:]]) + "\n")
+    return buf.getvalue().encode()
+
+
+# ------------ Cases ------------
+# ogni caso: setup(app_main, client) -> (call(i), scenari per chiamata, chiamate)
+def case_internal_single(m, c):
+    rows = [m.ScenarioIn(**r) for r in scenarios(2000)]
+    return (lambda i: m._compute_internal(rows[i % len(rows)])), 1, 2000
+
+
+def case_http_compute(m, c):
+    rows = scenarios(1000, seed=11)
+    return (lambda i: _ok(c.post("/api/compute", json=rows[i % len(rows)]))), 1, 1000
+
+
+def case_http_compute_cached(m, c):
+    row = scenarios(1, seed=13)[0]
+    _ok(c.post("/api/compute", json=row))
+    return (lambda i: _ok(c.post("/api/compute", json=row))), 1, 1000
+
+
+def case_batch_1k(m, c):
+    payload = {"columns": _columns(scenarios(1000, seed=17))}
+    return (lambda i: _ok(c.post("/api/compute/batch", json=payload))), 1000, 50
+
+
+def case_batch_full_1k(m, c):
+    payload = {"scenarios": scenarios(1000, seed=19), "detail": "full"}
+    return (lambda i: _ok(c.post("/api/compute/batch", json=payload))), 1000, 10
+
+
+def case_batch_100k(m, c):
+    payload = {"columns": _columns(scenarios(100_000, seed=23))}
+    return (lambda i: _ok(c.post("/api/compute/batch", json=payload))), 100_000, 5
+
+
+def case_portfolio_100k(m, c):
+    data = _csv(scenarios(100_000, seed=29))
+    def call(i):
+        _ok(c.post("/api/portfolio/evaluate?format=csv", files={"file": ("book.csv", data, "text/csv")}))
+    return call, 100_000, 3
+
+
+CASES: Dict[str, Callable] = {
+    "internal_single": case_internal_single,
+    "http_compute": case_http_compute,
+    "http_compute_cached": case_http_compute_cached,
+    "batch_1k": case_batch_1k,
+    "batch_full_1k": case_batch_full_1k,
+    "batch_100k": case_batch_100k,
+    "portfolio_100k": case_portfolio_100k,
+}
+
+
+def _ok(r):
+    if r.status_code != 200:
+        raise RuntimeError(f"{r.status_code}: {r.text[:200]}")
+    return r
+
+
+def _percentile(values: Sequence[float], q: float) -> float:
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def run_case(name: str, m, c, repeat: float = 1.0) -> Dict[str, float]:
+    call, per_call, calls = CASES[name](m, c)
+    calls = max(1, int(calls * repeat))
+    call(0)  # warm-up (piani compilati, cache di import)
+    lat: List[float] = []
+    t_start = time.perf_counter()
+    for i in range(calls):
+        t0 = time.perf_counter()
+        call(i)
+        lat.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - t_start
+
+    tracemalloc.start()
+    call(calls)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "calls": calls,
+        "throughput_per_s": per_call * calls / elapsed,
+        "p50_ms": _percentile(lat, 0.50) * 1000,
+        "p99_ms": _percentile(lat, 0.99) * 1000,
+        "peak_alloc_kb": peak / 1024,
+    }
+
+
+def regressions(result: Dict[str, float], base: Dict[str, float], tolerance: float) -> List[str]:
+    out = []
+    if result["throughput_per_s"] < base["throughput_per_s"] * (1 - tolerance):
+        out.append(f"throughput {result['throughput_per_s']:.0f}/s < baseline {base['throughput_per_s']:.0f}/s")
+    if result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+        out.append(f"p99 {result['p99_ms']:.3f} ms > baseline {base['p99_ms']:.3f} ms")
+    if result["peak_alloc_kb"] > base["peak_alloc_kb"] * (1 + tolerance) + 64:
+        out.append(f"peak alloc {result['peak_alloc_kb']:.0f} KB > baseline {base['peak_alloc_kb']:.0f} KB")
+    return out
+
+
+def setup_app():
+    os.environ.setdefault("COSTS_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="trade-bench-"), "costs.db"))
+    sys.path.insert(0, SERVER_DIR)
+    import main
+    from fastapi.testclient import TestClient
+    return main, TestClient(main.app)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Compute engine / API benchmarks.")
+    ap.add_argument("--only", action="append", choices=sorted(CASES), help="run only these cases")
+    ap.add_argument("--repeat", type=float, default=1.0, help="scale the number of calls per case")
+    ap.add_argument("--check", action="store_true", help="fail on regression vs baselines.json")
+    ap.add_argument("--update", action="store_true", help="write results to baselines.json")
+    ap.add_argument("--tolerance", type=float, default=0.30)
+    ap.add_argument("--json", action="store_true", help="print results as JSON")
+    args = ap.parse_args(argv)
+
+    m, c = setup_app()
+    names = args.only or list(CASES)
+    results: Dict[str, Dict[str, float]] = {}
+    for name in names:
+        results[name] = r = run_case(name, m, c, args.repeat)
+        if not args.json:
+            print(f"{name:22s} {r['throughput_per_s']:>12,.0f}/s  p50 {r['p50_ms']:>9.3f} ms  "
+                  f"p99 {r['p99_ms']:>9.3f} ms  peak {r['peak_alloc_kb']:>10,.0f} KB")
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    baselines: Dict[str, Dict[str, float]] = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH, encoding="utf-8") as f:
+            baselines = json.load(f)
+    if args.update:
+        baselines.update({k: {f: round(v, 4) for f, v in r.items()} for k, r in results.items()})
+        with open(BASELINES_PATH, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baselines written to {BASELINES_PATH}")
+    if args.check:
+        failed: List[Tuple[str, str]] = []
+        for name, r in results.items():
+            if name in baselines:
+                failed += [(name, msg) for msg in regressions(r, baselines[name], args.tolerance)]
+        for name, msg in failed:
+            print(f"REGRESSION {name}: {msg}", file=sys.stderr)
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
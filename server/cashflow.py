@@ -0,0 +1,104 @@
+"""Dated cash flows and working-capital timeline for a portfolio of deals.
+
+Il blocco finance di _compute_internal e' un'approssimazione NWC statica
+(AR + INV - AP per un tasso). Qui ogni deal diventa una serie di eventi
+datati, in giorni dalla data di partenza del deal:
+
+    logistics   giorno 0: logistica + assicurazione, esclusa la parte storage
+    supplier    giorno dpo_buy_days: pagamento COGS al fornitore
+    storage     a fine di ogni mese di stoccaggio (ultimo mese pro rata)
+    receipt     giorno storage_months*30 + dso_sell_days: incasso, al netto
+                di shrinkage e quota partner
+
+La somma degli eventi e' il margine netto prima del costo finanziario. Il
+portafoglio si aggrega su una griglia giornaliera con bincount + cumsum:
+nessun loop per deal, solo per colonna di eventi (pochi, fissi).
+"""
+from typing import Dict, List, Mapping, Tuple
+import numpy as np
+
+from cost_plan import BEHAVIORS
+
+EVENT_KINDS = ("logistics", "supplier", "storage", "receipt")
+DAYS_PER_MONTH = 30.0
+MAX_DAYS = 20 * 366       # orizzonte massimo della griglia
+RESOLUTIONS = {"day": 1, "week": 7, "month": 30}
+_STORAGE_SLOTS = (BEHAVIORS.index("per_month"), BEHAVIORS.index("per_ton_per_month"))
+
+
+def deal_events(cols: Mapping[str, np.ndarray], res: Mapping[str, np.ndarray], coef_log: np.ndarray,
+                coef_ins: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(day offsets (n, K), signed amounts (n, K), kind index (K,)) for n deals.
+
+    `coef_log` / `coef_ins` are the per-row plan coefficients (n, N_SLOTS),
+    `res` the output of vector_engine.evaluate on the same rows.
+    """
+    V = cols["volume_mt"]
+    months = np.maximum(cols["storage_months"], 0.0)
+    per_month, per_ton_month = _STORAGE_SLOTS
+    coef = coef_log + coef_ins
+    storage = coef[:, per_month] * months + coef[:, per_ton_month] * V * months
+    logistics = res["logistics_excl_cogs_ins"] + res["insurance"] - storage
+    receipt = res["gross_revenue"] - res["shrinkage"] - res["partner_profit"]
+
+    n_storage = int(np.ceil(months.max())) if months.size else 0
+    k = np.arange(1, n_storage + 1, dtype=float)                      # mese k = 1..ceil(max months)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = np.clip(months[:, None] - (k - 1), 0.0, 1.0) / np.where(months > 0, months, 1.0)[:, None]
+    storage_days = DAYS_PER_MONTH * np.minimum(k, months[:, None])
+
+    days = np.column_stack([np.zeros_like(V), cols["dpo_buy_days"], storage_days,
+                            months * DAYS_PER_MONTH + cols["dso_sell_days"]])
+    amounts = np.column_stack([-logistics, -res["cogs"], -storage[:, None] * share, receipt])
+    kinds = np.array([0, 1] + [2] * n_storage + [3])
+    return np.rint(days).astype(np.int64), amounts, kinds
+
+
+def deal_funding(days: np.ndarray, amounts: np.ndarray, annual_rate_pct: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(peak funding, simple interest) per deal financed on its own, at its own rate."""
+    order = np.argsort(days, axis=1, kind="stable")
+    d = np.take_along_axis(days, order, axis=1)
+    balance = np.cumsum(np.take_along_axis(amounts, order, axis=1), axis=1)
+    need = np.maximum(0.0, -balance)
+    # il saldo dopo l'evento j vale fino all'evento j+1; dopo l'ultimo evento il deal e' chiuso
+    gaps = np.diff(d, axis=1)
+    interest = (need[:, :-1] * gaps).sum(axis=1) * annual_rate_pct / 100.0 / 365.0
+    return need.max(axis=1), interest
+
+
+def portfolio_curve(start: np.ndarray, days: np.ndarray, amounts: np.ndarray) -> Tuple[int, Dict[str, np.ndarray]]:
+    """(first day ordinal, daily inflow/outflow/balance/funding) for all deals together."""
+    absolute = start[:, None] + days
+    origin = int(absolute.min())
+    idx = (absolute - origin).ravel()
+    n_days = int(idx.max()) + 1
+    if n_days > MAX_DAYS:
+        raise ValueError(f"Timeline spans {n_days} days (max {MAX_DAYS})")
+    flat = amounts.ravel()
+    inflow = np.bincount(idx, weights=np.where(flat > 0, flat, 0.0), minlength=n_days)
+    outflow = np.bincount(idx, weights=np.where(flat < 0, -flat, 0.0), minlength=n_days)
+    balance = np.cumsum(inflow - outflow)
+    return origin, {"inflow": inflow, "outflow": outflow, "balance": balance, "funding": np.maximum(0.0, -balance)}
+
+
+def resample(curve: Mapping[str, np.ndarray], step: int) -> Dict[str, np.ndarray]:
+    """Flows summed per period; balance at period end; funding = peak within the period."""
+    if step == 1:
+        return dict(curve)
+    starts = np.arange(0, curve["balance"].size, step)
+    ends = np.minimum(starts + step, curve["balance"].size) - 1
+    return {
+        "inflow": np.add.reduceat(curve["inflow"], starts),
+        "outflow": np.add.reduceat(curve["outflow"], starts),
+        "balance": curve["balance"][ends],
+        "funding": np.maximum.reduceat(curve["funding"], starts),
+    }
+
+
+def event_totals(amounts: np.ndarray, kinds: np.ndarray) -> Dict[str, float]:
+    per_column = amounts.sum(axis=0)
+    return {name: float(per_column[kinds == i].sum()) for i, name in enumerate(EVENT_KINDS)}
+
+
+def to_lists(curve: Mapping[str, np.ndarray]) -> Dict[str, List[float]]:
+    return {k: v.tolist() for k, v in curve.items()}
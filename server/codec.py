@@ -0,0 +1,41 @@
+"""Response encoding: JSON (orjson if installed) or MessagePack.
+
+orjson e msgpack sono opzionali: senza orjson si ricade sul modulo json
+standard, senza msgpack la richiesta MessagePack risponde comunque in JSON.
+"""
+from typing import Any, Optional, Tuple
+import json
+
+try:
+    import orjson
+except ImportError:  # dipendenza opzionale
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # dipendenza opzionale
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/x-msgpack"
+MSGPACK_TYPES = ("application/x-msgpack", "application/msgpack", "application/vnd.msgpack")
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Media type to answer with for an Accept header."""
+    if msgpack is not None and accept and any(t in accept for t in MSGPACK_TYPES):
+        return MSGPACK
+    return JSON
+
+
+def encode(obj: Any, media_type: str = JSON) -> bytes:
+    if media_type == MSGPACK:
+        return msgpack.packb(obj, use_bin_type=True)
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def encode_response(obj: Any, accept: Optional[str]) -> Tuple[bytes, str]:
+    media_type = negotiate(accept)
+    return encode(obj, media_type), media_type
@@ -0,0 +1,73 @@
+"""Bounded LRU/TTL cache for /api/compute responses.
+
+La chiave e' un hash canonico dello scenario piu' la versione della tabella
+costi: add_cost/update_cost incrementano la versione, quindi le voci vecchie
+non vengono mai piu' servite (e spariscono per LRU/TTL).
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+import hashlib
+import json
+import threading
+import time
+
+
+def scenario_key(payload: Mapping[str, Any], version: Any) -> str:
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{version}:{canonical}".encode()).hexdigest()[:32]
+
+
+class ComputeCache:
+    def __init__(self, maxsize: int = 4096, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.not_modified = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._data[key]
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, body: bytes) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, body)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def note_not_modified(self) -> None:
+        with self._lock:
+            self.not_modified += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+                "evictions": self.evictions,
+                "not_modified": self.not_modified,
+            }
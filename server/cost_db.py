@@ -0,0 +1,184 @@
+"""SQLAlchemy side of the cost store: schema, migrations and writes.
+
+Importato solo alla prima scrittura (o al primo avvio su un DB vuoto): le
+letture del percorso di avvio passano da cost_store con sqlite3 puro.
+"""
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from cost_store import COST_FIELDS, ConflictError, overlaps
+from sqlalchemy import Column, Date, Float, Index, Integer, String, create_engine, event, inspect, text, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+Base = declarative_base()
+
+
+class CostRow(Base):
+    __tablename__ = "cost_catalog"
+    id = Column(Integer, primary_key=True)
+    code = Column(String, nullable=False, index=True)
+    name = Column(String, nullable=False)
+    behavior = Column(String, nullable=False)
+    unit_amount_usd = Column(Float, nullable=False)
+    unit = Column(String, nullable=False)
+    qty_source = Column(String, nullable=False)
+    dest_scope = Column(String, nullable=False, index=True)
+    category = Column(String, nullable=False)
+    effective_from = Column(Date, nullable=True)   # incluso; None = da sempre
+    effective_to = Column(Date, nullable=True)     # escluso; None = ancora valido
+    formula = Column(String, nullable=True)        # solo behavior "formula"
+
+    __table_args__ = (Index("ix_cost_catalog_code_from", "code", "effective_from"),)
+
+    def to_dict(self) -> Dict:
+        return {f: getattr(self, f) for f in COST_FIELDS}
+
+
+class MetaRow(Base):
+    __tablename__ = "cost_meta"
+    key = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False)
+
+
+class ChangeRow(Base):
+    """Codes touched by each version: `GET /api/costs?since=` builds deltas from here."""
+    __tablename__ = "cost_changes"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+    code = Column(String, nullable=False)
+
+
+CHANGE_LOG_VERSIONS = 1000   # versioni tenute nel log; oltre, il client riceve la tabella intera
+
+
+class CostDB:
+    def __init__(self, path: str):
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        event.listen(self.engine, "connect", _sqlite_pragmas)
+        self.Session = sessionmaker(bind=self.engine, autoflush=False, autocommit=False)
+
+    def init(self, seed: Callable[[], Iterable[Dict]]) -> None:
+        """Create tables and seed them if the catalogue is empty (idempotent)."""
+        Base.metadata.create_all(bind=self.engine)
+        self._add_missing_columns()
+        with self.Session.begin() as db:
+            # INSERT OR IGNORE: idempotente anche se un altro processo e' arrivato prima
+            db.execute(insert(MetaRow).values(key="version", value=0).on_conflict_do_nothing())
+            # log completo solo da qui in avanti (DB creati prima del log)
+            version = db.get(MetaRow, "version", populate_existing=True).value
+            db.execute(insert(MetaRow).values(key="changes_from", value=version).on_conflict_do_nothing())
+            if db.query(CostRow).count() == 0:
+                rows = list(seed())
+                db.add_all(CostRow(**row) for row in rows)
+                _bump(db, {r["code"] for r in rows})
+
+    def _add_missing_columns(self) -> None:
+        # migrazione minima per DB creati prima delle colonne nullable aggiunte dopo
+        have = {c["name"] for c in inspect(self.engine).get_columns(CostRow.__tablename__)}
+        with self.engine.begin() as conn:
+            for col in CostRow.__table__.columns:
+                if col.name not in have and col.nullable:
+                    conn.execute(text(f"ALTER TABLE {CostRow.__tablename__} ADD COLUMN {col.name} {col.type.compile(self.engine.dialect)}"))
+            for ix in CostRow.__table__.indexes:
+                ix.create(conn, checkfirst=True)
+
+    def insert(self, row: Dict) -> int:
+        """Add one item; ConflictError if its validity overlaps a row with the same code."""
+        with self.Session.begin() as db:
+            _check_overlap(db, row)
+            db.add(CostRow(**row))
+            return _bump(db, {row["code"]})
+
+    def update(self, code: str, row: Dict) -> Optional[int]:
+        """Update the current (open-ended, latest) item with `code`.
+
+        If `row` starts later than the current item, the current item is closed
+        at row["effective_from"] and `row` is added as a new version, so past
+        deals keep pricing at the old rate. Otherwise the item is overwritten.
+        Returns the new table version, or None if `code` does not exist;
+        ConflictError if the resulting row overlaps another row of its code.
+        """
+        with self.Session.begin() as db:
+            if not _update(db, code, row):
+                return None
+            return _bump(db, {code, row["code"]})
+
+    def apply(self, ops: Sequence[Tuple[str, str, Dict]], replace: bool = False) -> Tuple[int, Dict[str, int]]:
+        """Apply ("add" | "update" | "upsert", code, row) ops in one transaction.
+
+        With `replace` the table is emptied first. Every resulting row (adds,
+        updates and upserts, renames included) is checked for overlapping
+        validity with the other rows of its code (ConflictError), updates of
+        unknown codes raise KeyError; either way nothing is written.
+        Returns (new version, counts per op) with a single version bump.
+        """
+        counts = {"added": 0, "updated": 0}
+        touched = {c for _, code, row in ops for c in (code, row["code"])}
+        with self.Session.begin() as db:
+            if replace:
+                touched.update(c for (c,) in db.query(CostRow.code).distinct())
+                db.query(CostRow).delete()
+            for op, code, row in ops:
+                if op in ("update", "upsert") and _update(db, code, row):
+                    counts["updated"] += 1
+                elif op == "update":
+                    raise KeyError(code)
+                else:
+                    _check_overlap(db, row)
+                    db.add(CostRow(**row))
+                    db.flush()
+                    counts["added"] += 1
+            return _bump(db, touched), counts
+
+
+def _update(db, code: str, row: Dict) -> bool:
+    current = _current(db, code)
+    if current is None:
+        return False
+    starts = row.get("effective_from")
+    # la riga finale (anche rinominata su un altro codice) non deve sovrapporsi ad altre dello stesso
+    # codice; la corrente e' esclusa: o viene sovrascritta, o si chiude dove la nuova inizia
+    _check_overlap(db, row, exclude=current.id)
+    if starts is not None and (current.effective_from is None or starts > current.effective_from):
+        current.effective_to = starts
+        db.add(CostRow(**row))
+    else:
+        for k, v in row.items():
+            setattr(current, k, v)
+    db.flush()
+    return True
+
+
+def _check_overlap(db, row: Dict, exclude: Optional[int] = None) -> None:
+    for other in db.query(CostRow).filter(CostRow.code == row["code"], CostRow.id != exclude):
+        if overlaps(row.get("effective_from"), row.get("effective_to"), other.effective_from, other.effective_to):
+            raise ConflictError(f"{row['code']}: validity overlaps an existing item "
+                                f"({other.effective_from or '-inf'} .. {other.effective_to or '+inf'})")
+
+
+def _current(db, code: str) -> Optional[CostRow]:
+    rows = db.query(CostRow).filter(CostRow.code == code).order_by(CostRow.id).all()
+    if not rows:
+        return None
+    open_rows = [r for r in rows if r.effective_to is None] or rows
+    return max(open_rows, key=lambda r: (r.effective_from is not None, r.effective_from or 0, r.id))
+
+
+def _bump(db, codes: Iterable[str]) -> int:
+    """New table version, logging the codes it touched (same transaction)."""
+    db.execute(update(MetaRow).where(MetaRow.key == "version").values(value=MetaRow.value + 1))
+    version = db.get(MetaRow, "version", populate_existing=True).value
+    db.add_all(ChangeRow(version=version, code=c) for c in sorted(set(codes)))
+    oldest = version - CHANGE_LOG_VERSIONS
+    if oldest > 0:
+        db.query(ChangeRow).filter(ChangeRow.version <= oldest).delete()
+        db.execute(update(MetaRow).where(MetaRow.key == "changes_from", MetaRow.value < oldest).values(value=oldest))
+    return version
+
+
+def _sqlite_pragmas(dbapi_conn, _record) -> None:
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.close()
@@ -0,0 +1,49 @@
+"""Cost table import/export (CSV / JSON).
+
+Stesse colonne della tabella (COST_FIELDS); le date sono ISO, vuoto = None.
+La validazione dei singoli campi resta a CostItem: qui si leggono solo righe.
+"""
+from datetime import date
+from typing import Dict, Iterable, List, Mapping
+import csv
+import io
+import json
+
+from cost_store import COST_FIELDS
+
+OPTIONAL_FIELDS = ("effective_from", "effective_to", "formula")
+
+
+def to_csv(rows: Iterable[Mapping]) -> str:
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=COST_FIELDS, extrasaction="ignore")
+    w.writeheader()
+    for r in rows:
+        w.writerow({k: ("" if r.get(k) is None else r[k].isoformat() if isinstance(r[k], date) else r[k])
+                    for k in COST_FIELDS})
+    return buf.getvalue()
+
+
+def to_json(rows: Iterable[Mapping]) -> str:
+    return json.dumps([{k: (r[k].isoformat() if isinstance(r.get(k), date) else r.get(k)) for k in COST_FIELDS}
+                       for r in rows], indent=1)
+
+
+def parse(data: bytes, fmt: str) -> List[Dict]:
+    """Raw rows from a CSV or JSON (list of objects) export; ValueError on a malformed file."""
+    text = data.decode("utf-8-sig")
+    if fmt == "json":
+        rows = json.loads(text)
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise ValueError("JSON import must be a list of objects")
+    else:
+        reader = csv.DictReader(io.StringIO(text, newline=""))
+        missing = [f for f in COST_FIELDS if f not in OPTIONAL_FIELDS and f not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Missing columns: {missing}")
+        rows = [{k.strip(): v for k, v in r.items() if k} for r in reader]
+    for r in rows:
+        for f in OPTIONAL_FIELDS:
+            if r.get(f) == "":
+                r[f] = None
+    return rows
@@ -0,0 +1,268 @@
+"""Compiled per-destination cost plans.
+
+Il calcolo di /api/compute non riscandisce piu' tutta la tabella costi: ogni
+destinazione viene compilata una volta in coefficienti raggruppati per
+behavior, e il compute diventa una manciata di multiply-add.
+"""
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import bisect
+import threading
+
+from formula import Formula, compile_formula
+
+# Ordine fisso dei behavior: l'indice e' la posizione nel vettore quantita'.
+BEHAVIORS: Tuple[str, ...] = (
+    "per_ton",
+    "per_container",
+    "per_truck",
+    "per_month",
+    "per_ton_per_month",
+    "fixed_per_shipment",
+    "percent_of_value",
+    "percent_of_cogs",
+)
+BEHAVIOR_INDEX: Dict[str, int] = {b: i for i, b in enumerate(BEHAVIORS)}
+UNKNOWN_BEHAVIOR = len(BEHAVIORS)  # behavior sconosciuto: qty 0, costo 0
+FORMULA_BEHAVIOR = "formula"       # qty = formula(scenario), fuori dai coefficienti per slot (vedi formula.py)
+
+
+def matches_scope(item, dest: str) -> bool:
+    return item.dest_scope.startswith(dest)
+
+
+def is_cogs_placeholder(item) -> bool:
+    return item.category == "product" and item.code.startswith("COGS_")
+
+
+def is_active(item, start: Optional[date]) -> bool:
+    """Is `item` in force over the segment starting at `start` (None = -inf)?"""
+    eff_from = getattr(item, "effective_from", None)
+    eff_to = getattr(item, "effective_to", None)
+    if eff_from is not None and (start is None or eff_from > start):
+        return False
+    return eff_to is None or start is None or eff_to > start
+
+
+def quantity_vectors(volume_mt: float, n_cntr: int, n_trk: int, storage_months: float,
+                     revenue: float, cogs_total: float) -> Tuple[tuple, tuple]:
+    """Return (multipliers, display_qty), both indexed like BEHAVIORS (+ unknown).
+
+    The multiplier is what the unit amount is multiplied by; display_qty is the
+    `qty` shown on the breakdown line (percent behaviors report qty=1).
+    """
+    ton_month = volume_mt * storage_months
+    mult = (volume_mt, n_cntr, n_trk, storage_months, ton_month, 1, revenue, cogs_total, 0)
+    qty = (volume_mt, n_cntr, n_trk, storage_months, ton_month, 1, 1, 1, 0)
+    return mult, qty
+
+
+def formula_vars(mult: Sequence) -> Dict[str, object]:
+    """Formula variables from a multiplier vector (scalars or arrays, ordered like BEHAVIORS)."""
+    V, n_cntr, n_trk, months, ton_month, _, revenue, cogs_total = mult[:8]
+    return {"volume_mt": V, "containers": n_cntr, "trucks": n_trk, "storage_months": months,
+            "storage_days": months * 30.0, "ton_months": ton_month, "value": revenue, "cogs": cogs_total}
+
+
+class FormulaTerms:
+    """Formula lines of a plan as (unit amount, Formula) per category; picklable.
+
+    Called with formula_vars(...) it returns (logistics, insurance) totals,
+    broadcast like the variables.
+    """
+    __slots__ = ("logistics", "insurance")
+
+    def __init__(self, logistics: Sequence[Tuple[float, Formula]], insurance: Sequence[Tuple[float, Formula]]):
+        self.logistics = tuple(logistics)
+        self.insurance = tuple(insurance)
+
+    def __call__(self, q: Dict[str, object]):
+        return _terms_total(self.logistics, q), _terms_total(self.insurance, q)
+
+    def __reduce__(self):
+        return FormulaTerms, (self.logistics, self.insurance)
+
+
+def _terms_total(terms, q):
+    total = 0.0
+    for amt, f in terms:
+        total = total + amt * f(q)
+    return total
+
+
+class CostPlan:
+    """Cost table compiled for a single destination.
+
+    `logistics` / `insurance` hold, per behavior, the sum of unit amounts of the
+    in-scope items of that category; the line arrays keep table order so the
+    breakdown is identical to the old per-item loop. Items with behavior
+    "formula" stay out of the per-behavior sums: `formulas` holds their
+    compiled Formula (None for the other lines) and `terms` their totals.
+    """
+    __slots__ = ("destination", "version", "segment", "codes", "names", "categories", "units",
+                 "amounts", "behavior_idx", "formulas", "terms", "logistics", "insurance")
+
+    def __init__(self, destination: str, version: int, items: Sequence, segment: int = 0):
+        self.destination = destination
+        self.version = version
+        self.segment = segment
+        lines = [it for it in items if matches_scope(it, destination) and not is_cogs_placeholder(it)]
+        self.codes = tuple(it.code for it in lines)
+        self.names = tuple(it.name for it in lines)
+        self.categories = tuple(it.category for it in lines)
+        self.units = tuple(it.unit for it in lines)
+        self.amounts = tuple(float(it.unit_amount_usd) for it in lines)
+        self.behavior_idx = tuple(BEHAVIOR_INDEX.get(it.behavior, UNKNOWN_BEHAVIOR) for it in lines)
+        self.formulas = tuple(compile_formula(it.formula) if it.behavior == FORMULA_BEHAVIOR and getattr(it, "formula", None)
+                              else None for it in lines)
+
+        logistics = [0.0] * (len(BEHAVIORS) + 1)
+        insurance = [0.0] * (len(BEHAVIORS) + 1)
+        for cat, amt, b in zip(self.categories, self.amounts, self.behavior_idx):
+            if cat == "logistics":
+                logistics[b] += amt
+            elif cat == "insurance":
+                insurance[b] += amt
+        self.logistics = tuple(logistics)
+        self.insurance = tuple(insurance)
+        terms = {"logistics": [], "insurance": []}
+        for cat, amt, f in zip(self.categories, self.amounts, self.formulas):
+            if f is not None and cat in terms:
+                terms[cat].append((amt, f))
+        self.terms = FormulaTerms(**terms) if terms["logistics"] or terms["insurance"] else None
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def totals(self, mult: Sequence[float]) -> Tuple[float, float]:
+        """(total_logistics, total_insurance) for a multiplier vector."""
+        total_log = 0.0
+        total_ins = 0.0
+        for m, cl, ci in zip(mult, self.logistics, self.insurance):
+            if cl:
+                total_log += cl * m
+            if ci:
+                total_ins += ci * m
+        if self.terms is not None:
+            f_log, f_ins = self.terms(formula_vars(mult))
+            total_log += float(f_log)
+            total_ins += float(f_ins)
+        return total_log, total_ins
+
+    def lines(self, mult: Sequence[float], qty: Sequence[float]) -> List[dict]:
+        out = []
+        q = formula_vars(mult) if any(self.formulas) else None
+        for code, name, cat, unit, amt, b, f in zip(self.codes, self.names, self.categories,
+                                                    self.units, self.amounts, self.behavior_idx, self.formulas):
+            if f is not None:
+                fq = float(f(q))
+                out.append({"code": code, "name": name, "category": cat,
+                            "qty": fq, "unit": unit, "unit_amount_usd": amt, "cost_usd": amt * fq})
+                continue
+            out.append({
+                "code": code, "name": name, "category": cat,
+                "qty": qty[b], "unit": unit, "unit_amount_usd": amt,
+                "cost_usd": amt * mult[b]
+            })
+        return out
+
+
+class _Generation:
+    """Items of one table version plus the plans compiled from them (never mutated but for the LRU)."""
+    __slots__ = ("version", "items", "breakpoints", "plans")
+
+    def __init__(self, version: int, items: Sequence):
+        self.version = version
+        self.items = tuple(items)
+        dates = set()
+        for it in self.items:
+            for d in (getattr(it, "effective_from", None), getattr(it, "effective_to", None)):
+                if d is not None:
+                    dates.add(d)
+        self.breakpoints: Tuple[date, ...] = tuple(sorted(dates))
+        self.plans: "OrderedDict[Tuple[int, str], CostPlan]" = OrderedDict()
+
+
+class PlanRegistry:
+    """Lazily compiles and caches CostPlans per (validity segment, destination).
+
+    Items may carry effective_from (inclusive) / effective_to (exclusive)
+    dates. All distinct dates of the table form a sorted breakpoint list; a
+    segment is the interval between two breakpoints, over which the set of
+    active items is constant. An as-of date is resolved to its segment with a
+    bisect, so historical pricing costs the same as current pricing. Compiled
+    plans are immutable and kept in a bounded LRU.
+
+    `invalidate()` must be called whenever the underlying table is mutated: it
+    takes a copy of the source items and swaps in a new generation (version,
+    items, breakpoints, plans) with a single reference assignment, so a
+    compute that already holds a plan, or is compiling one, never sees a
+    half-updated table.
+    """
+
+    def __init__(self, source: Callable[[], Iterable], max_plans: int = 256):
+        self._source = source
+        self._lock = threading.Lock()
+        self._gen: Optional[_Generation] = None
+        self.max_plans = max_plans
+
+    def _current(self) -> _Generation:
+        gen = self._gen
+        if gen is None:
+            with self._lock:
+                if self._gen is None:
+                    self._gen = _Generation(0, self._source())
+                gen = self._gen
+        return gen
+
+    @property
+    def version(self) -> int:
+        return self._current().version
+
+    @property
+    def breakpoints(self) -> Tuple[date, ...]:
+        return self._current().breakpoints
+
+    def segment(self, as_of: Optional[date] = None) -> int:
+        return bisect.bisect_right(self._current().breakpoints, as_of or date.today())
+
+    def segment_start(self, as_of: Optional[date] = None) -> Optional[date]:
+        """First day of the segment `as_of` (default today) falls in; None for the open-ended first one."""
+        bps = self._current().breakpoints
+        i = bisect.bisect_right(bps, as_of or date.today())
+        return bps[i - 1] if i else None
+
+    def items(self, segment: int, gen: Optional[_Generation] = None) -> List:
+        """Items in force over `segment`, in table order."""
+        gen = gen or self._current()
+        bps = gen.breakpoints
+        start = bps[segment - 1] if segment > 0 else None
+        return [it for it in gen.items if is_active(it, start)]
+
+    def get(self, destination: str, as_of: Optional[date] = None, segment: Optional[int] = None) -> CostPlan:
+        gen = self._current()
+        if segment is None:
+            segment = bisect.bisect_right(gen.breakpoints, as_of or date.today())
+        key = (segment, destination)
+        with self._lock:
+            plan = gen.plans.get(key)
+            if plan is not None:
+                gen.plans.move_to_end(key)
+                return plan
+        # compilato fuori dal lock: non blocca chi usa piani gia' pronti
+        plan = CostPlan(destination, gen.version, self.items(segment, gen), segment)
+        with self._lock:
+            plan = gen.plans.setdefault(key, plan)
+            while len(gen.plans) > self.max_plans:
+                gen.plans.popitem(last=False)
+        return plan
+
+    def __len__(self) -> int:
+        return len(self._current().plans)
+
+    def invalidate(self, version: Optional[int] = None) -> int:
+        with self._lock:
+            old = self._gen.version if self._gen is not None else 0
+            self._gen = _Generation(old + 1 if version is None else version, self._source())
+            return self._gen.version
@@ -0,0 +1,319 @@
+"""Durable SQLite cost store (WAL) with an in-process read-through snapshot.
+
+La tabella costi vive in `cost_catalog` (var/costs.db, o COSTS_DB_PATH); ogni
+scrittura incrementa nella stessa transazione la riga `version` di
+`cost_meta`. Le istanze leggono solo quella riga per capire se lo snapshot
+in memoria e' ancora valido: il compute non tocca mai il disco.
+
+Le letture (version, load) usano sqlite3 della stdlib, cosi' l'avvio non
+importa SQLAlchemy; schema, migrazioni e scritture stanno in cost_db e
+vengono importati alla prima scrittura o su un DB ancora da creare.
+"""
+from contextlib import closing, contextmanager
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo processo in sviluppo, niente lock
+    fcntl = None
+
+from starlette.concurrency import run_in_threadpool
+
+COST_FIELDS = ("code", "name", "behavior", "unit_amount_usd", "unit", "qty_source", "dest_scope", "category",
+               "effective_from", "effective_to", "formula")
+DATE_FIELDS = ("effective_from", "effective_to")
+REQUIRED_INDEXES = ("ix_cost_catalog_code_from",)
+
+
+class ConflictError(ValueError):
+    """A write would create two rows of the same code valid on the same day."""
+
+
+def overlaps(a_from: Optional[date], a_to: Optional[date], b_from: Optional[date], b_to: Optional[date]) -> bool:
+    # intervalli [from, to) con None = illimitato
+    return (a_to is None or b_from is None or b_from < a_to) and (b_to is None or a_from is None or a_from < b_to)
+
+
+class CostStore:
+    """`template`: DB di partenza copiato (in sola lettura) in `path` se questo non esiste ancora.
+
+    Il file versionato (server/data.db, tabelle legacy cost_items / sell_prices /
+    app_params) non viene mai aperto in scrittura: schema nuovo e WAL stanno
+    solo nella copia di runtime.
+    """
+
+    def __init__(self, path: str, template: Optional[str] = None):
+        self.path = path
+        self.template = template
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            from cost_db import CostDB  # SQLAlchemy: solo per scritture e migrazioni
+            self._db = CostDB(self.path)
+        return self._db
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def init(self, seed: Callable[[], Iterable[Dict]]) -> None:
+        """Create tables and seed them if the catalogue is empty (idempotent).
+
+        Safe with several processes booting at once on a new path (uvicorn
+        --workers N): copy, schema and seed happen under an exclusive file lock,
+        and whoever gets it second re-checks and finds nothing to do.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with init_lock(self.path):
+            if not os.path.exists(self.path) and self.template and os.path.exists(self.template):
+                copy_readonly(self.template, self.path)
+            if self._needs_init():
+                self.db.init(seed)
+
+    def _needs_init(self) -> bool:
+        if not os.path.exists(self.path):
+            return True
+        with closing(self._connect()) as conn:
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(cost_catalog)")}
+            if not set(COST_FIELDS) <= cols:
+                return True
+            indexes = {r[1] for r in conn.execute("PRAGMA index_list(cost_catalog)")}
+            if not set(REQUIRED_INDEXES) <= indexes:
+                return True
+            try:
+                meta = {r[0] for r in conn.execute("SELECT key FROM cost_meta")}
+                conn.execute("SELECT 1 FROM cost_changes LIMIT 1")
+            except sqlite3.OperationalError:
+                return True
+            return not {"version", "changes_from"} <= meta or \
+                conn.execute("SELECT 1 FROM cost_catalog LIMIT 1").fetchone() is None
+
+    def version(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT value FROM cost_meta WHERE key = 'version'").fetchone()[0]
+
+    def load(self) -> Tuple[int, List[Dict]]:
+        """(version, rows) read in one transaction, rows in table order."""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN")
+            version = conn.execute("SELECT value FROM cost_meta WHERE key = 'version'").fetchone()[0]
+            rows = [_row(r) for r in conn.execute(f"SELECT {', '.join(COST_FIELDS)} FROM cost_catalog ORDER BY id")]
+            conn.execute("COMMIT")
+            return version, rows
+
+    def changed_codes(self, since: int, upto: int) -> Optional[List[str]]:
+        """Codes touched by versions in (since, upto]; None if the change log doesn't go back to `since`."""
+        with closing(self._connect()) as conn:
+            changes_from = conn.execute("SELECT value FROM cost_meta WHERE key = 'changes_from'").fetchone()
+            if changes_from is None or since < changes_from[0]:
+                return None
+            return [r[0] for r in conn.execute(
+                "SELECT DISTINCT code FROM cost_changes WHERE version > ? AND version <= ? ORDER BY code", (since, upto))]
+
+    def insert(self, row: Dict) -> int:
+        return self.db.insert(row)
+
+    def update(self, code: str, row: Dict) -> Optional[int]:
+        """See CostDB.update: supersedes or overwrites the current item; None if unknown."""
+        return self.db.update(code, row)
+
+    def apply(self, ops: Sequence[Tuple[str, str, Dict]], replace: bool = False) -> Tuple[int, Dict[str, int]]:
+        """See CostDB.apply: all ops in one transaction and one version bump."""
+        return self.db.apply(ops, replace)
+
+
+@contextmanager
+def init_lock(path: str):
+    """Exclusive lock (`path`.lock) around create / migrate / seed of the SQLite file `path`."""
+    with open(f"{path}.lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def copy_readonly(src: str, dst: str) -> None:
+    """Consistent copy of SQLite file `src` into `dst`, opening `src` read-only."""
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    with closing(sqlite3.connect(f"file:{os.path.abspath(src)}?mode=ro", uri=True)) as source, \
+            closing(sqlite3.connect(tmp)) as target:
+        source.backup(target)
+    os.replace(tmp, dst)
+
+
+def _row(values: Sequence) -> Dict:
+    row = dict(zip(COST_FIELDS, values))
+    for f in DATE_FIELDS:
+        if row[f] is not None:
+            row[f] = date.fromisoformat(row[f])
+    return row
+
+
+# ------------ Precompiled snapshot file ------------
+def write_snapshot(path: str, version: int, rows: Sequence[Dict]) -> None:
+    data = {"version": version,
+            "rows": [{k: (v.isoformat() if isinstance(v, date) else v) for k, v in r.items()} for r in rows]}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def read_snapshot(path: str) -> Optional[Tuple[int, List[Dict]]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    rows = data["rows"]
+    for r in rows:
+        for f in DATE_FIELDS:
+            if r.get(f) is not None:
+                r[f] = date.fromisoformat(r[f])
+    return data["version"], rows
+
+
+class CostSnapshot:
+    """In-process snapshot of the store, refreshed only when `version` moves.
+
+    `maybe_refresh()` looks at the version row at most once every
+    `refresh_interval` seconds; `on_change(version)` runs after each reload.
+    With `start_polling()` a daemon thread does the version check in the
+    background, so requests never wait on a reload; `ensure(version)` is the
+    synchronous path for a client that already saw a newer version on
+    another replica.
+    """
+
+    def __init__(self, store: CostStore, make_item: Callable[[Dict], object],
+                 on_change: Callable[[int], None], refresh_interval: float = 2.0):
+        self.store = store
+        self.make_item = make_item
+        self.on_change = on_change
+        self.refresh_interval = refresh_interval
+        self.items: Sequence = ()
+        self.version = -1
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._poller: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def reload(self) -> int:
+        with self._lock:
+            version, rows = self.store.load()
+            self._install(version, rows)
+            return self.version
+
+    def current(self) -> Tuple[int, Sequence]:
+        """(version, items) of the same reload, for work that outlives the request."""
+        with self._lock:
+            return self.version, self.items
+
+    def load_file(self, path: str) -> bool:
+        """Install a precompiled snapshot file if it matches the store version.
+
+        Only the version row is read from the database; returns False (and
+        leaves the snapshot untouched) when the file is missing or stale.
+        """
+        snap = read_snapshot(path)
+        if snap is None or snap[0] != self.store.version():
+            return False
+        with self._lock:
+            self._install(*snap)
+        return True
+
+    def _install(self, version: int, rows: Sequence[Dict]) -> None:
+        if version != self.version:
+            self.items = tuple(self.make_item(r) for r in rows)
+            self.version = version
+            self.on_change(version)
+        self._checked = time.monotonic()
+
+    @property
+    def refresh_due(self) -> bool:
+        return time.monotonic() - self._checked >= self.refresh_interval
+
+    def maybe_refresh(self) -> bool:
+        if not self.refresh_due:
+            return False
+        return self.check()
+
+    def check(self) -> bool:
+        """Reload now if the store version moved; True if it did."""
+        self._checked = time.monotonic()
+        if self.store.version() == self.version:
+            return False
+        self.reload()
+        return True
+
+    def ensure(self, version: int) -> bool:
+        """Make sure the snapshot is at least at `version` (read-your-writes across replicas)."""
+        return version > self.version and self.check()
+
+    @property
+    def polling(self) -> bool:
+        return self._poller is not None and self._poller.is_alive()
+
+    def start_polling(self, interval: float) -> None:
+        if self.polling or interval <= 0:
+            return
+        self._stop.clear()
+        self._poller = threading.Thread(target=self._poll, args=(interval,), name="cost-snapshot-poller", daemon=True)
+        self._poller.start()
+
+    def stop_polling(self) -> None:
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join(timeout=5)
+            self._poller = None
+
+    def _poll(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.check()
+            except Exception:  # DB momentaneamente non leggibile: si riprova al giro dopo
+                logging.getLogger(__name__).exception("cost snapshot refresh failed")
+
+
+class VersionHeaderMiddleware:
+    """ASGI middleware: `X-Cost-Version` on every HTTP response.
+
+    A request carrying `X-Cost-Version: N` (e.g. the version returned by the
+    replica that handled a PUT) first brings this replica's snapshot to N;
+    the SQLite read / reload runs in the threadpool, never on the event loop.
+    """
+    HEADER = b"x-cost-version"
+
+    def __init__(self, app, snapshot: CostSnapshot):
+        self.app = app
+        self.snapshot = snapshot
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        for k, v in scope.get("headers", ()):
+            if k == self.HEADER and v.isdigit():
+                if int(v) > self.snapshot.version:
+                    await run_in_threadpool(self.snapshot.ensure, int(v))
+                break
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((self.HEADER, str(self.snapshot.version).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
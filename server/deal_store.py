@@ -0,0 +1,385 @@
+"""Saved deals with materialized KPIs and incremental repricing.
+
+Ogni deal salva lo ScenarioIn (JSON) e, in colonne indicizzate, i KPI e i
+totali dell'ultimo pricing: le query per destinazione, fascia di margine o
+data leggono solo queste colonne, non ricalcolano niente.
+
+`deal_deps(code, deal)` e' l'indice inverso codice costo -> deal: i codici
+delle righe del piano con cui il deal e' stato prezzato. Quando la tabella
+costi cambia si confrontano le righe vecchie e nuove: vanno riprezzati i deal
+aperti che dipendevano da un codice cambiato (via deal_deps) piu' quelli la
+cui destinazione rientra nel dest_scope di una riga nuova o modificata.
+Tutto il resto (es. LUB/KOL per una tariffa KIN) non viene toccato.
+
+I deal senza as_of sono prezzati al segmento di validita' di oggi: `priced_on`
+salva il giorno da cui e' stato risolto il segmento (NULL per i deal con as_of,
+il cui segmento non cambia). Quando un effective_from futuro diventa corrente
+la versione costi non cambia, quindi il repricer controlla anche l'inizio del
+segmento di oggi (a ogni giro e almeno a mezzanotte): i deal con priced_on
+precedente sono prezzati in un segmento ormai passato e vengono riprezzati.
+
+Lo store usa sqlite3 della stdlib (stesso file della tabella costi, WAL) e
+una riga `priced_version` in `deal_meta`: con piu' repliche la prima che la
+avanza fa il repricing, le altre lo saltano.
+"""
+from collections import defaultdict
+from contextlib import closing
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from cost_store import COST_FIELDS, init_lock
+from vector_engine import KPI_FIELDS, TOTAL_FIELDS
+
+PRICED_FIELDS = KPI_FIELDS + TOTAL_FIELDS
+ORDER_FIELDS = ("id", "deal_date", "destination") + PRICED_FIELDS
+MAX_PARAMS = 500   # parametri per IN (...): sotto il limite di SQLite
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS deals (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    destination TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'open',
+    deal_date TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    cost_version INTEGER,
+    stale INTEGER NOT NULL DEFAULT 1,
+    priced_at REAL,
+    priced_on TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    {", ".join(f"{f} REAL" for f in PRICED_FIELDS)}
+);
+CREATE INDEX IF NOT EXISTS ix_deals_dest_status_date ON deals (destination, status, deal_date);
+CREATE INDEX IF NOT EXISTS ix_deals_date ON deals (deal_date);
+CREATE INDEX IF NOT EXISTS ix_deals_margin_pct ON deals (net_margin_pct);
+CREATE INDEX IF NOT EXISTS ix_deals_stale ON deals (stale) WHERE stale = 1;
+CREATE TABLE IF NOT EXISTS deal_deps (
+    code TEXT NOT NULL,
+    deal INTEGER NOT NULL,
+    PRIMARY KEY (code, deal)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_deal_deps_deal ON deal_deps (deal);
+CREATE TABLE IF NOT EXISTS deal_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO deal_meta (key, value) VALUES ('priced_version', -1);
+"""
+
+# pricing di un gruppo di deal:
+# (cost_version, {campo: [valori]}, [codici del piano per deal], [priced_on per deal, None se ha as_of])
+Pricing = Tuple[int, Dict[str, List[float]], List[Sequence[str]], List[Optional[str]]]
+
+
+def _chunks(values: Sequence, n: int = MAX_PARAMS) -> Iterable[Sequence]:
+    for i in range(0, len(values), n):
+        yield values[i:i + n]
+
+
+class DealStore:
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init(self) -> None:
+        with init_lock(self.path), closing(self._connect()) as conn:   # piu' worker all'avvio: uno alla volta
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            if "priced_on" not in {r[1] for r in conn.execute("PRAGMA table_info(deals)")}:
+                # DB creati prima di priced_on: i deal senza as_of erano prezzati al giorno del pricing
+                conn.execute("ALTER TABLE deals ADD COLUMN priced_on TEXT")
+                conn.execute("UPDATE deals SET priced_on = date(priced_at, 'unixepoch', 'localtime') "
+                             "WHERE priced_at IS NOT NULL AND json_extract(scenario, '$.as_of') IS NULL")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_deals_priced_on ON deals (priced_on) "
+                         "WHERE priced_on IS NOT NULL")
+
+    # ------------ Writes ------------
+    def add(self, deals: Sequence[Mapping], pricing: Pricing) -> List[int]:
+        """Insert deals ({name, status, deal_date, scenario}) with their pricing; returns the ids."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            ids = []
+            for d in deals:
+                cur = conn.execute(
+                    "INSERT INTO deals (name, destination, status, deal_date, scenario, created, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (d.get("name"), d["scenario"]["destination"], d.get("status") or "open",
+                     d["deal_date"], json.dumps(d["scenario"]), now, now))
+                ids.append(cur.lastrowid)
+            self._write_prices(conn, ids, pricing)
+            conn.execute("COMMIT")
+        return ids
+
+    def update(self, deal_id: int, deal: Mapping, pricing: Pricing) -> bool:
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute(
+                "UPDATE deals SET name = ?, destination = ?, status = ?, deal_date = ?, scenario = ?, updated = ? "
+                "WHERE id = ?",
+                (deal.get("name"), deal["scenario"]["destination"], deal.get("status") or "open", deal["deal_date"],
+                 json.dumps(deal["scenario"]), time.time(), deal_id))
+            if cur.rowcount:
+                self._write_prices(conn, [deal_id], pricing)
+            conn.execute("COMMIT")
+            return cur.rowcount > 0
+
+    def delete(self, deal_id: int) -> bool:
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute("DELETE FROM deals WHERE id = ?", (deal_id,))
+            conn.execute("DELETE FROM deal_deps WHERE deal = ?", (deal_id,))
+            conn.execute("COMMIT")
+            return cur.rowcount > 0
+
+    def write_prices(self, ids: Sequence[int], pricing: Pricing) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._write_prices(conn, ids, pricing)
+            conn.execute("COMMIT")
+
+    def _write_prices(self, conn: sqlite3.Connection, ids: Sequence[int], pricing: Pricing) -> None:
+        version, values, codes, priced_on = pricing
+        now = time.time()
+        sets = ", ".join(f"{f} = ?" for f in PRICED_FIELDS)
+        # un repricing piu' vecchio non sovrascrive uno piu' nuovo (repliche / save concorrenti)
+        conn.executemany(
+            f"UPDATE deals SET {sets}, cost_version = ?, stale = 0, priced_at = ?, priced_on = ? "
+            f"WHERE id = ? AND (cost_version IS NULL OR cost_version <= ?)",
+            [tuple(values[f][i] for f in PRICED_FIELDS) + (version, now, priced_on[i], deal_id, version)
+             for i, deal_id in enumerate(ids)])
+        for chunk in _chunks(list(ids)):
+            conn.execute(f"DELETE FROM deal_deps WHERE deal IN ({', '.join('?' * len(chunk))})", chunk)
+        conn.executemany("INSERT OR IGNORE INTO deal_deps (code, deal) VALUES (?, ?)",
+                         [(c, deal_id) for deal_id, deal_codes in zip(ids, codes) for c in deal_codes])
+
+    # ------------ Reads ------------
+    def get(self, deal_id: int) -> Optional[Dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM deals WHERE id = ?", (deal_id,)).fetchone()
+            return _deal(row) if row is not None else None
+
+    def query(self, destination: Optional[str] = None, status: Optional[str] = None,
+              min_margin_pct: Optional[float] = None, max_margin_pct: Optional[float] = None,
+              date_from: Optional[date] = None, date_to: Optional[date] = None, stale: Optional[bool] = None,
+              order: str = "deal_date", desc: bool = True, limit: int = 100, offset: int = 0) -> Tuple[int, List[Dict]]:
+        """(matching count, page of deals); filters map onto the deals indexes."""
+        if order not in ORDER_FIELDS:
+            raise ValueError(f"order must be one of {list(ORDER_FIELDS)}")
+        where, params = [], []
+        for clause, value in (("destination = ?", destination), ("status = ?", status),
+                              ("net_margin_pct >= ?", min_margin_pct), ("net_margin_pct <= ?", max_margin_pct),
+                              ("deal_date >= ?", date_from and date_from.isoformat()),
+                              ("deal_date <= ?", date_to and date_to.isoformat()),
+                              ("stale = ?", None if stale is None else int(stale))):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        sql_where = f" WHERE {' AND '.join(where)}" if where else ""
+        with closing(self._connect()) as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM deals{sql_where}", params).fetchone()[0]
+            rows = conn.execute(f"SELECT * FROM deals{sql_where} ORDER BY {order} {'DESC' if desc else 'ASC'}, id "
+                                f"LIMIT ? OFFSET ?", params + [limit, offset]).fetchall()
+        return total, [_deal(r) for r in rows]
+
+    def scenarios(self, ids: Sequence[int]) -> List[Tuple[int, Dict]]:
+        out = []
+        with closing(self._connect()) as conn:
+            for chunk in _chunks(list(ids)):
+                out += [(r[0], json.loads(r[1])) for r in conn.execute(
+                    f"SELECT id, scenario FROM deals WHERE id IN ({', '.join('?' * len(chunk))})", chunk)]
+        return out
+
+    def affected(self, codes: Set[str], scopes: Set[str]) -> List[int]:
+        """Open deals that depend on one of `codes` or whose destination matches one of `scopes`."""
+        with closing(self._connect()) as conn:
+            ids: Set[int] = set()
+            for chunk in _chunks(sorted(codes)):
+                ids.update(r[0] for r in conn.execute(
+                    f"SELECT DISTINCT d.deal FROM deal_deps d JOIN deals ON deals.id = d.deal "
+                    f"WHERE d.code IN ({', '.join('?' * len(chunk))}) AND deals.status = 'open'", chunk))
+            dests = [r[0] for r in conn.execute("SELECT DISTINCT destination FROM deals")]
+            hit = [d for d in dests if any(s.startswith(d) for s in scopes)]   # stessa regola di matches_scope
+            for chunk in _chunks(hit):
+                ids.update(r[0] for r in conn.execute(
+                    f"SELECT id FROM deals WHERE destination IN ({', '.join('?' * len(chunk))}) AND status = 'open'",
+                    chunk))
+            return sorted(ids)
+
+    def open_scenarios(self) -> List[Tuple[int, str, Dict]]:
+        """(id, deal_date, scenario) of every open deal."""
+        with closing(self._connect()) as conn:
+            return [(r[0], r[1], json.loads(r[2])) for r in conn.execute(
+                "SELECT id, deal_date, scenario FROM deals WHERE status = 'open' ORDER BY id")]
+
+    def open_ids(self, below_version: int) -> List[int]:
+        with closing(self._connect()) as conn:
+            return [r[0] for r in conn.execute(
+                "SELECT id FROM deals WHERE status = 'open' AND (cost_version IS NULL OR cost_version < ?)",
+                (below_version,))]
+
+    def mark_segment_stale(self, start: Optional[date]) -> int:
+        """Mark stale the open deals without as_of priced before `start` (today's segment start)."""
+        if start is None:
+            return 0
+        with closing(self._connect()) as conn:
+            return conn.execute("UPDATE deals SET stale = 1 WHERE priced_on < ? AND status = 'open' AND stale = 0",
+                                (start.isoformat(),)).rowcount
+
+    def stale_ids(self) -> List[int]:
+        with closing(self._connect()) as conn:
+            return [r[0] for r in conn.execute("SELECT id FROM deals WHERE stale = 1 ORDER BY id")]
+
+    def priced_version(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT value FROM deal_meta WHERE key = 'priced_version'").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT COUNT(*), COALESCE(SUM(status = 'open'), 0), COALESCE(SUM(stale), 0) "
+                               "FROM deals").fetchone()
+            return {"deals": row[0], "open": row[1], "stale": row[2]}
+
+    # ------------ Repricing claim ------------
+    def claim(self, version: int, ids_for: Callable[[int], Sequence[int]]) -> Optional[int]:
+        """Advance priced_version to `version` and mark `ids_for(previous)` stale, atomically.
+
+        Returns the previous priced_version, or None when another process
+        already got there (nothing to do here).
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            prev = conn.execute("SELECT value FROM deal_meta WHERE key = 'priced_version'").fetchone()[0]
+            if prev >= version:
+                conn.execute("ROLLBACK")
+                return None
+            ids = list(ids_for(prev))
+            for chunk in _chunks(ids):
+                conn.execute(f"UPDATE deals SET stale = 1 WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            conn.execute("UPDATE deal_meta SET value = ? WHERE key = 'priced_version'", (version,))
+            conn.execute("COMMIT")
+            return prev
+
+
+def _deal(row: sqlite3.Row) -> Dict:
+    return {
+        "id": row["id"], "name": row["name"], "destination": row["destination"], "status": row["status"],
+        "deal_date": row["deal_date"], "scenario": json.loads(row["scenario"]),
+        "cost_version": row["cost_version"], "stale": bool(row["stale"]), "priced_at": row["priced_at"],
+        "priced_on": row["priced_on"],
+        "kpis": {f: row[f] for f in KPI_FIELDS},
+        "totals": {f: row[f] for f in TOTAL_FIELDS},
+    }
+
+
+def changed_codes(old_items: Sequence, new_items: Sequence) -> Tuple[Set[str], Set[str]]:
+    """(codes whose rows differ, dest_scopes of the rows that are new or changed)."""
+    def rows(items):
+        out = defaultdict(set)
+        for it in items:
+            out[it.code].add(tuple(getattr(it, f) for f in COST_FIELDS))
+        return out
+
+    old, new = rows(old_items), rows(new_items)
+    codes = {c for c in old.keys() | new.keys() if old.get(c) != new.get(c)}
+    scope = COST_FIELDS.index("dest_scope")
+    scopes = {r[scope] for c in codes for r in new.get(c, set()) - old.get(c, set())}
+    return codes, scopes
+
+
+def _seconds_to_midnight() -> float:
+    now = datetime.now()
+    return (datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds() + 1
+
+
+class DealRepricer:
+    """Background thread keeping the saved deals priced at the current cost version.
+
+    `wake()` is cheap and can be called from the cost snapshot's on_change;
+    the thread then diffs the previous and current cost rows, claims the new
+    version in the store and reprices the affected open deals in chunks.
+    It also wakes at midnight: `segment_start()` (start of today's validity
+    segment) may have moved past the day undated deals were priced on.
+    """
+
+    def __init__(self, store: DealStore, current: Callable[[], Tuple[int, Sequence]],
+                 price: Callable[[List[Dict]], Pricing], segment_start: Callable[[], Optional[date]] = lambda: None,
+                 chunk_rows: int = 20_000):
+        self.store = store
+        self.current = current
+        self.price = price
+        self.segment_start = segment_start
+        self.chunk_rows = chunk_rows
+        self._seen: Optional[Tuple[int, Sequence]] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._wake.set()   # al primo giro: deal rimasti stale o versioni mai prezzate
+        self._thread = threading.Thread(target=self._run, name="deal-repricer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(_seconds_to_midnight())
+            if self._stop.is_set():
+                return
+            self._wake.clear()
+            try:
+                self.sync()
+            except Exception:  # DB occupato o simili: i deal restano stale e si riprova al prossimo giro
+                logging.getLogger(__name__).exception("deal repricing failed")
+
+    def sync(self) -> int:
+        """Reprice what the last cost change or segment rollover touched; returns the number of deals repriced."""
+        with self._lock:
+            version, items = self.current()
+            seen = self._seen
+            self._seen = (version, items)
+
+            def ids_for(prev: int) -> Sequence[int]:
+                if seen is not None and prev == seen[0]:
+                    return self.store.affected(*changed_codes(seen[1], items))
+                # cambi che questo processo non ha visto: si riprezzano tutti i deal aperti non aggiornati
+                return self.store.open_ids(version)
+
+            claimed = self.store.claim(version, ids_for)
+            rolled = self.store.mark_segment_stale(self.segment_start())
+            if claimed is None and seen is not None and not rolled:
+                return 0   # ci ha gia' pensato un'altra replica
+            return self.reprice(self.store.stale_ids())
+
+    def reprice(self, ids: Sequence[int]) -> int:
+        for chunk in _chunks(list(ids), self.chunk_rows):
+            rows = self.store.scenarios(chunk)
+            if rows:
+                self.store.write_prices([r[0] for r in rows], self.price([r[1] for r in rows]))
+            if self._stop.is_set():
+                break
+        return len(ids)
@@ -0,0 +1,229 @@
+"""Cost formulas: a small, safe expression language over scenario quantities.
+
+Un costo con behavior "formula" ha come quantita' il valore della formula
+(costo = unit_amount_usd * formula), es. franchigia di 14 giorni sulla sosta:
+
+    containers * max(0, storage_days - 14)
+
+Il testo viene parsato con `ast`, controllato contro una whitelist (numeri,
+variabili di VARIABLES, + - * / // % **, confronti, and/or/not, `a if c else
+b`, funzioni di FUNCTIONS) e compilato in una lambda NumPy: funziona sia su
+scalari sia su array, quindi batch, sweep e Monte Carlo la valutano una volta
+per blocco di righe. La compilazione e' in cache per testo: una formula si
+compila una volta per processo, non per richiesta.
+"""
+from functools import lru_cache
+from typing import Dict, Mapping, Tuple
+import ast
+
+import numpy as np
+
+VARIABLES: Tuple[str, ...] = (
+    "volume_mt",
+    "containers",
+    "trucks",
+    "storage_months",
+    "storage_days",      # storage_months * 30, come nel finance NWC
+    "ton_months",        # volume_mt * storage_months
+    "value",             # ricavo (volume * prezzo di vendita)
+    "cogs",              # volume * prezzo di acquisto
+)
+MAX_LENGTH = 500
+MAX_NODES = 200
+
+
+def _min(*args):
+    out = args[0]
+    for a in args[1:]:
+        out = np.minimum(out, a)
+    return out
+
+
+def _max(*args):
+    out = args[0]
+    for a in args[1:]:
+        out = np.maximum(out, a)
+    return out
+
+
+# nome -> (funzione, numero minimo di argomenti, massimo o None)
+FUNCTIONS: Dict[str, tuple] = {
+    "min": (_min, 1, None),
+    "max": (_max, 1, None),
+    "clip": (np.clip, 3, 3),
+    "ceil": (np.ceil, 1, 1),
+    "floor": (np.floor, 1, 1),
+    "abs": (np.abs, 1, 1),
+    "round": (np.round, 1, 1),
+}
+
+_BINOPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+_CMPOPS = (ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+_ENV = {"__builtins__": {}, "_where": np.where, "_and": np.logical_and, "_or": np.logical_or,
+        "_not": np.logical_not, **{f"_f_{name}": fn for name, (fn, _, _) in FUNCTIONS.items()}}
+
+
+class FormulaError(ValueError):
+    """The formula text is not valid in the cost formula language."""
+
+
+class _Check(ast.NodeVisitor):
+    def generic_visit(self, node):
+        raise FormulaError(f"{type(node).__name__} is not allowed in a cost formula")
+
+    def _children(self, node):
+        for child in ast.iter_child_nodes(node):
+            if not isinstance(child, (ast.operator, ast.unaryop, ast.cmpop, ast.boolop, ast.expr_context)):
+                self.visit(child)
+
+    def visit_Expression(self, node):
+        self.visit(node.body)
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise FormulaError(f"Only numbers are allowed, got {node.value!r}")
+
+    def visit_Name(self, node):
+        if node.id not in VARIABLES:
+            raise FormulaError(f"Unknown variable '{node.id}'; allowed: {', '.join(VARIABLES)}")
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, _BINOPS):
+            raise FormulaError(f"Operator {type(node.op).__name__} is not allowed")
+        self._children(node)
+
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, (ast.UAdd, ast.USub, ast.Not)):
+            raise FormulaError(f"Operator {type(node.op).__name__} is not allowed")
+        self._children(node)
+
+    def visit_Compare(self, node):
+        if not all(isinstance(op, _CMPOPS) for op in node.ops):
+            raise FormulaError("Only < <= > >= == != comparisons are allowed")
+        self._children(node)
+
+    def visit_BoolOp(self, node):
+        self._children(node)
+
+    def visit_IfExp(self, node):
+        self._children(node)
+
+    def visit_Call(self, node):
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        if name not in FUNCTIONS:
+            raise FormulaError(f"Unknown function '{ast.unparse(node.func)}'; allowed: {', '.join(FUNCTIONS)}")
+        if node.keywords:
+            raise FormulaError(f"{name}() takes no keyword arguments")
+        _, lo, hi = FUNCTIONS[name]
+        if len(node.args) < lo or (hi is not None and len(node.args) > hi):
+            raise FormulaError(f"{name}() takes {lo if hi == lo else f'at least {lo}'} argument(s)")
+        for a in node.args:
+            self.visit(a)
+
+
+class _Vectorize(ast.NodeTransformer):
+    """Rewrite the checked tree so that it only uses element-wise NumPy operations."""
+
+    def visit_Constant(self, node):
+        # float: niente aritmetica intera a precisione arbitraria (10 ** 10 ** 10)
+        return ast.copy_location(ast.Constant(value=float(node.value)), node)
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        node.func = ast.Name(id=f"_f_{node.func.id}", ctx=ast.Load())
+        return node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return ast.Call(func=ast.Name(id="_where", ctx=ast.Load()), args=[node.test, node.body, node.orelse], keywords=[])
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        fn = "_and" if isinstance(node.op, ast.And) else "_or"
+        out = node.values[0]
+        for v in node.values[1:]:
+            out = ast.Call(func=ast.Name(id=fn, ctx=ast.Load()), args=[out, v], keywords=[])
+        return out
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.Call(func=ast.Name(id="_not", ctx=ast.Load()), args=[node.operand], keywords=[])
+        return node
+
+    def visit_Compare(self, node):
+        # a < b < c -> _and(a < b, b < c)
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        terms = [node.left] + node.comparators
+        out = None
+        for op, left, right in zip(node.ops, terms, terms[1:]):
+            cmp = ast.Compare(left=left, ops=[op], comparators=[right])
+            out = cmp if out is None else ast.Call(func=ast.Name(id="_and", ctx=ast.Load()), args=[out, cmp], keywords=[])
+        return out
+
+
+class Formula:
+    """A compiled cost formula; call it with a mapping of VARIABLES (scalars or arrays).
+
+    Pickled as its text (the process pools recompile it through the cache).
+    """
+    __slots__ = ("text", "variables", "_fn")
+
+    def __init__(self, text: str, variables: Tuple[str, ...], fn):
+        self.text = text
+        self.variables = variables
+        self._fn = fn
+
+    def __call__(self, q: Mapping[str, object]):
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            return self._fn(*(np.asarray(q[v], dtype=float) for v in self.variables))
+
+    def __reduce__(self):
+        return compile_formula, (self.text,)
+
+    def __repr__(self) -> str:
+        return f"Formula({self.text!r})"
+
+
+def parse(text: str) -> ast.Expression:
+    """Checked syntax tree of `text`; FormulaError if it's not a valid formula."""
+    if not isinstance(text, str) or not text.strip():
+        raise FormulaError("Formula is empty")
+    if len(text) > MAX_LENGTH:
+        raise FormulaError(f"Formula is longer than {MAX_LENGTH} characters")
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except SyntaxError as e:
+        raise FormulaError(f"Syntax error at column {e.offset}: {e.msg}")
+    if sum(1 for _ in ast.walk(tree)) > MAX_NODES:
+        raise FormulaError(f"Formula has more than {MAX_NODES} terms")
+    _Check().visit(tree)
+    return tree
+
+
+@lru_cache(maxsize=1024)
+def compile_formula(text: str) -> Formula:
+    tree = parse(text)
+    variables = tuple(v for v in VARIABLES if any(isinstance(n, ast.Name) and n.id == v for n in ast.walk(tree)))
+    body = _Vectorize().visit(tree).body
+    args = ast.arguments(posonlyargs=[], args=[ast.arg(arg=v) for v in variables], kwonlyargs=[],
+                         kw_defaults=[], defaults=[])
+    expr = ast.fix_missing_locations(ast.Expression(body=ast.Lambda(args=args, body=body)))
+    return Formula(text, variables, eval(compile(expr, "<cost formula>", "eval"), dict(_ENV)))
+
+
+def check(text: str) -> Formula:
+    """Compile `text` and try it on scalars and arrays; FormulaError if it can't price a scenario."""
+    f = compile_formula(text)
+    sample = {"volume_mt": 1000.0, "containers": 44.0, "trucks": 30.0, "storage_months": 1.5, "storage_days": 45.0,
+              "ton_months": 1500.0, "value": 700_000.0, "cogs": 450_000.0}
+    try:
+        scalar = np.asarray(f(sample))
+        vector = np.asarray(f({k: np.full(3, v) for k, v in sample.items()}))
+    except (TypeError, ValueError, ArithmeticError) as e:
+        raise FormulaError(f"Formula cannot be evaluated: {e}")
+    if scalar.shape != () or vector.shape not in ((), (3,)):
+        raise FormulaError("Formula must evaluate to a single number")
+    return f
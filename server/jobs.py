@@ -0,0 +1,387 @@
+"""Background jobs: portfolio repricing, large sweeps and risk simulations.
+
+Il lavoro pesante gira su un process pool dedicato (JOBS_WORKERS processi,
+priorita' abbassata con JOBS_NICE), quindi l'event loop e i worker uvicorn
+restano liberi per /api/compute. Ogni job ha una directory sotto JOBS_DIR:
+
+    job.json     stato, progresso, risultato parziale (scritto atomicamente)
+    input.*      file caricato (portfolio)
+    result.*     risultato; per sweep/portfolio viene scritto a blocchi ed e'
+                 leggibile (righe complete) anche mentre il job gira
+    cancel       marker di cancellazione, controllato tra un blocco e l'altro
+
+Lo stato vive solo su disco: qualunque replica che vede JOBS_DIR puo'
+rispondere su un job, anche dopo un riavvio. Ogni processo API ha un BOOT_ID
+e rinnova un lease in JOBS_DIR/.leases: un job queued/running il cui owner
+non rinnova piu' il lease (processo morto, container ricreato con lo stesso
+host/pid o con un host nuovo) viene marcato failed dalla scansione periodica,
+che cancella anche i job scaduti e aggiorna i contatori per /metrics. Il processo figlio non importa
+main: riceve coefficienti gia' compilati o le righe della tabella costi
+alla versione del submit, cosi' il risultato e' prezzato su una versione nota.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Mapping, Optional, Sequence
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+import logging
+import time
+import uuid
+
+import numpy as np
+
+STATUSES = ("queued", "running", "done", "failed", "cancelled")
+FINISHED = ("done", "failed", "cancelled")
+PROGRESS_INTERVAL = 0.25   # secondi minimi tra due scritture di job.json durante il run
+LEASE_SECONDS = 60.0       # un owner che non rinnova il lease da piu' di cosi' e' considerato morto
+BOOT_ID = uuid.uuid4().hex  # identita' di questo processo: host e pid si ripetono dopo un riavvio
+
+
+class Cancelled(Exception):
+    pass
+
+
+# ------------ Job state on disk ------------
+def _write_json(path: str, data: Mapping) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def read_state(job_dir: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(job_dir, "job.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class JobContext:
+    """Handle passed to a job function inside the worker process."""
+
+    def __init__(self, job_dir: str):
+        self.dir = job_dir
+        self.state = read_state(job_dir)
+        self._written = 0.0
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def cancelled(self) -> bool:
+        return os.path.exists(self.path("cancel"))
+
+    def save(self, **changes) -> None:
+        self.state.update(changes)
+        _write_json(self.path("job.json"), self.state)
+        self._written = time.monotonic()
+
+    def progress(self, done: int, total: Optional[int], partial: Optional[Mapping] = None) -> None:
+        """Record progress (throttled) and stop the job if it was cancelled."""
+        if self.cancelled():
+            raise Cancelled()
+        if time.monotonic() - self._written >= PROGRESS_INTERVAL or (total is not None and done >= total):
+            changes = {"progress": {"done": done, "total": total}}
+            if partial is not None:
+                changes["partial"] = partial
+            self.save(**changes)
+
+
+def run(job_dir: str, kind: str, args: Mapping) -> str:
+    """Worker-process entry point: run one job and record how it ended."""
+    ctx = JobContext(job_dir)
+    if ctx.state is None:
+        return "failed"
+    if ctx.cancelled():
+        ctx.save(status="cancelled", finished=time.time())
+        return "cancelled"
+    ctx.save(status="running", started=time.time())
+    try:
+        KINDS[kind](ctx, **args)
+    except Cancelled:
+        ctx.save(status="cancelled", finished=time.time())
+    except Exception as e:  # l'errore finisce nello stato del job, non nel processo
+        ctx.save(status="failed", finished=time.time(), error=f"{type(e).__name__}: {e}")
+    else:
+        ctx.save(status="done", finished=time.time())
+    return ctx.state["status"]
+
+
+def _lower_priority(nice: int) -> None:
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+
+
+# ------------ Job kinds (run in the worker process) ------------
+def simulate_job(ctx: JobContext, base: Mapping, spec: Mapping, coef_log: np.ndarray, coef_ins: np.ndarray,
+                 draws: int, seed: Optional[int] = None, extra: Optional[Mapping] = None, formulas=None) -> None:
+    import risk
+    ss, sizes, seeds = risk.shards(draws, seed)
+    results = []
+    for n, sq in zip(sizes, seeds):
+        results.append(risk.run_shard(base, spec, coef_log, coef_ins, n, sq, formulas))
+        # riepilogo sugli shard gia' fatti: stima che si stabilizza man mano
+        ctx.progress(sum(r[0].size for r in results), draws, risk.summarise(results, ss.entropy, len(sizes)))
+    out = risk.summarise(results, ss.entropy, len(sizes))
+    out.update(extra or {})
+    _write_json(ctx.path("result.json"), out)
+
+
+def sweep_job(ctx: JobContext, header: Mapping, cols: Mapping, coef_log: np.ndarray, coef_ins: np.ndarray,
+              kpis: Sequence[str], chunk_size: int, formulas=None) -> None:
+    import sweep
+    shape = tuple(header["shape"])
+    total = int(np.prod(shape))
+    inner = total // shape[0]
+    with open(ctx.path("result.ndjson"), "w", encoding="utf-8") as f:
+        f.write(json.dumps(header) + "\n")
+        for offset, block in sweep.iter_chunks(cols, shape, coef_log, coef_ins, kpis, chunk_size, formulas):
+            f.write(json.dumps({"offset": offset, "kpis": sweep.to_lists(block)}) + "\n")
+            f.flush()
+            rows = np.shape(next(iter(block.values())))[0]
+            ctx.progress((offset + rows) * inner, total)
+
+
+def portfolio_job(ctx: JobContext, input_name: str, fmt: str, chunk_rows: int, cost_rows: Sequence[Mapping],
+                  cost_version: int, defaults: Mapping) -> None:
+    import portfolio
+    from cost_plan import PlanRegistry
+    items = [SimpleNamespace(**r) for r in cost_rows]
+    plans = PlanRegistry(lambda: items)
+    plans.invalidate(cost_version)
+    writer = portfolio.to_csv if fmt == "csv" else portfolio.to_ndjson
+    src_path = ctx.path(input_name)
+    size = os.path.getsize(src_path)
+    with open(src_path, "rb") as src, open(ctx.path(f"result.{fmt}"), "w", newline="", encoding="utf-8") as out:
+        chunks = portfolio.open_chunks(input_name, src, chunk_rows)
+        rows = 0
+
+        def counted():
+            nonlocal rows
+            for offset, raw, res in portfolio.evaluate_chunks(chunks, plans.get, plans.segment, defaults):
+                rows = offset + len(raw["destination"])
+                yield offset, raw, res
+
+        for piece in writer(counted()):
+            out.write(piece)
+            out.flush()
+            # totale righe ignoto fino alla fine: progresso in byte letti
+            ctx.progress(min(src.tell(), size), size, {"rows": rows})
+        ctx.save(progress={"done": size, "total": size}, partial={"rows": rows})
+
+
+KINDS: Dict[str, Callable] = {
+    "simulate": simulate_job,
+    "sweep": sweep_job,
+    "portfolio": portfolio_job,
+}
+RESULT_MEDIA = {"json": "application/json", "ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+# ------------ Queue (API process) ------------
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _owner_alive(owner: Optional[Sequence], leases: str, lease_seconds: float = LEASE_SECONDS) -> bool:
+    """Is the API process that submitted a job (owner = [host, pid, boot id]) still there?"""
+    if not owner:
+        return True
+    same_host = owner[0] == socket.gethostname()
+    if len(owner) < 3:   # job di una versione senza boot id: solo il controllo sul pid locale
+        return not same_host or _pid_alive(owner[1])
+    if owner[2] == BOOT_ID:
+        return True
+    if same_host and (owner[1] == os.getpid() or not _pid_alive(owner[1])):
+        return False     # stesso pid ma altro boot (container riavviato), o processo finito
+    try:
+        return time.time() - os.path.getmtime(os.path.join(leases, owner[2])) < lease_seconds
+    except OSError:
+        return False
+
+
+class JobQueue:
+    """Submits jobs to a bounded process pool; all state goes through JOBS_DIR."""
+
+    def __init__(self, root: str, workers: int = 1, nice: int = 10, ttl_seconds: float = 7 * 86400,
+                 scan_seconds: float = 20.0, lease_seconds: float = LEASE_SECONDS):
+        self.root = root
+        self.workers = max(1, workers)
+        self.nice = nice
+        self.ttl_seconds = ttl_seconds
+        self.scan_seconds = min(scan_seconds, lease_seconds / 3)   # il lease si rinnova a ogni giro
+        self.lease_seconds = lease_seconds
+        self.leases = os.path.join(root, ".leases")
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[str, object] = {}
+        self._counts: Optional[Dict[tuple, int]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(self.leases, exist_ok=True)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_lower_priority, initargs=(self.nice,))
+            return self._pool
+
+    def dir(self, job_id: str) -> str:
+        if not job_id.isalnum():
+            raise KeyError(job_id)
+        return os.path.join(self.root, job_id)
+
+    def create(self, kind: str, params: Optional[Mapping] = None, result: str = "json") -> str:
+        """Reserve a job id and its directory (status queued); files can be added before submit()."""
+        self.start()   # lease valido prima che il job compaia su disco
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.dir(job_id))
+        _write_json(os.path.join(self.dir(job_id), "job.json"), {
+            "id": job_id, "kind": kind, "status": "queued", "created": time.time(), "started": None,
+            "finished": None, "progress": {"done": 0, "total": None}, "partial": None, "error": None,
+            "params": dict(params or {}), "result": result,
+            "owner": [socket.gethostname(), os.getpid(), BOOT_ID],
+        })
+        return job_id
+
+    def submit(self, job_id: str, kind: str, args: Mapping) -> Dict:
+        try:
+            future = self._get_pool().submit(run, self.dir(job_id), kind, dict(args))
+        except BrokenProcessPool:   # un worker e' morto: i job in corso sono gia' marcati failed, pool nuovo
+            with self._lock:
+                self._pool = None
+            future = self._get_pool().submit(run, self.dir(job_id), kind, dict(args))
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f, job_id=job_id: self._finished(job_id, f))
+        return self.get(job_id)
+
+    def _finished(self, job_id: str, future) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+        if future.cancelled():
+            self._mark(job_id, "cancelled")
+        elif future.exception() is not None:   # processo morto (OOM, kill): il job non ha scritto lo stato
+            self._mark(job_id, "failed", f"worker crashed: {future.exception()!r}")
+
+    def _mark(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        state = read_state(self.dir(job_id))
+        if state is not None and state["status"] not in FINISHED:
+            state.update(status=status, finished=time.time(), error=error)
+            _write_json(os.path.join(self.dir(job_id), "job.json"), state)
+
+    def get(self, job_id: str) -> Dict:
+        state = read_state(self.dir(job_id))
+        if state is None:
+            raise KeyError(job_id)
+        return state
+
+    def list(self, limit: int = 50) -> List[Dict]:
+        states = [s for s in (read_state(os.path.join(self.root, d)) for d in os.listdir(self.root)
+                              if d.isalnum()) if s]
+        return sorted(states, key=lambda s: -s["created"])[:limit]
+
+    def cancel(self, job_id: str) -> Dict:
+        state = self.get(job_id)
+        if state["status"] in FINISHED:
+            return state
+        # il marker vale anche per job sottomessi da un'altra replica
+        open(os.path.join(self.dir(job_id), "cancel"), "w").close()
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            self._mark(job_id, "cancelled")
+        return self.get(job_id)
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.dir(job_id), f"result.{self.get(job_id)['result']}")
+
+    # ------------ Maintenance ------------
+    def start(self) -> None:
+        """Renew this process' lease and start the periodic scan (idempotent)."""
+        self._renew()
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="job-maintenance", daemon=True)
+            self._thread.start()
+
+    def _renew(self) -> None:
+        path = os.path.join(self.leases, BOOT_ID)
+        with open(path, "a"):
+            pass
+        os.utime(path)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.scan_seconds):
+            try:
+                self._renew()
+                self.scan()
+            except Exception:  # JOBS_DIR momentaneamente non leggibile: si riprova al giro dopo
+                logging.getLogger(__name__).exception("job maintenance failed")
+
+    def scan(self) -> Dict[str, int]:
+        """One pass over JOBS_DIR: fail orphaned jobs, delete expired ones, refresh the status counts."""
+        cutoff = time.time() - self.ttl_seconds
+        counts = {(s,): 0 for s in STATUSES}
+        recovered = purged = 0
+        for state in self.list(limit=10**9):
+            if state["status"] in FINISHED and (state["finished"] or 0) < cutoff:
+                shutil.rmtree(self.dir(state["id"]), ignore_errors=True)
+                purged += 1
+                continue
+            if state["status"] not in FINISHED and not _owner_alive(state.get("owner"), self.leases,
+                                                                    self.lease_seconds):
+                self._mark(state["id"], "failed", "interrupted: the server that ran it is gone")
+                state["status"] = "failed"
+                recovered += 1
+            counts[(state["status"],)] += 1
+        for name in os.listdir(self.leases):   # lease scaduti da un pezzo: owner morti
+            path = os.path.join(self.leases, name)
+            try:
+                if time.time() - os.path.getmtime(path) > max(self.ttl_seconds, self.lease_seconds):
+                    os.remove(path)
+            except OSError:
+                pass
+        self._counts = counts
+        return {"recovered": recovered, "purged": purged}
+
+    def recover(self) -> int:
+        """Mark failed the queued/running jobs whose owner process is gone; returns how many."""
+        return self.scan()["recovered"]
+
+    def purge(self) -> int:
+        return self.scan()["purged"]
+
+    def counts(self) -> Dict[tuple, int]:
+        """Jobs by status as of the last scan (every scan_seconds): a /metrics scrape reads no job.json."""
+        if self._counts is None:
+            self.scan()
+        return dict(self._counts)
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+            pool, self._pool = self._pool, None
+            running = list(self._futures)
+        if thread is not None:
+            thread.join(timeout=5)
+        for job_id in running:   # i job in corso si fermano al prossimo blocco invece di tenere in vita il pool
+            open(os.path.join(self.dir(job_id), "cancel"), "w").close()
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
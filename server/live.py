@@ -0,0 +1,123 @@
+"""Live-pricing sessions: server-held scenario, field diffs, partial recompute.
+
+Il client manda solo i campi cambiati; la sessione tiene lo scenario e i
+termini del modello gia' calcolati e ricalcola solo quelli che dipendono dai
+campi toccati (es. dso_sell_days -> solo finance). Le formule sono le stesse
+di _compute_internal.
+"""
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Set
+
+import vector_engine as vec
+from cost_plan import quantity_vectors
+
+# campo -> termini da ricalcolare ("base" = unita', ricavi, COGS; trascina tutto il resto)
+DEPENDS: Dict[str, Set[str]] = {
+    "destination": {"plan"},
+    "as_of": {"plan"},
+    "volume_mt": {"base"},
+    "buy_price_per_mt": {"base"},
+    "sell_price_per_mt": {"base"},
+    "mt_per_container": {"base"},
+    "mt_per_truck": {"base"},
+    "storage_months": {"logistics", "finance"},
+    "shrinkage_pct": {"shrink"},
+    "partner_profit_pct": {"partner"},
+    "dpo_buy_days": {"finance"},
+    "dso_sell_days": {"finance"},
+    "annual_finance_rate_pct": {"finance"},
+}
+DOWNSTREAM: Dict[str, Set[str]] = {
+    "plan": {"logistics"},
+    "base": {"logistics", "shrink", "partner", "finance"},
+}
+TERMS = ("plan", "base", "logistics", "shrink", "partner", "finance")
+
+
+def affected(fields: Iterable[str]) -> Set[str]:
+    out: Set[str] = set()
+    for f in fields:
+        for t in DEPENDS.get(f, ()):
+            out.add(t)
+            out |= DOWNSTREAM.get(t, set())
+    return out
+
+
+class PricingSession:
+    """One client's scenario plus its cached model terms.
+
+    `validate(dict) -> model` checks the merged scenario (ScenarioIn);
+    `plan_for(destination, as_of)` returns the compiled CostPlan and
+    `version()` the current cost-table version, so an edit to the table
+    recomputes the logistics term on the next frame.
+    """
+
+    def __init__(self, validate: Callable[[Dict], Any], plan_for: Callable, version: Callable[[], int]):
+        self.validate = validate
+        self.plan_for = plan_for
+        self.version = version
+        self.state: Dict[str, Any] = {}
+        self.terms: Dict[str, Any] = {}
+        self.kpis: Dict[str, float] = {}
+        self._cost_version: Optional[int] = None
+
+    def apply(self, diff: Mapping[str, Any]) -> Dict[str, Any]:
+        """Merge `diff`, recompute what it touches and return the frame.
+
+        Raises whatever `validate` raises; the session is left unchanged.
+        """
+        merged = {**self.state, **diff}
+        s = self.validate(merged)
+        changed = {k for k, v in diff.items() if k not in self.state or self.state[k] != v}
+        todo = set(TERMS) if not self.terms else affected(changed)
+        if self._cost_version != self.version():
+            todo |= {"plan", "logistics"}
+        self.state = merged
+        self._recompute(s, todo)
+
+        prev = self.kpis
+        self.kpis = self._kpis(s)
+        return {
+            "kpis": self.kpis,
+            "delta": {k: v - prev[k] for k, v in self.kpis.items()} if prev else {},
+            "totals": {k: self.terms[k] for k in vec.TOTAL_FIELDS},
+            "recomputed": [t for t in TERMS if t in todo],
+            "cost_version": self._cost_version,
+        }
+
+    def _recompute(self, s, todo: Set[str]) -> None:
+        t = self.terms
+        if "plan" in todo:
+            self._cost_version = self.version()
+            t["plan"] = self.plan_for(s.destination, s.as_of)
+        if "base" in todo:
+            t["sell_unit"] = s.sell_price_per_mt if s.sell_price_per_mt not in (None, 0) else s.buy_price_per_mt
+            n_cntr, n_trk = vec.unit_counts(s.volume_mt, s.mt_per_container, s.mt_per_truck)
+            t["n_cntr"], t["n_trk"] = int(n_cntr), int(n_trk)
+            t["revenue"] = s.volume_mt * t["sell_unit"]
+            t["cogs"] = s.volume_mt * s.buy_price_per_mt
+        if "logistics" in todo:
+            mult, _ = quantity_vectors(s.volume_mt, t["n_cntr"], t["n_trk"], s.storage_months,
+                                       t["revenue"], t["cogs"])
+            t["logistics_excl_cogs_ins"], t["insurance"] = t["plan"].totals(mult)
+        if "shrink" in todo:
+            t["shrinkage"] = (s.shrinkage_pct / 100.0) * t["cogs"]
+        if "partner" in todo:
+            t["partner_profit"] = (s.partner_profit_pct / 100.0) * t["sell_unit"] * s.volume_mt
+        if "finance" in todo:
+            t["finance"] = float(vec.finance_nwc(t["revenue"], t["cogs"], s.storage_months, s.dso_sell_days,
+                                                 s.dpo_buy_days, s.annual_finance_rate_pct))
+
+    def _kpis(self, s) -> Dict[str, float]:
+        t = self.terms
+        revenue = t["revenue"]
+        total_cost = (t["cogs"] + t["logistics_excl_cogs_ins"] + t["insurance"] + t["shrinkage"]
+                      + t["finance"] + t["partner_profit"])
+        net_margin = revenue - total_cost
+        return {
+            "gross_revenue": revenue,
+            "total_cost": total_cost,
+            "net_margin": net_margin,
+            "net_margin_pct": (net_margin / revenue) if revenue else 0,
+            "net_margin_per_mt": (net_margin / s.volume_mt) if s.volume_mt else 0,
+            "break_even_sell_per_mt": (total_cost / s.volume_mt) if s.volume_mt else 0,
+        }
@@ -0,0 +1,114 @@
+"""Load planning: volume / destination split / payload choice that maximises margin per MT.
+
+A container e truck fissi il margine e' affine nel volume, quindi per ogni
+opzione (destinazione x modo di carico) il margine per MT e' monotono dentro
+ogni gradino: i candidati utili sono solo i volumi a pieno carico
+(k * mt_per_container, k * mt_per_truck) piu' i limiti min/max. I candidati
+vengono valutati in blocco con il modello vettoriale e combinati con
+broadcasting NumPy per gli split su 2-3 destinazioni.
+"""
+from itertools import combinations
+from typing import Dict, List, Mapping, Sequence, Tuple
+import numpy as np
+
+import vector_engine as vec
+
+MAX_SPLITS = 3
+TOP_PER_OPTION = {2: 1000, 3: 60}   # candidati tenuti per opzione negli split (<= 1M celle)
+MAX_CANDIDATES = 200_000            # volumi candidati per opzione
+
+
+def candidate_count(vmax: float, cap_c: float, cap_t: float) -> float:
+    """Upper bound on candidate_volumes(...).size, without allocating (inf for an infinite vmax)."""
+    cap_c, cap_t = max(cap_c, 0.0001), max(cap_t, 0.0001)
+    return vmax // cap_c + vmax // cap_t + 2
+
+
+def candidate_volumes(vmin: float, vmax: float, cap_c: float, cap_t: float) -> np.ndarray:
+    cap_c, cap_t = max(cap_c, 0.0001), max(cap_t, 0.0001)
+    pts = [np.arange(1, int(vmax // cap_c) + 1) * cap_c,
+           np.arange(1, int(vmax // cap_t) + 1) * cap_t,
+           np.array([vmin, vmax])]
+    v = np.unique(np.concatenate(pts))
+    return v[(v > 0) & (v <= vmax)]
+
+
+def evaluate_option(base: Mapping[str, float], volumes: np.ndarray, sell: float, mode: Mapping[str, float],
+                    coef_log: np.ndarray, coef_ins: np.ndarray, formulas=None) -> Dict[str, np.ndarray]:
+    cols = {f: np.asarray(base[f], dtype=float) for f in vec.NUMERIC_FIELDS}
+    cols["volume_mt"] = volumes
+    cols["sell_price_per_mt"] = np.asarray(sell, dtype=float)
+    cols["mt_per_container"] = np.asarray(mode["mt_per_container"], dtype=float)
+    cols["mt_per_truck"] = np.asarray(mode["mt_per_truck"], dtype=float)
+    return vec.evaluate(cols, coef_log, coef_ins, formulas=formulas)
+
+
+def _allocation(opt: Mapping, i: int) -> Dict:
+    r = opt["res"]
+    return {
+        "destination": opt["destination"],
+        "volume_mt": float(opt["volumes"][i]),
+        "mt_per_container": opt["mode"]["mt_per_container"],
+        "mt_per_truck": opt["mode"]["mt_per_truck"],
+        "containers": int(r["containers"][i]),
+        "trucks": int(r["trucks"][i]),
+        "sell_price_per_mt": float(r["sell_unit"][i]),
+        "net_margin": float(r["net_margin"][i]),
+        "net_margin_per_mt": float(r["net_margin_per_mt"][i]),
+    }
+
+
+def _plan(parts: List[Dict]) -> Dict:
+    vol = sum(p["volume_mt"] for p in parts)
+    margin = sum(p["net_margin"] for p in parts)
+    return {"allocations": parts, "volume_mt": vol, "net_margin": margin,
+            "net_margin_per_mt": margin / vol if vol else 0.0}
+
+
+def search(options: Sequence[Dict], vmin: float, vmax: float, max_splits: int, top: int = 5) -> List[Dict]:
+    """Best plans over single options and splits across distinct destinations.
+
+    Each option is {"destination", "mode", "volumes", "res"} (res from
+    evaluate_option over volumes).
+    """
+    found: List[Tuple[float, List[Tuple[int, int]]]] = []   # (margin/MT, [(option, index)])
+
+    for o, opt in enumerate(options):
+        v, m = opt["volumes"], opt["res"]["net_margin"]
+        ok = np.nonzero(v >= vmin)[0]
+        for i in ok[np.argsort(-(m[ok] / v[ok]))][:top]:
+            found.append((float(m[i] / v[i]), [(o, int(i))]))
+
+    for k in range(2, min(max_splits, MAX_SPLITS) + 1):
+        for combo in combinations(range(len(options)), k):
+            if len({options[o]["destination"] for o in combo}) < k:
+                continue
+            idx = []
+            for o in combo:
+                opt = options[o]
+                per_mt = opt["res"]["net_margin"] / opt["volumes"]
+                keep = np.argsort(-per_mt)
+                idx.append(keep[:TOP_PER_OPTION[k]])
+            vols = [options[o]["volumes"][ix] for o, ix in zip(combo, idx)]
+            margins = [options[o]["res"]["net_margin"][ix] for o, ix in zip(combo, idx)]
+            # broadcasting: una dimensione per opzione
+            shape = [1] * k
+            tv, tm = 0.0, 0.0
+            for d, (v, m) in enumerate(zip(vols, margins)):
+                sh = list(shape)
+                sh[d] = v.size
+                tv = tv + v.reshape(sh)
+                tm = tm + m.reshape(sh)
+            feasible = (tv >= vmin) & (tv <= vmax)
+            if not feasible.any():
+                continue
+            score = np.where(feasible, tm / tv, -np.inf)
+            flat = np.argsort(-score, axis=None)[:top]
+            for f in flat:
+                if not np.isfinite(score.flat[f]):
+                    break
+                pos = np.unravel_index(f, score.shape)
+                found.append((float(score.flat[f]), [(o, int(ix[p])) for o, ix, p in zip(combo, idx, pos)]))
+
+    found.sort(key=lambda x: -x[0])
+    return [_plan([_allocation(options[o], i) for o, i in parts]) for _, parts in found[:top]]
@@ -1,16 +1,75 @@
-﻿from fastapi import FastAPI, HTTPException
+﻿import time
+STARTUP_T0 = time.perf_counter()  # budget di cold start misurato da qui
+
+from fastapi import Depends, FastAPI, File, HTTPException, Request, Response, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, Any, List
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError, model_validator
+from typing import Dict, Any, List, Literal
+from contextlib import asynccontextmanager
+from datetime import date
+import asyncio
 import math
-import copy
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from cost_plan import FORMULA_BEHAVIOR, CostPlan, PlanRegistry, quantity_vectors
+from formula import check as check_formula
+import vector_engine as vec
+import sweep
+import solver
+from compute_cache import ComputeCache, scenario_key
+from cost_store import ConflictError, CostSnapshot, CostStore, VersionHeaderMiddleware, write_snapshot
+import portfolio
+import cost_io
+import routes
+import load_plan
+import codec
+import live
+import metrics
+import jobs
+import cashflow
+from deal_store import DealRepricer, DealStore
+
+async def fresh_costs():
+    # col poller attivo (COSTS_POLL_SECONDS) la richiesta non legge il DB; senza, controllo
+    # versione rate-limited (COSTS_REFRESH_SECONDS): ricarica solo se la tabella e' cambiata.
+    # lettura SQLite / reload nel threadpool: l'event loop non aspetta il disco
+    with metrics.span("refresh"):
+        if not COSTS.polling and COSTS.refresh_due:
+            await run_in_threadpool(COSTS.maybe_refresh)
+
+@asynccontextmanager
+async def lifespan(app):
+    COSTS.start_polling(float(os.environ.get("COSTS_POLL_SECONDS", 2)))
+    JOBS.start()
+    JOBS.recover()   # job lasciati a meta' da un processo gia' morto; gli altri li trova la scansione periodica
+    warmup()
+    DEAL_REPRICER.start()
+    yield
+    DEAL_REPRICER.stop()
+    JOBS.shutdown()
+    COSTS.stop_polling()
 
-app = FastAPI(title="Trade Calculator API")
+app = FastAPI(title="Trade Calculator API", dependencies=[Depends(fresh_costs)], lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,
-    allow_methods=["*"], allow_headers=["*"]
+    allow_methods=["*"], allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing", "X-Cost-Version"]
 )
+# batch / sweep grandi: gzip sopra GZIP_MIN_BYTES (il client manda Accept-Encoding)
+app.add_middleware(GZipMiddleware, minimum_size=int(os.environ.get("GZIP_MIN_BYTES", 1024)))
+# ultimo aggiunto = piu' esterno: misura anche gzip e CORS
+app.add_middleware(metrics.MetricsMiddleware)
 
 # ------------ Models ------------
 class ScenarioIn(BaseModel):
@@ -27,16 +86,31 @@ class ScenarioIn(BaseModel):
     partner_profit_pct: float = 5.0
     mt_per_container: float = 40
     mt_per_truck: float = 58
+    as_of: date | None = None  # prezza con le tariffe valide a questa data (default: oggi)
 
 class CostItem(BaseModel):
     code: str
     name: str
-    behavior: str                  # "per_ton"|"per_container"|"per_truck"|"per_month"|"per_ton_per_month"|"fixed_per_shipment"|"percent_of_value"|"percent_of_cogs"
+    behavior: str                  # "per_ton"|"per_container"|"per_truck"|"per_month"|"per_ton_per_month"|"fixed_per_shipment"|"percent_of_value"|"percent_of_cogs"|"formula"
     unit_amount_usd: float
     unit: str
     qty_source: str                # "Volume_MT"|"Containers"|"Trucks"|"Storage_Months"|"1"|"Value_USD"|"COGS_USD"
     dest_scope: str                # "LUB*"|"KIN*"|"KOL*"
     category: str                  # "product"|"logistics"|"insurance"|"finance"
+    effective_from: date | None = None   # incluso; None = da sempre
+    effective_to: date | None = None     # escluso; None = ancora valido
+    formula: str | None = None           # solo con behavior "formula": qty = formula (vedi formula.py)
+
+    @model_validator(mode="after")
+    def check_validity(self):
+        if self.effective_from and self.effective_to and self.effective_to <= self.effective_from:
+            raise ValueError("effective_to must be after effective_from")
+        if self.behavior == FORMULA_BEHAVIOR:
+            # compilata qui: un errore di sintassi esce al salvataggio (422), non al primo compute
+            check_formula(self.formula or "")
+        elif self.formula:
+            raise ValueError(f"formula is only used with behavior '{FORMULA_BEHAVIOR}'")
+        return self
 
 # ------------ Helpers ------------
 def containers_needed(volume_mt: float, mt_per_container: float) -> int:
@@ -48,9 +122,6 @@ def trucks_needed(volume_mt: float, mt_per_truck: float) -> int:
 def value_usd(volume_mt: float, unit_price: float) -> float:
     return volume_mt * unit_price
 
-def matches_scope(item: CostItem, dest: str) -> bool:
-    return item.dest_scope.startswith(dest)
-
 # ------------ Seed costs (KIN, LUB, KOL) ------------
 def seed_costs() -> List[CostItem]:
     costs: List[CostItem] = []
@@ -128,7 +199,35 @@ def seed_costs() -> List[CostItem]:
 
     return costs
 
-DEFAULT_COSTS: List[CostItem] = seed_costs()
+# Tabella costi persistente (SQLite, WAL); seed al primo avvio. Default fuori da git (var/, ignorata):
+# al primo avvio parte da una copia di data.db (versionato, mai scritto), poi cost_catalog viene seminata
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+COST_STORE = CostStore(os.environ.get("COSTS_DB_PATH", os.path.join(SERVER_DIR, "var", "costs.db")),
+                       template=os.path.join(SERVER_DIR, "data.db"))
+COST_STORE.init(lambda: [c.model_dump() for c in seed_costs()])
+# Piani compilati per destinazione; invalidati ad ogni nuova versione dello snapshot
+PLANS = PlanRegistry(lambda: COSTS.items, max_plans=int(os.environ.get("PLAN_CACHE_SIZE", 256)))
+# Deal salvati (stesso file SQLite salvo DEALS_DB_PATH); il repricer gira in background dopo ogni cambio costi
+# e quando il segmento di validita' di oggi cambia (deal senza as_of)
+DEALS = DealStore(os.environ.get("DEALS_DB_PATH", COST_STORE.path))
+DEALS.init()
+DEAL_REPRICER = DealRepricer(DEALS, lambda: COSTS.current(), lambda rows: _price_deals(rows),
+                             segment_start=lambda: PLANS.segment_start())
+
+def _costs_changed(version: int) -> None:
+    PLANS.invalidate(version)
+    DEAL_REPRICER.wake()
+
+COSTS = CostSnapshot(COST_STORE, lambda row: CostItem(**row), _costs_changed,
+                     refresh_interval=float(os.environ.get("COSTS_REFRESH_SECONDS", 2)))
+# snapshot precompilato (python main.py --write-snapshot, in fase di build): evita di rileggere la
+# tabella se la versione coincide con quella del DB
+COSTS_SNAPSHOT_PATH = os.environ.get("COSTS_SNAPSHOT_PATH",
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), "costs.snapshot.json"))
+if not COSTS.load_file(COSTS_SNAPSHOT_PATH):
+    COSTS.reload()
+# X-Cost-Version in ogni risposta; se il client ne manda una piu' nuova, ricarica prima di rispondere
+app.add_middleware(VersionHeaderMiddleware, snapshot=COSTS)
 
 # Mappe per disegno rotta
 ROUTE_LEGS = {
@@ -137,38 +236,202 @@ ROUTE_LEGS = {
     "KOL": [("Dar es Salaam","Kolwezi")]
 }
 
+def _dest_label(dest) -> str:
+    # label delle metriche: solo destinazioni note, il resto in "other" (cardinalita' limitata)
+    d = str(dest).strip().upper()
+    return d if d in ROUTE_LEGS else "other"
+
 # ------------ API ------------
 @app.get("/api/health")
 @app.get("/health")
 def health():
     return {"status":"ok"}
 
+# ------------ Startup / readiness ------------
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", 1.0))
+STARTUP = {"ready": False, "seconds": None, "within_budget": None}
+
+def warmup() -> float:
+    """Compile every destination's plan and run each hot path once before readiness."""
+    for dest in ROUTE_LEGS:
+        s = ScenarioIn(destination=dest, volume_mt=100, buy_price_per_mt=400, sell_price_per_mt=600,
+                       dpo_buy_days=30, dso_sell_days=30, annual_finance_rate_pct=10, storage_months=1)
+        codec.encode(_shape(_compute_internal(s), "full"))
+    dest, cols = vec.columns_from_records([s.model_dump()] * 2, SCENARIO_DEFAULTS)
+    vec.evaluate_mixed(dest, cols, PLANS.get, _segments([None, None]))
+    _catalog(*COSTS.current())
+    elapsed = time.perf_counter() - STARTUP_T0
+    STARTUP.update(ready=True, seconds=elapsed, within_budget=elapsed <= STARTUP_BUDGET_SECONDS)
+    if elapsed > STARTUP_BUDGET_SECONDS:
+        logging.getLogger("uvicorn.error").warning(
+            "startup took %.3fs, over the %.3fs budget (STARTUP_BUDGET_SECONDS)", elapsed, STARTUP_BUDGET_SECONDS)
+    return elapsed
+
+@app.get("/api/ready")
+@app.get("/ready")
+def ready():
+    # readiness / startup probe: 503 finche' il warmup non e' finito
+    if not STARTUP["ready"]:
+        raise HTTPException(503, "warming up")
+    return {"status": "ready", "cost_version": COSTS.version, "startup_seconds": STARTUP["seconds"],
+            "startup_budget_seconds": STARTUP_BUDGET_SECONDS, "within_budget": STARTUP["within_budget"]}
+
+# ------------ Cost catalogue ------------
+# righe serializzate una volta per versione; i body per (since, media) restano in cache finche' la versione non cambia
+MAX_CATALOG_BODIES = 64
+_CATALOG = {"version": None, "rows": [], "by_code": {}, "bodies": {}}
+
+def _catalog(version: int, items) -> dict:
+    cat = _CATALOG
+    if cat["version"] != version:
+        rows = [c.model_dump(mode="json") for c in sorted(items, key=lambda x: (x.code, x.effective_from or date.min))]
+        by_code = {}
+        for r in rows:
+            by_code.setdefault(r["code"], []).append(r)
+        cat = {"version": version, "rows": rows, "by_code": by_code, "bodies": {}}
+        globals()["_CATALOG"] = cat          # swap atomico: le richieste in corso tengono la versione che hanno letto
+    return cat
+
+def _catalog_delta(cat: dict, since: int) -> dict:
+    version = cat["version"]
+    codes = [] if since >= version else COST_STORE.changed_codes(since, version) if since >= 0 else None
+    if codes is None:        # log non abbastanza lungo (o primo sync): tabella intera
+        return {"cost_version": version, "since": since, "full": True, "items": cat["rows"], "removed": []}
+    by_code = cat["by_code"]
+    return {"cost_version": version, "since": since, "full": False,
+            "items": [r for c in codes for r in by_code.get(c, ())],
+            "removed": [c for c in codes if c not in by_code]}
+
 @app.get("/api/costs")
 @app.get("/costs")
-def list_costs():
-    # sort per coerenza
-    return [c.model_dump() for c in sorted(DEFAULT_COSTS, key=lambda x: x.code)]
+def list_costs(request: Request, since: int | None = None):
+    # since=<versione>: solo i codici toccati dopo quella versione (tutte le loro righe correnti) + quelli rimossi
+    if since is not None:
+        COSTS.ensure(since)
+    version, items = COSTS.current()
+    media = codec.negotiate(request.headers.get("accept"))
+    # un validatore per rappresentazione: versione, since e media type (JSON / MessagePack)
+    etag = f'"costs-{version}-{"all" if since is None else since}-{media.rsplit("/", 1)[-1]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    cat = _catalog(version, items)
+    key = (since, media)
+    body = cat["bodies"].get(key)
+    if body is None:
+        body = codec.encode(cat["rows"] if since is None else _catalog_delta(cat, since), media)
+        if len(cat["bodies"]) >= MAX_CATALOG_BODIES:
+            cat["bodies"].clear()
+        cat["bodies"][key] = body
+    return Response(content=body, media_type=media, headers=headers)
 
 @app.post("/api/costs")
 @app.post("/costs")
 def add_cost(item: CostItem):
-    DEFAULT_COSTS.append(item)
-    return {"ok": True}
+    # stesso codice ammesso solo con periodi di validita' disgiunti, altrimenti il compute lo conta due volte
+    try:
+        COST_STORE.insert(item.model_dump())
+    except ConflictError as e:
+        raise HTTPException(409, str(e))
+    return {"ok": True, "cost_version": COSTS.reload()}
 
 @app.put("/api/costs/{code}")
 @app.put("/costs/{code}")
 def update_cost(code: str, item: CostItem):
-    for i, c in enumerate(DEFAULT_COSTS):
-        if c.code == code:
-            DEFAULT_COSTS[i] = item
-            return {"ok": True}
-    raise HTTPException(404, "Cost not found")
+    try:
+        version = COST_STORE.update(code, item.model_dump())
+    except ConflictError as e:
+        raise HTTPException(409, str(e))
+    if version is None:
+        raise HTTPException(404, "Cost not found")
+    return {"ok": True, "cost_version": COSTS.reload()}
+
+@app.get("/api/costs/meta")
+@app.get("/costs/meta")
+def costs_meta(request: Request):
+    # metadati statici per codice: le risposte compute `compact` riportano solo i codici
+    etag = f'"meta-{COSTS.version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    meta = {c.code: {"name": c.name, "category": c.category, "unit": c.unit, "behavior": c.behavior}
+            for c in sorted(COSTS.items, key=lambda x: x.effective_from or date.min)}
+    body, media = codec.encode_response({"cost_version": COSTS.version, "codes": meta}, request.headers.get("accept"))
+    return Response(content=body, media_type=media, headers=headers)
+
+# ------------ Bulk cost edits ------------
+class CostOp(BaseModel):
+    op: Literal["add", "update", "upsert"] = "upsert"
+    code: str | None = None        # per update/upsert; default item.code
+    item: CostItem
+
+class CostPatchIn(BaseModel):
+    ops: List[CostOp]
+
+def _apply_ops(ops: List[tuple], replace: bool = False) -> dict:
+    # una transazione, una versione, un solo rebuild dei piani compilati
+    seen = {}
+    for op, code, row in ops:
+        if op != "update" and not replace and code in seen:
+            raise HTTPException(409, f"{code}: more than one add/upsert in the same batch")
+        seen[code] = op
+    try:
+        version, counts = COST_STORE.apply(ops, replace=replace)
+    except KeyError as e:
+        raise HTTPException(404, f"Cost not found: {e.args[0]}")
+    except ConflictError as e:
+        raise HTTPException(409, str(e))
+    COSTS.reload()
+    return {"ok": True, "cost_version": version, **counts}
+
+@app.patch("/api/costs")
+@app.patch("/costs")
+def patch_costs(req: CostPatchIn):
+    if not req.ops:
+        raise HTTPException(422, "ops must not be empty")
+    return _apply_ops([(o.op, o.code or o.item.code, o.item.model_dump()) for o in req.ops])
+
+@app.get("/api/costs/export")
+@app.get("/costs/export")
+def export_costs(format: Literal["csv", "json"] = "csv"):
+    rows = [c.model_dump() for c in COSTS.items]   # ordine tabella, storico incluso
+    headers = {"Content-Disposition": f'attachment; filename="costs-v{COSTS.version}.{format}"'}
+    if format == "json":
+        return Response(cost_io.to_json(rows), media_type="application/json", headers=headers)
+    return Response(cost_io.to_csv(rows), media_type="text/csv", headers=headers)
+
+@app.post("/api/costs/import")
+@app.post("/costs/import")
+def import_costs(file: UploadFile = File(...), format: Literal["csv", "json"] | None = None,
+                 mode: Literal["upsert", "replace"] = "upsert"):
+    # upsert: una riga per codice (es. tariffe di una gara), aggiorna o aggiunge;
+    # replace: la tabella diventa il file (round-trip di /api/costs/export, storico compreso)
+    fmt = format or ("json" if (file.filename or "").lower().endswith(".json") else "csv")
+    try:
+        raw = cost_io.parse(file.file.read(), fmt)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    items, errors = [], []
+    for i, row in enumerate(raw):
+        try:
+            items.append(CostItem(**row))
+        except ValidationError as e:
+            errors.append({"row": i + 1, "errors": e.errors(include_url=False, include_context=False)})
+    if errors:
+        raise HTTPException(422, errors)
+    if not items:
+        raise HTTPException(422, "No rows to import")
+    op = "add" if mode == "replace" else "upsert"
+    return _apply_ops([(op, it.code, it.model_dump()) for it in items], replace=mode == "replace")
 
 class ComputeOut(BaseModel):
     kpis: Dict[str, float]
-    breakdown: Dict[str, Any]
+    breakdown: Dict[str, Any]      # full: totali + lines + route_legs; compact: lines a colonne; totals: solo totali
+
+class ComputeKpisOut(BaseModel):   # detail=kpis
+    kpis: Dict[str, float]
 
-def _compute_internal(s: ScenarioIn) -> ComputeOut:
+def _compute_internal(s: ScenarioIn, plan: CostPlan | None = None) -> ComputeOut:
     sell_unit = s.sell_price_per_mt if s.sell_price_per_mt not in (None, 0) else s.buy_price_per_mt
     buy_unit  = s.buy_price_per_mt
 
@@ -177,53 +440,11 @@ def _compute_internal(s: ScenarioIn) -> ComputeOut:
     revenue = value_usd(s.volume_mt, sell_unit)
     cogs_total = value_usd(s.volume_mt, buy_unit)
 
-    lines: list[dict] = []
-    total_log = 0.0
-    total_ins = 0.0
-
-    for item in DEFAULT_COSTS:
-        if not matches_scope(item, s.destination): 
-            continue
-        if item.category == "product" and item.code.startswith("COGS_"):
-            continue
-
-        if item.behavior == "per_ton":
-            qty = s.volume_mt
-            cost = qty * item.unit_amount_usd
-        elif item.behavior == "per_container":
-            qty = n_cntr
-            cost = qty * item.unit_amount_usd
-        elif item.behavior == "per_truck":
-            qty = n_trk
-            cost = qty * item.unit_amount_usd
-        elif item.behavior == "per_month":
-            qty = s.storage_months
-            cost = qty * item.unit_amount_usd
-        elif item.behavior == "per_ton_per_month":
-            qty = s.volume_mt * s.storage_months
-            cost = qty * item.unit_amount_usd
-        elif item.behavior == "fixed_per_shipment":
-            qty = 1
-            cost = item.unit_amount_usd
-        elif item.behavior == "percent_of_value":
-            qty = 1
-            cost = revenue * item.unit_amount_usd
-        elif item.behavior == "percent_of_cogs":
-            qty = 1
-            cost = cogs_total * item.unit_amount_usd
-        else:
-            qty = 0
-            cost = 0
-
-        lines.append({
-            "code": item.code, "name": item.name, "category": item.category,
-            "qty": qty, "unit": item.unit, "unit_amount_usd": item.unit_amount_usd,
-            "cost_usd": cost
-        })
-        if item.category == "logistics":
-            total_log += cost
-        elif item.category == "insurance":
-            total_ins += cost
+    plan = plan or PLANS.get(s.destination, s.as_of)
+    metrics.COMPUTES.inc(_dest_label(s.destination))
+    mult, qty = quantity_vectors(s.volume_mt, n_cntr, n_trk, s.storage_months, revenue, cogs_total)
+    total_log, total_ins = plan.totals(mult)
+    lines = plan.lines(mult, qty)
 
     shrink_loss  = (s.shrinkage_pct/100.0) * cogs_total
     
@@ -266,11 +487,823 @@ def _compute_internal(s: ScenarioIn) -> ComputeOut:
         "lines": lines,
         "route_legs": ROUTE_LEGS.get(s.destination, [])
     }
-    return ComputeOut(kpis=kpis, breakdown=breakdown)
+    # valori gia' float: niente validazione pydantic sul percorso caldo
+    return ComputeOut.model_construct(kpis=kpis, breakdown=breakdown)
+
+COMPUTE_DETAIL = Literal["full", "compact", "totals", "kpis"]
+
+def _shape(out: ComputeOut, detail: str) -> Dict[str, Any]:
+    """full = as before; compact = lines as columns keyed by code (see /api/costs/meta);
+    totals = breakdown totals only; kpis = KPIs only."""
+    if detail == "kpis":
+        return {"kpis": out.kpis}
+    b = out.breakdown
+    breakdown = {k: b[k] for k in vec.TOTAL_FIELDS}
+    if detail == "full":
+        return {"kpis": out.kpis, "breakdown": b}
+    if detail == "compact":
+        lines = b["lines"]
+        breakdown["lines"] = {k: [l[k] for l in lines] for k in ("code", "qty", "unit_amount_usd", "cost_usd")}
+        breakdown["route_legs"] = b["route_legs"]
+    return {"kpis": out.kpis, "breakdown": breakdown}
+
+COMPUTE_CACHE = ComputeCache(
+    maxsize=int(os.environ.get("COMPUTE_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("COMPUTE_CACHE_TTL", 300)),
+)
+
+@app.post("/api/compute", response_model=ComputeOut | ComputeKpisOut)
+@app.post("/compute",  response_model=ComputeOut | ComputeKpisOut)
+def compute(s: ScenarioIn, request: Request, detail: COMPUTE_DETAIL = "full"):
+    media = codec.negotiate(request.headers.get("accept"))
+    # piano risolto una volta: chiave/ETag e calcolo vengono dalla stessa versione anche se nel mezzo arriva un reload
+    plan = PLANS.get(s.destination, s.as_of)
+    key = scenario_key(s.model_dump(mode="json"), f"{plan.version}.{plan.segment}.{detail}.{media}")
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if request.headers.get("if-none-match") == etag:
+        COMPUTE_CACHE.note_not_modified()
+        return Response(status_code=304, headers=headers)
+    body = COMPUTE_CACHE.get(key)
+    if body is None:
+        with metrics.span("compute"):
+            out = _compute_internal(s, plan)
+        with metrics.span("serialize"):
+            body = codec.encode(_shape(out, detail), media)
+        COMPUTE_CACHE.put(key, body)
+    return Response(content=body, media_type=media, headers=headers)
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return {"cost_version": PLANS.version, "compute": COMPUTE_CACHE.stats()}
+
+# ------------ Metrics ------------
+metrics.REGISTRY.gauge("trade_cost_items", "Rows in the in-memory cost table", lambda: len(COSTS.items))
+metrics.REGISTRY.gauge("trade_cost_version", "Cost table version", lambda: COSTS.version)
+metrics.REGISTRY.gauge("trade_compiled_plans", "Compiled cost plans in the LRU", lambda: len(PLANS))
+metrics.REGISTRY.gauge("trade_compute_cache", "Compute response cache counters",
+                       lambda: {(k,): v for k, v in COMPUTE_CACHE.stats().items()}, labels=("stat",))
+
+@app.get("/metrics", include_in_schema=False)
+@app.get("/api/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+
+# ------------ Batch compute ------------
+class BatchIn(BaseModel):
+    scenarios: List[ScenarioIn] | None = None
+    columns: Dict[str, List[Any]] | None = None   # formato colonnare: {"destination": [...], "volume_mt": [...], ...}
+    detail: Literal["kpis", "totals", "full"] = "kpis"
+
+SCENARIO_DEFAULTS = {k: f.default for k, f in ScenarioIn.model_fields.items() if not f.is_required()}
+
+def _batch_columns(b: BatchIn):
+    if (b.scenarios is None) == (b.columns is None):
+        raise HTTPException(422, "Provide exactly one of 'scenarios' or 'columns'")
+    if b.scenarios is not None:
+        dest, cols = vec.columns_from_records([x.model_dump() for x in b.scenarios], SCENARIO_DEFAULTS)
+        return dest, cols, _segments([x.as_of for x in b.scenarios])
+    try:
+        dest, cols = vec.columns_from_payload(b.columns, SCENARIO_DEFAULTS)
+        as_of = [date.fromisoformat(v) if v else None for v in b.columns.get("as_of") or [None] * len(dest)]
+    except (TypeError, ValueError) as e:
+        raise HTTPException(422, str(e))
+    if len(as_of) != len(dest):
+        raise HTTPException(422, f"Column as_of has {len(as_of)} values, expected {len(dest)}")
+    return dest, cols, _segments(as_of)
+
+def _segments(as_of: List[date | None]) -> np.ndarray:
+    # una bisect per data distinta, non per riga
+    memo = {d: PLANS.segment(d) for d in set(as_of)}
+    return np.array([memo[d] for d in as_of], dtype=np.int64)
+
+def _batch_full(dest, cols, res, plans, inverse) -> List[dict]:
+    n = len(dest)
+    kpi_cols = {k: res[k].tolist() for k in vec.KPI_FIELDS}
+    tot_cols = {k: res[k].tolist() for k in vec.TOTAL_FIELDS}
+    lines_per_row: List[list] = [None] * n
+    for g, plan in enumerate(plans):
+        rows = np.nonzero(inverse == g)[0]
+        qty, cost = vec.line_costs(plan, res, rows, cols)
+        qty, cost = qty.tolist(), cost.tolist()
+        meta = list(zip(plan.codes, plan.names, plan.categories, plan.units, plan.amounts))
+        for r, q_row, c_row in zip(rows.tolist(), qty, cost):
+            lines_per_row[r] = [
+                {"code": code, "name": name, "category": cat, "qty": q, "unit": unit,
+                 "unit_amount_usd": amt, "cost_usd": c}
+                for (code, name, cat, unit, amt), q, c in zip(meta, q_row, c_row)
+            ]
+    out = []
+    for i in range(n):
+        breakdown = {k: tot_cols[k][i] for k in vec.TOTAL_FIELDS}
+        breakdown["lines"] = lines_per_row[i]
+        breakdown["route_legs"] = ROUTE_LEGS.get(dest[i], [])
+        out.append({"kpis": {k: kpi_cols[k][i] for k in vec.KPI_FIELDS}, "breakdown": breakdown})
+    return out
+
+@app.post("/api/compute/batch")
+@app.post("/compute/batch")
+def compute_batch(b: BatchIn, request: Request):
+    with metrics.span("columns"):
+        dest, cols, segments = _batch_columns(b)
+    with metrics.span("compute"):
+        res, plans, inverse = vec.evaluate_mixed(dest, cols, PLANS.get, segments)
+    metrics.BATCH_ROWS.observe(len(dest), "batch")
+    for d, n in zip(*np.unique(np.asarray(dest, dtype=str), return_counts=True)):
+        metrics.COMPUTES.inc(_dest_label(d), amount=int(n))
+    with metrics.span("serialize"):
+        out: Dict[str, Any] = {"count": len(dest), "cost_version": PLANS.version}
+        if b.detail == "full":
+            out["results"] = _batch_full(dest, cols, res, plans, inverse)
+        else:
+            out["kpis"] = {k: res[k].tolist() for k in vec.KPI_FIELDS}
+            if b.detail == "totals":
+                out["totals"] = {k: res[k].tolist() for k in vec.TOTAL_FIELDS}
+        body, media = codec.encode_response(out, request.headers.get("accept"))
+    return Response(content=body, media_type=media)
+
+# ------------ Saved deals ------------
+class DealIn(BaseModel):
+    scenario: ScenarioIn
+    name: str | None = None
+    deal_date: date | None = None                  # default: oggi
+    status: Literal["open", "closed"] = "open"     # i deal chiusi non vengono piu' riprezzati
+
+def _price_deals(scenarios: List[dict]) -> tuple:
+    """Pricing of stored scenarios (JSON dicts) for DealStore: version, KPI/total columns, plan codes
+    and priced_on (the day today's segment was resolved from, None with as_of) per deal."""
+    dest, cols = vec.columns_from_records(scenarios, SCENARIO_DEFAULTS)
+    today = date.today()
+    as_of = [date.fromisoformat(s["as_of"]) if s.get("as_of") else None for s in scenarios]
+    res, plans, inverse = vec.evaluate_mixed(dest, cols, PLANS.get, _segments([d or today for d in as_of]))
+    values = {f: [None if math.isnan(v) else v for v in res[f].tolist()] for f in vec.KPI_FIELDS + vec.TOTAL_FIELDS}
+    priced_on = [None if d else today.isoformat() for d in as_of]
+    return min(p.version for p in plans), values, [plans[g].codes for g in inverse.tolist()], priced_on
+
+def _deal_rows(deals: List[DealIn]) -> List[dict]:
+    today = date.today().isoformat()
+    return [{"name": d.name, "status": d.status, "deal_date": d.deal_date.isoformat() if d.deal_date else today,
+             "scenario": d.scenario.model_dump(mode="json")} for d in deals]
+
+def _deal(deal_id: int) -> dict:
+    deal = DEALS.get(deal_id)
+    if deal is None:
+        raise HTTPException(404, f"Deal not found: {deal_id}")
+    return deal
+
+@app.post("/api/deals")
+@app.post("/deals")
+def save_deal(deal: DealIn):
+    rows = _deal_rows([deal])
+    return _deal(DEALS.add(rows, _price_deals([r["scenario"] for r in rows]))[0])
+
+@app.post("/api/deals/bulk")
+@app.post("/deals/bulk")
+def save_deals(deals: List[DealIn]):
+    if not deals:
+        raise HTTPException(422, "No deals to save")
+    rows = _deal_rows(deals)
+    pricing = _price_deals([r["scenario"] for r in rows])
+    return {"count": len(rows), "ids": DEALS.add(rows, pricing), "cost_version": pricing[0]}
+
+@app.get("/api/deals")
+@app.get("/deals")
+def list_deals(destination: str | None = None, status: Literal["open", "closed"] | None = None,
+               min_margin_pct: float | None = None, max_margin_pct: float | None = None,
+               date_from: date | None = None, date_to: date | None = None, stale: bool | None = None,
+               order: str = "deal_date", desc: bool = True, limit: int = 100, offset: int = 0):
+    # solo colonne materializzate: nessun ricalcolo, anche su book grandi
+    try:
+        total, deals = DEALS.query(destination, status, min_margin_pct, max_margin_pct, date_from, date_to, stale,
+                                   order, desc, max(1, min(limit, 10_000)), max(0, offset))
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    return {"total": total, "cost_version": COSTS.version, "priced_version": DEALS.priced_version(), "deals": deals}
+
+@app.get("/api/deals/{deal_id}")
+@app.get("/deals/{deal_id}")
+def get_deal(deal_id: int):
+    return _deal(deal_id)
+
+@app.put("/api/deals/{deal_id}")
+@app.put("/deals/{deal_id}")
+def update_deal(deal_id: int, deal: DealIn):
+    rows = _deal_rows([deal])
+    if not DEALS.update(deal_id, rows[0], _price_deals([rows[0]["scenario"]])):
+        raise HTTPException(404, f"Deal not found: {deal_id}")
+    return _deal(deal_id)
+
+@app.delete("/api/deals/{deal_id}")
+@app.delete("/deals/{deal_id}")
+def delete_deal(deal_id: int):
+    if not DEALS.delete(deal_id):
+        raise HTTPException(404, f"Deal not found: {deal_id}")
+    return {"ok": True}
+
+@app.post("/api/deals/reprice")
+@app.post("/deals/reprice")
+def reprice_deals():
+    # di norma non serve: il repricer parte da solo a ogni nuova versione costi
+    return {"repriced": DEAL_REPRICER.sync(), "priced_version": DEALS.priced_version()}
+
+metrics.REGISTRY.gauge("trade_deals", "Saved deals (all, open, waiting for repricing)",
+                       lambda: {(k,): v for k, v in DEALS.stats().items()}, labels=("state",))
+
+# ------------ Cash-flow timeline ------------
+class CashflowDealIn(ScenarioIn):
+    start_date: date | None = None     # giorno 0 del deal (default: as_of, altrimenti oggi)
+
+class CashflowIn(BaseModel):
+    scenarios: List[CashflowDealIn] | None = None
+    columns: Dict[str, List[Any]] | None = None    # come /api/compute/batch, piu' la colonna start_date
+    saved: bool = False                            # tutti i deal salvati aperti, giorno 0 = deal_date
+    annual_rate_pct: float | None = None           # linea di credito; default: tasso dei deal pesato sul COGS
+    resolution: Literal["day", "week", "month"] = "day"
+    per_deal: bool = False
+
+def _cashflow_inputs(req: CashflowIn) -> tuple:
+    if (req.scenarios is not None) + (req.columns is not None) + req.saved != 1:
+        raise HTTPException(422, "Provide exactly one of 'scenarios', 'columns' or 'saved'")
+    today = date.today()
+    if req.saved:
+        rows = DEALS.open_scenarios()
+        if not rows:
+            raise HTTPException(422, "No open saved deals")
+        scenarios = [r[2] for r in rows]
+        dest, cols = vec.columns_from_records(scenarios, SCENARIO_DEFAULTS)
+        as_of = [date.fromisoformat(s["as_of"]) if s.get("as_of") else None for s in scenarios]
+        return dest, cols, _segments(as_of), [date.fromisoformat(r[1]) for r in rows]
+    if req.scenarios is not None:
+        starts = [s.start_date or s.as_of or today for s in req.scenarios]
+        dest, cols, segments = _batch_columns(BatchIn(scenarios=req.scenarios))
+        return dest, cols, segments, starts
+    columns = dict(req.columns)
+    start_col = columns.pop("start_date", None)
+    dest, cols, segments = _batch_columns(BatchIn(columns=columns))
+    as_of = columns.get("as_of") or [None] * len(dest)
+    try:
+        starts = [date.fromisoformat(s) if s else (date.fromisoformat(a) if a else today)
+                  for s, a in zip(start_col or [None] * len(dest), as_of)]
+    except (TypeError, ValueError) as e:
+        raise HTTPException(422, f"start_date: {e}")
+    if len(starts) != len(dest):
+        raise HTTPException(422, f"Column start_date has {len(starts)} values, expected {len(dest)}")
+    return dest, cols, segments, starts
+
+@app.post("/api/cashflow")
+@app.post("/cashflow")
+def portfolio_cashflow(req: CashflowIn, request: Request):
+    dest, cols, segments, starts = _cashflow_inputs(req)
+    if not len(dest):
+        raise HTTPException(422, "No deals")
+    with metrics.span("compute"):
+        res, plans, inverse = vec.evaluate_mixed(dest, cols, PLANS.get, segments)
+        coef_log, coef_ins = vec.stack_plans(plans)
+        days, amounts, kinds = cashflow.deal_events(cols, res, coef_log[inverse], coef_ins[inverse])
+        if not np.isfinite(amounts).all():
+            raise HTTPException(422, "Some deals have missing or non-numeric fields")
+        start = np.array([d.toordinal() for d in starts], dtype=np.int64)
+        try:
+            origin, curve = cashflow.portfolio_curve(start, days, amounts)
+        except ValueError as e:
+            raise HTTPException(422, str(e))
+        deal_peak, deal_interest = cashflow.deal_funding(days, amounts, cols["annual_finance_rate_pct"])
+
+    cogs = res["cogs"]
+    rate = req.annual_rate_pct
+    if rate is None:
+        rate = float(np.average(cols["annual_finance_rate_pct"], weights=cogs)) if cogs.sum() > 0 else 0.0
+    funding = curve["funding"]
+    peak_day = int(funding.argmax())
+    step = cashflow.RESOLUTIONS[req.resolution]
+    out: Dict[str, Any] = {
+        "deals": len(dest),
+        "cost_version": PLANS.version,
+        "start": date.fromordinal(origin).isoformat(),
+        "end": date.fromordinal(origin + funding.size - 1).isoformat(),
+        "annual_rate_pct": rate,
+        "peak_funding": float(funding[peak_day]),
+        "peak_date": date.fromordinal(origin + peak_day).isoformat(),
+        # interesse semplice sul saldo di fine giornata, fino all'ultimo evento (escluso, come per deal_funding)
+        "interest_cost": float(funding[:-1].sum() * rate / 100.0 / 365.0),
+        "funding_days": int(np.count_nonzero(funding > 0)),
+        "net_cash": float(curve["balance"][-1]),
+        "events": cashflow.event_totals(amounts, kinds),
+        # stessi deal finanziati uno per uno (senza compensare incassi e pagamenti) e modello NWC statico
+        "standalone": {"peak_funding": float(deal_peak.sum()), "interest_cost": float(deal_interest.sum())},
+        "static_finance_cost": float(res["finance"].sum()),
+        "resolution": req.resolution,
+        "curve": {"date": [date.fromordinal(origin + i).isoformat() for i in range(0, funding.size, step)],
+                  **cashflow.to_lists(cashflow.resample(curve, step))},
+    }
+    if req.per_deal:
+        out["per_deal"] = {"start_date": [d.isoformat() for d in starts], "peak_funding": deal_peak.tolist(),
+                           "interest_cost": deal_interest.tolist(), "static_finance_cost": res["finance"].tolist(),
+                           "net_cash": amounts.sum(axis=1).tolist()}
+    body, media = codec.encode_response(out, request.headers.get("accept"))
+    return Response(content=body, media_type=media)
+
+# ------------ Sensitivity sweep ------------
+class SweepAxis(BaseModel):
+    field: str                        # campo numerico di ScenarioIn
+    values: List[float] | None = None
+    start: float | None = None
+    stop: float | None = None
+    steps: int | None = None
+
+class SweepIn(BaseModel):
+    base: ScenarioIn
+    axes: List[SweepAxis]
+    kpis: List[str] | None = None     # default: tutti i KPI
+    chunk_size: int | None = None     # se valorizzato, risposta NDJSON a blocchi di ~chunk_size celle
+
+MAX_SWEEP_CELLS = 5_000_000
+MAX_SWEEP_CELLS_INLINE = 250_000
+
+def _sweep_inputs(req: SweepIn, max_cells: int) -> tuple:
+    """(header, grid columns, coef_log, coef_ins, kpis); 422/413 on a bad or too large grid."""
+    kpis = req.kpis or list(vec.KPI_FIELDS)
+    bad = [k for k in kpis if k not in vec.KPI_FIELDS + vec.TOTAL_FIELDS]
+    if bad:
+        raise HTTPException(422, f"Unknown kpis: {bad}")
+    # dimensione dai soli parametri, prima di allocare (steps=10**9 non deve arrivare a linspace)
+    cells = math.prod(len(a.values) if a.values is not None else max(a.steps or 0, 0) for a in req.axes)
+    if cells > max_cells:
+        raise HTTPException(413, f"Grid has {cells} cells (max {max_cells})")
+    try:
+        axes = [(a.field, sweep.axis_values(a.values, a.start, a.stop, a.steps)) for a in req.axes]
+        cols = sweep.grid_columns(req.base.model_dump(), axes)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    shape = tuple(v.size for _, v in axes)
+
+    plan = PLANS.get(req.base.destination, req.base.as_of)
+    coef_log, coef_ins = vec.stack_plans([plan])
+    header = {
+        "destination": req.base.destination,
+        "cost_version": plan.version,
+        "axes": [{"field": f, "values": v.tolist()} for f, v in axes],
+        "shape": list(shape),
+    }
+    return header, cols, coef_log[0], coef_ins[0], kpis, plan.terms
+
+@app.post("/api/sweep")
+@app.post("/sweep")
+def compute_sweep(req: SweepIn):
+    header, cols, coef_log, coef_ins, kpis, formulas = _sweep_inputs(req, MAX_SWEEP_CELLS)
+    shape = tuple(header["shape"])
+    cells = int(np.prod(shape))
+    if req.chunk_size is None:
+        if cells > MAX_SWEEP_CELLS_INLINE:
+            raise HTTPException(413, f"Grid has {cells} cells; use chunk_size to stream it")
+        header["kpis"] = sweep.to_lists(sweep.evaluate_grid(cols, coef_log, coef_ins, kpis, formulas))
+        return header
+
+    def stream():
+        yield json.dumps(header) + "\n"
+        for offset, block in sweep.iter_chunks(cols, shape, coef_log, coef_ins, kpis, max(1, req.chunk_size), formulas):
+            yield json.dumps({"offset": offset, "kpis": sweep.to_lists(block)}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# ------------ Solvers ------------
+class SolveIn(BaseModel):
+    scenario: ScenarioIn
+    target_net_margin_pct: float = 0.0   # frazione, come il KPI net_margin_pct (0.1 = 10%)
+
+@app.post("/api/solve")
+@app.post("/solve")
+def solve(req: SolveIn):
+    s = req.scenario
+    plan = PLANS.get(s.destination, s.as_of)
+    coef_log, coef_ins = vec.stack_plans([plan])
+    coef_log, coef_ins = coef_log[0], coef_ins[0]
+    cols = {f: vec._num(getattr(s, f)) for f in vec.NUMERIC_FIELDS}
+    if s.volume_mt <= 0:
+        raise HTTPException(422, "volume_mt must be > 0 to solve for prices")
+
+    be = solver.solve_price(cols, "sell_price_per_mt", 0.0, coef_log, coef_ins, increasing=True, formulas=plan.terms)
+    tgt = solver.solve_price(cols, "sell_price_per_mt", req.target_net_margin_pct, coef_log, coef_ins, increasing=True,
+                             formulas=plan.terms)
+    max_buy = solver.solve_price(cols, "buy_price_per_mt", req.target_net_margin_pct, coef_log, coef_ins, increasing=False,
+                                 formulas=plan.terms)
+    return {
+        "destination": s.destination,
+        "cost_version": plan.version,
+        "target_net_margin_pct": req.target_net_margin_pct,
+        "break_even_sell_per_mt": be["value"],
+        "target_sell_per_mt": tgt["value"],
+        "max_buy_per_mt": max_buy["value"],
+        "methods": {"break_even_sell": be["method"], "target_sell": tgt["method"], "max_buy": max_buy["method"]},
+        "thresholds": solver.step_thresholds(cols, coef_log, coef_ins),
+    }
+
+# ------------ Monte Carlo risk ------------
+class Distribution(BaseModel):
+    dist: Literal["fixed", "normal", "uniform", "triangular", "lognormal"]
+    value: float | None = None
+    mean: float | None = None
+    sd: float | None = None
+    low: float | None = None
+    high: float | None = None
+    mode: float | None = None
+
+class SimulateIn(BaseModel):
+    base: ScenarioIn
+    distributions: Dict[str, Distribution]   # campo di ScenarioIn (o "fx_multiplier") -> distribuzione
+    draws: int = 10_000
+    seed: int | None = None
+
+MAX_SIMULATE_DRAWS_INLINE = 500_000   # oltre: /api/jobs/simulate (fino a risk.MAX_DRAWS)
+
+def _simulate_inputs(req: SimulateIn) -> tuple:
+    """(base columns, spec, coef_log, coef_ins, plan); 422 on a bad spec."""
+    import risk  # process pool / multiprocessing: caricato solo al primo uso
+    if not 1 <= req.draws <= risk.MAX_DRAWS:
+        raise HTTPException(422, f"draws must be between 1 and {risk.MAX_DRAWS}")
+    spec = {k: v.model_dump() for k, v in req.distributions.items()}
+    try:
+        risk.validate_spec(spec)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    plan = PLANS.get(req.base.destination, req.base.as_of)
+    coef_log, coef_ins = vec.stack_plans([plan])
+    base = {f: vec._num(getattr(req.base, f)) for f in vec.NUMERIC_FIELDS}
+    return base, spec, coef_log[0], coef_ins[0], plan
+
+@app.post("/api/simulate")
+@app.post("/simulate")
+def simulate(req: SimulateIn):
+    import risk
+    base, spec, coef_log, coef_ins, plan = _simulate_inputs(req)
+    if req.draws > MAX_SIMULATE_DRAWS_INLINE:
+        raise HTTPException(413, f"{req.draws} draws (max {MAX_SIMULATE_DRAWS_INLINE} inline); "
+                                 f"submit it to /api/jobs/simulate")
+    out = risk.simulate(base, spec, coef_log, coef_ins, req.draws, req.seed, formulas=plan.terms)
+    out["destination"] = req.base.destination
+    out["cost_version"] = plan.version
+    return out
+
+# ------------ Compare destinations ------------
+class CompareDestIn(BaseModel):
+    destination: str
+    sell_usd_per_mt: float | None = None   # se None, usa sell_price_per_mt dello scenario
+
+@app.post("/api/compare")
+@app.post("/compare")
+def compare(scn: ScenarioIn, dests: List[CompareDestIn] | None = None):
+    if dests is None:
+        dests = [CompareDestIn(destination=d) for d in ROUTE_LEGS]
+    if not dests:
+        raise HTTPException(422, "dests must not be empty")
+    names = [d.destination for d in dests]
+    plans = [PLANS.get(d, scn.as_of) for d in names]
+    coef_log, coef_ins = vec.stack_plans(plans)
+
+    # un solo passaggio: solo sell price e coefficienti variano per destinazione,
+    # COGS / container / truck / parte AP-INV del finance restano scalari condivisi
+    cols = {f: np.asarray(vec._num(getattr(scn, f))) for f in vec.NUMERIC_FIELDS}
+    cols["sell_price_per_mt"] = np.array([
+        vec._num(d.sell_usd_per_mt if d.sell_usd_per_mt is not None else scn.sell_price_per_mt) for d in dests
+    ])
+    res = vec.evaluate(cols, coef_log, coef_ins, formulas=vec.plan_terms(plans, np.arange(len(plans))))
+
+    fields = vec.KPI_FIELDS + vec.TOTAL_FIELDS
+    table = {k: res[k].tolist() for k in fields}
+    order = sorted(range(len(dests)), key=lambda i: -table["net_margin"][i])
+    best = order[0]
+    ref = names.index(scn.destination) if scn.destination in names else best
+    rows = []
+    for rank, i in enumerate(order, start=1):
+        rows.append({
+            "rank": rank,
+            "destination": names[i],
+            "sell_price_per_mt": float(res["sell_unit"][i]),
+            "kpis": {k: table[k][i] for k in vec.KPI_FIELDS},
+            "totals": {k: table[k][i] for k in vec.TOTAL_FIELDS},
+            "delta_vs_best": {k: table[k][i] - table[k][best] for k in fields},
+            "delta_vs_base": {k: table[k][i] - table[k][ref] for k in fields},
+            "route_legs": ROUTE_LEGS.get(names[i], []),
+        })
+    return {
+        "base_destination": names[ref],
+        "best_destination": names[best],
+        "cost_version": PLANS.version,
+        "containers": int(res["containers"][0]),
+        "trucks": int(res["trucks"][0]),
+        "results": rows,
+    }
+
+# ------------ Portfolio (file) evaluation ------------
+@app.post("/api/portfolio/evaluate")
+@app.post("/portfolio/evaluate")
+def portfolio_evaluate(file: UploadFile = File(...), format: Literal["csv", "ndjson"] = "csv",
+                       chunk_rows: int = portfolio.DEFAULT_CHUNK_ROWS):
+    # una riga per deal, colonne = campi di ScenarioIn (+ deal_id opzionale).
+    # FastAPI chiude l'UploadFile al ritorno dell'endpoint, ma lo stream lo legge dopo:
+    # ci teniamo il file spooled e lo chiudiamo a fine stream.
+    src, file.file = file.file, io.BytesIO()
+    try:
+        chunks = portfolio.open_chunks(file.filename or "", src, max(1, chunk_rows))
+        results = portfolio.evaluate_chunks(chunks, PLANS.get, PLANS.segment, SCENARIO_DEFAULTS)
+        first = next(results, None)   # errori di intestazione/primo blocco -> 4xx invece di stream troncato
+        # nei blocchi successivi le righe non valide escono marcate nella colonna "error"
+        bad = [i for i, err in enumerate(first[2]["error"]) if err] if first is not None else []
+        if bad:
+            raise ValueError(f"rows {first[0] + bad[0]}-{first[0] + bad[-1]}: {first[2]['error'][bad[0]]}")
+    except (RuntimeError, ValueError) as e:
+        src.close()
+        raise HTTPException(415 if isinstance(e, RuntimeError) else 422, str(e))
+
+    def all_results():
+        try:
+            for offset, raw, res in itertools.chain([first] if first is not None else [], results):
+                metrics.BATCH_ROWS.observe(len(raw["destination"]), "portfolio")
+                yield offset, raw, res
+        finally:
+            src.close()
+
+    writer = portfolio.to_csv if format == "csv" else portfolio.to_ndjson
+    media = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(writer(all_results()), media_type=media)
+
+# ------------ Route network ------------
+ROUTE_OPTIMIZER = routes.RouteOptimizer()
+
+@app.get("/api/routes/network")
+@app.get("/routes/network")
+def route_network(as_of: date | None = None):
+    segment = PLANS.segment(as_of)
+    legs = ROUTE_OPTIMIZER.rates(PLANS.version, segment, lambda: PLANS.items(segment))
+    return {"cost_version": PLANS.version, "nodes": routes.NODES, "origins": list(routes.ORIGINS), "legs": legs}
+
+class RouteSearchIn(BaseModel):
+    scenario: ScenarioIn
+    origins: List[str] | None = None           # default: tutti i porti
+    destination_node: str | None = None        # default: scenario.destination
+    metric: Literal["cost", "time"] = "cost"
+    k: int = 3
+
+@app.post("/api/routes/optimize")
+@app.post("/routes/optimize")
+def route_optimize(req: RouteSearchIn):
+    s = req.scenario
+    dst = req.destination_node or s.destination
+    origins = req.origins or list(routes.ORIGINS)
+    unknown = [n for n in origins + [dst] if n not in routes.NODES]
+    if unknown:
+        raise HTTPException(422, f"Unknown nodes: {unknown}")
+    if not 1 <= req.k <= 20:
+        raise HTTPException(422, "k must be between 1 and 20")
+    n_cntr = containers_needed(s.volume_mt, s.mt_per_container)
+    n_trk = trucks_needed(s.volume_mt, s.mt_per_truck)
+    segment = PLANS.segment(s.as_of)
+    found = ROUTE_OPTIMIZER.best(PLANS.version, segment, lambda: PLANS.items(segment), origins, dst,
+                                 s.volume_mt, n_cntr, n_trk, req.metric, req.k)
+    return {"cost_version": PLANS.version, "metric": req.metric, "containers": n_cntr, "trucks": n_trk, "routes": found}
+
+# ------------ Load planning ------------
+class LoadMode(BaseModel):
+    mt_per_container: float
+    mt_per_truck: float
+
+class LoadPlanIn(BaseModel):
+    scenario: ScenarioIn
+    min_volume_mt: float
+    max_volume_mt: float
+    dests: List[CompareDestIn] | None = None     # default: solo scenario.destination
+    modes: List[LoadMode] | None = None          # default: payload dello scenario
+    max_splits: int = 1
+    top: int = 5
+
+@app.post("/api/loadplan")
+@app.post("/loadplan")
+def loadplan(req: LoadPlanIn):
+    s = req.scenario
+    if not 0 < req.min_volume_mt <= req.max_volume_mt:
+        raise HTTPException(422, "Need 0 < min_volume_mt <= max_volume_mt")
+    if not 1 <= req.max_splits <= load_plan.MAX_SPLITS:
+        raise HTTPException(422, f"max_splits must be between 1 and {load_plan.MAX_SPLITS}")
+    dests = req.dests or [CompareDestIn(destination=s.destination)]
+    modes = req.modes or [LoadMode(mt_per_container=s.mt_per_container, mt_per_truck=s.mt_per_truck)]
+    if any(m.mt_per_container <= 0 or m.mt_per_truck <= 0 for m in modes):
+        raise HTTPException(422, "mt_per_container and mt_per_truck must be > 0")
+
+    base = {f: vec._num(getattr(s, f)) for f in vec.NUMERIC_FIELDS}
+    options = []
+    for d in dests:
+        plan = PLANS.get(d.destination, s.as_of)
+        coef_log, coef_ins = vec.stack_plans([plan])
+        sell = vec._num(d.sell_usd_per_mt if d.sell_usd_per_mt is not None else s.sell_price_per_mt)
+        for m in modes:
+            mode = m.model_dump()
+            n = load_plan.candidate_count(req.max_volume_mt, m.mt_per_container, m.mt_per_truck)
+            if n > load_plan.MAX_CANDIDATES:     # prima di allocare i candidati
+                raise HTTPException(422, f"Too many candidate volumes ({n:.0f}); "
+                                         f"max {load_plan.MAX_CANDIDATES} per destination/mode")
+            volumes = load_plan.candidate_volumes(req.min_volume_mt, req.max_volume_mt,
+                                                  m.mt_per_container, m.mt_per_truck)
+            res = load_plan.evaluate_option(base, volumes, sell, mode, coef_log[0], coef_ins[0], plan.terms)
+            options.append({"destination": d.destination, "mode": mode, "volumes": volumes, "res": res})
+
+    plans = load_plan.search(options, req.min_volume_mt, req.max_volume_mt, req.max_splits, max(1, req.top))
+    current = _compute_internal(s).kpis
+    return {
+        "cost_version": PLANS.version,
+        "current": {"destination": s.destination, "volume_mt": s.volume_mt,
+                    "net_margin": current["net_margin"], "net_margin_per_mt": current["net_margin_per_mt"]},
+        "best": plans[0] if plans else None,
+        "plans": plans,
+    }
+
+# ------------ Background jobs ------------
+# book interi, griglie oltre MAX_SWEEP_CELLS, simulazioni lunghe: process pool separato,
+# stato e risultati in JOBS_DIR; /api/compute non si accorge del job che gira
+JOBS = jobs.JobQueue(os.environ.get("JOBS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs")),
+                     workers=int(os.environ.get("JOBS_WORKERS", 0)) or max(1, (os.cpu_count() or 2) - 1),
+                     nice=int(os.environ.get("JOBS_NICE", 10)),
+                     ttl_seconds=float(os.environ.get("JOBS_TTL_SECONDS", 7 * 86400)),
+                     scan_seconds=float(os.environ.get("JOBS_SCAN_SECONDS", 20)))
+MAX_JOB_SWEEP_CELLS = 50_000_000
+JOB_SWEEP_CHUNK = 100_000
+
+metrics.REGISTRY.gauge("trade_jobs", "Background jobs in JOBS_DIR by status (as of the last scan)", JOBS.counts,
+                       labels=("status",))
+
+def _job_accepted(state: dict) -> Response:
+    return Response(codec.encode(state, "application/json"), status_code=202, media_type="application/json",
+                    headers={"Location": f"/api/jobs/{state['id']}"})
 
-@app.post("/api/compute", response_model=ComputeOut)
-@app.post("/compute",  response_model=ComputeOut)
-def compute(s: ScenarioIn):
-    return _compute_internal(s)
+@app.post("/api/jobs/simulate", status_code=202)
+@app.post("/jobs/simulate", status_code=202)
+def submit_simulate(req: SimulateIn):
+    base, spec, coef_log, coef_ins, plan = _simulate_inputs(req)
+    extra = {"destination": req.base.destination, "cost_version": plan.version}
+    job_id = JOBS.create("simulate", {**extra, "draws": req.draws})
+    return _job_accepted(JOBS.submit(job_id, "simulate", {
+        "base": base, "spec": spec, "coef_log": coef_log, "coef_ins": coef_ins,
+        "draws": req.draws, "seed": req.seed, "extra": extra, "formulas": plan.terms}))
 
+@app.post("/api/jobs/sweep", status_code=202)
+@app.post("/jobs/sweep", status_code=202)
+def submit_sweep(req: SweepIn):
+    header, cols, coef_log, coef_ins, kpis, formulas = _sweep_inputs(req, MAX_JOB_SWEEP_CELLS)
+    job_id = JOBS.create("sweep", {"destination": header["destination"], "cost_version": header["cost_version"],
+                                   "shape": header["shape"]}, result="ndjson")
+    return _job_accepted(JOBS.submit(job_id, "sweep", {
+        "header": header, "cols": cols, "coef_log": coef_log, "coef_ins": coef_ins, "kpis": kpis,
+        "chunk_size": max(1, req.chunk_size or JOB_SWEEP_CHUNK), "formulas": formulas}))
+
+@app.post("/api/jobs/portfolio", status_code=202)
+@app.post("/jobs/portfolio", status_code=202)
+def submit_portfolio(file: UploadFile = File(...), format: Literal["csv", "ndjson"] = "csv",
+                     chunk_rows: int = portfolio.DEFAULT_CHUNK_ROWS):
+    # il book viene prezzato alla versione costi del submit, anche se la tabella cambia durante il job
+    version, items = COSTS.current()
+    name = "input.parquet" if (file.filename or "").lower().endswith((".parquet", ".pq")) else "input.csv"
+    job_id = JOBS.create("portfolio", {"filename": file.filename, "cost_version": version}, result=format)
+    with open(os.path.join(JOBS.dir(job_id), name), "wb") as f:
+        shutil.copyfileobj(file.file, f)
+    return _job_accepted(JOBS.submit(job_id, "portfolio", {
+        "input_name": name, "fmt": format, "chunk_rows": max(1, chunk_rows),
+        "cost_rows": [c.model_dump() for c in items], "cost_version": version, "defaults": SCENARIO_DEFAULTS}))
+
+def _job(job_id: str) -> dict:
+    try:
+        return JOBS.get(job_id)
+    except KeyError:
+        raise HTTPException(404, f"Job not found: {job_id}")
+
+@app.get("/api/jobs")
+@app.get("/jobs")
+def list_jobs(limit: int = 50):
+    return JOBS.list(max(1, min(limit, 1000)))
+
+@app.get("/api/jobs/{job_id}")
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    return _job(job_id)
+
+@app.get("/api/jobs/{job_id}/events")
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, interval: float = 0.5):
+    # NDJSON: una riga per ogni cambio di stato/progresso, fino a done/failed/cancelled.
+    # async + sleep: chi segue un job non occupa un thread del threadpool
+    state = _job(job_id)
+
+    async def stream():
+        last = None
+        current = state
+        while True:
+            if current != last:
+                yield json.dumps(current) + "\n"
+                last = current
+            if current["status"] in jobs.FINISHED:
+                return
+            await asyncio.sleep(max(0.1, interval))
+            current = _job(job_id)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/api/jobs/{job_id}/result")
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str, partial: bool = False):
+    state = _job(job_id)
+    media = jobs.RESULT_MEDIA[state["result"]]
+    path = JOBS.result_path(job_id)
+    if state["status"] == "done":
+        return FileResponse(path, media_type=media)
+    if not partial or (state["status"] in ("failed", "cancelled") and not os.path.exists(path)):
+        raise HTTPException(409, f"Job is {state['status']}" + (f": {state['error']}" if state["error"] else ""))
+    if state["result"] == "json":
+        return {"status": state["status"], "progress": state["progress"], "partial": state["partial"]}
+    # righe gia' scritte, tagliate all'ultimo a-capo
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b""
+    return Response(data[:data.rfind(b"\n") + 1], media_type=media, headers={"X-Job-Status": state["status"]})
+
+@app.delete("/api/jobs/{job_id}")
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    _job(job_id)
+    return JOBS.cancel(job_id)
+
+# ------------ Live pricing (WebSocket) ------------
+LIVE_DEBOUNCE_SECONDS = float(os.environ.get("LIVE_DEBOUNCE_MS", 40)) / 1000.0
+
+async def _live_message(ws: WebSocket) -> tuple | None:
+    """(set, seq) of the next message; None, after an error frame, if it is not {"seq": n, "set": {...}}."""
+    try:
+        msg = await ws.receive_json()
+    except ValueError:                       # JSON non valido (il messaggio e' gia' consumato)
+        msg = None
+    if isinstance(msg, dict) and isinstance(msg.get("set") or {}, dict):
+        return dict(msg.get("set") or {}), msg.get("seq")
+    seq = msg.get("seq") if isinstance(msg, dict) else None
+    await ws.send_json({"seq": seq, "error": [{"type": "invalid_message",
+                                               "msg": 'Expected {"seq": n, "set": {field: value}}'}]})
+    return None
+
+@app.websocket("/api/ws/pricing")
+@app.websocket("/ws/pricing")
+async def pricing_ws(ws: WebSocket):
+    # messaggi: {"seq": n, "set": {campo: valore}}; il primo deve completare lo scenario.
+    # I diff che arrivano entro LIVE_DEBOUNCE_MS vengono fusi in un solo frame.
+    await ws.accept()
+    session = live.PricingSession(lambda d: ScenarioIn(**d), PLANS.get, lambda: PLANS.version)
+    try:
+        while True:
+            if (first := await _live_message(ws)) is None:
+                continue
+            diff, seq = first
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + LIVE_DEBOUNCE_SECONDS
+            while (left := deadline - loop.time()) > 0:
+                try:
+                    nxt = await asyncio.wait_for(_live_message(ws), left)
+                except asyncio.TimeoutError:
+                    break
+                if nxt is not None:
+                    diff.update(nxt[0])
+                    seq = nxt[1] if nxt[1] is not None else seq
+            # come fresh_costs: col poller attivo niente DB, altrimenti lettura nel threadpool
+            if not COSTS.polling and COSTS.refresh_due:
+                await run_in_threadpool(COSTS.maybe_refresh)
+            try:
+                frame = session.apply(diff)
+            except ValidationError as e:
+                await ws.send_json({"seq": seq, "error": e.errors(include_url=False, include_context=False, include_input=False)})
+                continue
+            frame["seq"] = seq
+            await ws.send_json(frame)
+    except WebSocketDisconnect:
+        pass
 
+# ------------ CLI: snapshot / startup budget ------------
+if __name__ == "__main__":
+    import argparse
+    import sys
+    ap = argparse.ArgumentParser(description="Cold-start helpers.")
+    ap.add_argument("--write-snapshot", action="store_true", help="write COSTS_SNAPSHOT_PATH from the cost store")
+    ap.add_argument("--check-startup", action="store_true",
+                    help="import + warmup + first /api/compute, exit 1 if over STARTUP_BUDGET_SECONDS")
+    args = ap.parse_args()
+    if args.write_snapshot:
+        write_snapshot(COSTS_SNAPSHOT_PATH, *COST_STORE.load())
+        print(f"snapshot v{COSTS.version} written to {COSTS_SNAPSHOT_PATH}")
+    if args.check_startup:
+        t_import = time.perf_counter()
+        from fastapi.testclient import TestClient   # non fa parte dell'avvio reale: tempo escluso
+        t_import = time.perf_counter() - t_import
+        with TestClient(app) as client:   # esegue il lifespan (warmup)
+            client.post("/api/compute", json={"destination": "LUB", "volume_mt": 100, "buy_price_per_mt": 400,
+                                              "dpo_buy_days": 30, "dso_sell_days": 30, "storage_months": 1,
+                                              "annual_finance_rate_pct": 10}).raise_for_status()
+            elapsed = time.perf_counter() - STARTUP_T0 - t_import
+        print(f"time to first response: {elapsed:.3f}s (budget {STARTUP_BUDGET_SECONDS:.3f}s)")
+        sys.exit(0 if elapsed <= STARTUP_BUDGET_SECONDS else 1)
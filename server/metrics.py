@@ -0,0 +1,198 @@
+"""In-process metrics (Prometheus text format) and per-request timing spans.
+
+Niente dipendenze esterne: istogrammi a bucket fissi, contatori e gauge
+calcolati al momento dello scrape. Gli span (`with span("compute")`) finiscono
+sia nell'istogramma per fase sia, se il client manda `X-Profile: 1`, nello
+header `Server-Timing` della risposta.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import bisect
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+PROFILE_HEADER = b"x-profile"
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for lv, v in sorted(self._values.items()):
+                out.append(f"{self.name}{_labels(self.labels, lv)} {v}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}   # labels -> [counts per bucket (+Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            s[0][i] += 1
+            s[1] += value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for lv, (counts, total) in sorted(self._series.items()):
+                cum = 0
+                for le, c in zip(self.buckets + (float("inf"),), counts):
+                    cum += c
+                    le_label = 'le="%s"' % ("+Inf" if le == float("inf") else repr(le))
+                    out.append(f"{self.name}_bucket{_labels(self.labels, lv, le_label)} {cum}")
+                out.append(f"{self.name}_sum{_labels(self.labels, lv)} {total}")
+                out.append(f"{self.name}_count{_labels(self.labels, lv)} {cum}")
+        return out
+
+
+class Gauge:
+    """Value read at scrape time: fn() -> number or {labels tuple: number}."""
+
+    def __init__(self, name: str, help: str, fn: Callable, labels: Sequence[str] = ()):
+        self.name, self.help, self.fn, self.labels = name, help, fn, tuple(labels)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.fn()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for lv, v in items:
+            out.append(f"{self.name}{_labels(self.labels, lv)} {float(v)}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *a, **kw) -> Counter:
+        return self.register(Counter(*a, **kw))
+
+    def histogram(self, *a, **kw) -> Histogram:
+        return self.register(Histogram(*a, **kw))
+
+    def gauge(self, *a, **kw) -> Gauge:
+        return self.register(Gauge(*a, **kw))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram("trade_http_request_duration_seconds", "HTTP request latency",
+                                     ("method", "route", "status"))
+PHASE_SECONDS = REGISTRY.histogram("trade_request_phase_seconds",
+                                   "Time per request phase (refresh, validate, compute, serialize)",
+                                   ("route", "phase"))
+COMPUTES = REGISTRY.counter("trade_computes_total", "Scenarios evaluated per destination", ("destination",))
+BATCH_ROWS = REGISTRY.histogram("trade_batch_rows", "Rows per batch / portfolio chunk", ("endpoint",),
+                                buckets=SIZE_BUCKETS)
+
+# ------------ Spans ------------
+_request: ContextVar[Optional[dict]] = ContextVar("trade_request", default=None)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    ctx = _request.get()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if ctx is not None:
+            ctx["spans"].append((name, t0, time.perf_counter()))
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency per route, phase histograms and opt-in Server-Timing.
+
+    "validate" is the gap between the end of the cost refresh dependency and the
+    first span opened by the endpoint (body parsing + pydantic validation).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        ctx = {"spans": []}
+        token = _request.set(ctx)
+        profile = any(k == PROFILE_HEADER and v not in (b"", b"0") for k, v in scope.get("headers", ()))
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if profile:
+                    timing = _server_timing(_phases(ctx["spans"]), time.perf_counter() - t0)
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", timing)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, scope["method"], route, str(status[0]))
+            for phase, dur in _phases(ctx["spans"]).items():
+                PHASE_SECONDS.observe(dur, route, phase)
+
+
+def _phases(spans: List[tuple]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    refresh_end = None
+    first_other = None
+    for name, a, b in spans:
+        out[name] = out.get(name, 0.0) + (b - a)
+        if name == "refresh":
+            refresh_end = b
+        elif first_other is None or a < first_other:
+            first_other = a
+    if refresh_end is not None and first_other is not None and first_other > refresh_end:
+        out["validate"] = first_other - refresh_end
+    return out
+
+
+def _server_timing(phases: Dict[str, float], total: float) -> bytes:
+    parts = [f"{k};dur={v * 1000:.3f}" for k, v in phases.items()]
+    parts.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(parts).encode()
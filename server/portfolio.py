@@ -0,0 +1,188 @@
+"""Streaming portfolio evaluation: CSV/Parquet of deals -> CSV/NDJSON of KPIs.
+
+Una riga = uno ScenarioIn (colonne con gli stessi nomi). Il file viene letto
+a blocchi di `chunk_rows` righe, ogni blocco viene valutato con il modello
+vettoriale e scritto subito: la memoria resta costante qualunque sia la
+dimensione del file, e non si costruisce nessun oggetto pydantic per riga.
+
+CLI:
+    python portfolio.py deals.csv -o out.csv [--format csv|ndjson] [--chunk-rows 20000]
+"""
+from datetime import date
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+import argparse
+import csv
+import io
+import json
+import sys
+import numpy as np
+
+import vector_engine as vec
+
+ID_COLUMN = "deal_id"  # se presente viene riportata in output
+# "error": righe con celle non valide, KPI vuoti (il resto del file continua)
+OUTPUT_FIELDS: Tuple[str, ...] = ("row", ID_COLUMN, "destination") + vec.KPI_FIELDS + vec.TOTAL_FIELDS + ("error",)
+DEFAULT_CHUNK_ROWS = 20_000
+
+
+def iter_csv_chunks(stream: IO[str], chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[Dict[str, List]]:
+    reader = csv.reader(stream)
+    header = [h.strip() for h in next(reader, [])]
+    if not header:
+        return
+    buf: List[List[str]] = []
+    for row in reader:
+        if not row:
+            continue
+        buf.append(row)
+        if len(buf) >= chunk_rows:
+            yield _columns(header, buf)
+            buf = []
+    if buf:
+        yield _columns(header, buf)
+
+
+def _columns(header: Sequence[str], rows: Sequence[Sequence[str]]) -> Dict[str, List]:
+    cols = list(zip(*(r + [""] * (len(header) - len(r)) for r in rows)))
+    return {h: list(c) for h, c in zip(header, cols)}
+
+
+def iter_parquet_chunks(source, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[Dict[str, List]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:  # dipendenza opzionale
+        raise RuntimeError("Parquet input needs pyarrow (pip install pyarrow)")
+    for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_rows):
+        yield batch.to_pydict()
+
+
+def _floats(values: Sequence, default, name: str, errors: Dict[int, str]) -> np.ndarray:
+    fill = np.nan if default is None else float(default)
+    out = np.empty(len(values), dtype=float)
+    for i, v in enumerate(values):
+        try:
+            out[i] = fill if v is None or v == "" else float(v)
+        except (TypeError, ValueError) as e:
+            out[i] = np.nan
+            errors.setdefault(i, f"{name}: {e}")
+    return out
+
+
+def _dates(values: Sequence, errors: Dict[int, str]) -> List[Optional[date]]:
+    out = []
+    for i, v in enumerate(values):
+        if v is None or v == "" or isinstance(v, date):
+            out.append(v or None)
+            continue
+        try:
+            out.append(date.fromisoformat(str(v)[:10]))
+        except ValueError as e:
+            out.append(None)
+            errors.setdefault(i, f"as_of: {e}")
+    return out
+
+
+def evaluate_chunks(chunks: Iterable[Mapping[str, Sequence]], plan_for: Callable, segment_for: Callable,
+                    defaults: Mapping) -> Iterator[Tuple[int, Dict[str, np.ndarray], Dict]]:
+    """Yield (first row index, raw chunk columns, results) per chunk.
+
+    Raises ValueError on missing columns. Rows with malformed cells get NaN
+    results and a message in ``results["error"]`` (None for good rows).
+    """
+    offset = 0
+    for raw in chunks:
+        n = len(next(iter(raw.values()), []))
+        if "destination" not in raw:
+            raise ValueError("Missing column: destination")
+        missing = [f for f in vec.NUMERIC_FIELDS if f not in raw and f not in defaults]
+        if missing:
+            raise ValueError(f"rows {offset}-{offset + n - 1}: Missing column: {missing[0]}")
+        errors: Dict[int, str] = {}
+        cols = {f: _floats(raw[f], defaults.get(f), f, errors) if f in raw else np.full(n, vec._num(defaults[f]))
+                for f in vec.NUMERIC_FIELDS}
+        as_of = _dates(raw["as_of"], errors) if "as_of" in raw else [None] * n
+        memo = {d: segment_for(d) for d in set(as_of)}
+        segments = np.array([memo[d] for d in as_of], dtype=np.int64)
+        dest = np.array([str(d).strip().upper() for d in raw["destination"]], dtype=object)
+        res, _, _ = vec.evaluate_mixed(dest, cols, plan_for, segments)
+        error = np.full(n, None, dtype=object)
+        if errors:
+            bad = np.zeros(n, dtype=bool)
+            bad[list(errors)] = True
+            res = {k: np.where(bad, np.nan, v) if v.dtype.kind == "f" else v for k, v in res.items()}
+            error[list(errors)] = list(errors.values())
+        res["error"] = error
+        yield offset, raw, res
+        offset += n
+
+
+def _rows(offset: int, raw: Mapping[str, Sequence], res: Mapping[str, np.ndarray]) -> Iterator[List]:
+    n = len(raw["destination"])
+    ids = raw.get(ID_COLUMN) or [None] * n
+    values = [_nullable(res[k]) for k in vec.KPI_FIELDS + vec.TOTAL_FIELDS] + [res["error"].tolist()]
+    for i in range(n):
+        yield [offset + i, ids[i], raw["destination"][i]] + [v[i] for v in values]
+
+
+def _nullable(arr: np.ndarray) -> List:
+    # righe con campi obbligatori vuoti danno NaN: in output diventano celle vuote / null
+    nan = np.isnan(arr)
+    if not nan.any():
+        return arr.tolist()
+    out = arr.astype(object)
+    out[nan] = None
+    return out.tolist()
+
+
+def to_csv(results: Iterable) -> Iterator[str]:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(OUTPUT_FIELDS)
+    for offset, raw, res in results:
+        w.writerows(_rows(offset, raw, res))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def to_ndjson(results: Iterable) -> Iterator[str]:
+    for offset, raw, res in results:
+        yield "".join(json.dumps(dict(zip(OUTPUT_FIELDS, r))) + "\n" for r in _rows(offset, raw, res))
+
+
+def open_chunks(path: str, stream: IO[bytes], chunk_rows: int) -> Iterator[Dict[str, List]]:
+    if path.lower().endswith((".parquet", ".pq")):
+        return iter_parquet_chunks(stream, chunk_rows)
+    return iter_csv_chunks(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""), chunk_rows)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Evaluate a deal book (CSV/Parquet) chunk by chunk.")
+    ap.add_argument("input")
+    ap.add_argument("-o", "--output", default="-")
+    ap.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    ap.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    args = ap.parse_args(argv)
+
+    import main as app_main  # usa la stessa tabella costi del server
+    writer = to_csv if args.format == "csv" else to_ndjson
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    try:
+        with open(args.input, "rb") as f:
+            chunks = open_chunks(args.input, f, args.chunk_rows)
+            results = evaluate_chunks(chunks, app_main.PLANS.get, app_main.PLANS.segment, app_main.SCENARIO_DEFAULTS)
+            for piece in writer(results):
+                out.write(piece)
+    except (ValueError, RuntimeError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
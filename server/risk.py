@@ -0,0 +1,142 @@
+"""Monte Carlo risk engine for deal margins.
+
+Le estrazioni vengono valutate con il modello vettoriale (vector_engine);
+oltre SHARD_SIZE estrazioni il lavoro viene diviso in shard indipendenti
+(SeedSequence.spawn) ed eseguito su un process pool.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Mapping, Optional, Tuple
+import multiprocessing
+import os
+import threading
+import numpy as np
+
+import vector_engine as vec
+
+FX_FIELD = "fx_multiplier"          # moltiplicatore sui costi logistici a tariffa
+SIM_FIELDS = vec.NUMERIC_FIELDS + (FX_FIELD,)
+DISTRIBUTIONS = ("fixed", "normal", "uniform", "triangular", "lognormal")
+SHARD_SIZE = 250_000
+MAX_DRAWS = 10_000_000
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def validate_spec(spec: Mapping[str, Mapping]) -> None:
+    """Raise ValueError if a distribution spec is malformed."""
+    for field, d in spec.items():
+        if field not in SIM_FIELDS:
+            raise ValueError(f"Cannot simulate {field!r}; allowed: {list(SIM_FIELDS)}")
+        kind = d.get("dist")
+        if kind not in DISTRIBUTIONS:
+            raise ValueError(f"{field}: unknown dist {kind!r}; allowed: {list(DISTRIBUTIONS)}")
+        need = {"fixed": ("value",), "normal": ("mean", "sd"), "uniform": ("low", "high"),
+                "triangular": ("low", "mode", "high"), "lognormal": ("mean", "sd")}[kind]
+        missing = [p for p in need if d.get(p) is None]
+        if missing:
+            raise ValueError(f"{field}: {kind} needs {missing}")
+        if kind in ("normal", "lognormal") and d["sd"] < 0:
+            raise ValueError(f"{field}: sd must be >= 0")
+        if kind == "lognormal" and d["mean"] <= 0:
+            raise ValueError(f"{field}: lognormal mean must be > 0")
+        if kind == "uniform" and d["low"] > d["high"]:
+            raise ValueError(f"{field}: low must be <= high")
+        if kind == "triangular" and not d["low"] <= d["mode"] <= d["high"]:
+            raise ValueError(f"{field}: need low <= mode <= high")
+
+
+def draw(rng: np.random.Generator, d: Mapping, n: int) -> np.ndarray:
+    kind = d["dist"]
+    if kind == "fixed":
+        x = np.full(n, float(d["value"]))
+    elif kind == "normal":
+        x = rng.normal(d["mean"], d["sd"], n)
+    elif kind == "uniform":
+        x = rng.uniform(d["low"], d["high"], n)
+    elif kind == "triangular":
+        x = rng.triangular(d["low"], d["mode"], d["high"], n) if d["low"] < d["high"] else np.full(n, float(d["mode"]))
+    else:
+        # lognormal parametrizzata su media/sd della variabile (non del log)
+        mean, sd = float(d["mean"]), float(d["sd"])
+        sigma2 = np.log1p((sd / mean) ** 2)
+        x = rng.lognormal(np.log(mean) - sigma2 / 2, np.sqrt(sigma2), n)
+    lo, hi = d.get("low"), d.get("high")
+    if kind in ("normal", "lognormal") and (lo is not None or hi is not None):
+        x = np.clip(x, lo, hi)
+    return np.maximum(x, 0.0)
+
+
+def run_shard(base: Mapping[str, float], spec: Mapping[str, Mapping], coef_log: np.ndarray,
+              coef_ins: np.ndarray, n: int, seed: np.random.SeedSequence, formulas=None) -> Tuple[np.ndarray, float]:
+    """Simulate n draws; returns (net_margin array, sum of finance cost)."""
+    rng = np.random.default_rng(seed)
+    cols = {f: np.asarray(base[f], dtype=float) for f in vec.NUMERIC_FIELDS}
+    fx = None
+    for field, d in spec.items():
+        if field == FX_FIELD:
+            fx = draw(rng, d, n)
+        else:
+            cols[field] = draw(rng, d, n)
+    res = vec.evaluate(cols, coef_log, coef_ins, fx_multiplier=fx, formulas=formulas)
+    net = np.broadcast_to(res["net_margin"], (n,))
+    fin = np.broadcast_to(res["finance"], (n,))
+    return np.ascontiguousarray(net), float(fin.sum())
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.environ.get("RISK_WORKERS", 0)) or os.cpu_count() or 1
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shards(draws: int, seed: Optional[int] = None) -> Tuple[np.random.SeedSequence, List[int], List]:
+    """(root SeedSequence, shard sizes, shard seeds): same split whoever runs the shards."""
+    ss = np.random.SeedSequence(seed)
+    n_shards = max(1, -(-draws // SHARD_SIZE))
+    sizes = [SHARD_SIZE] * (n_shards - 1) + [draws - SHARD_SIZE * (n_shards - 1)]
+    return ss, sizes, ss.spawn(n_shards)
+
+
+def simulate(base: Mapping[str, float], spec: Mapping[str, Mapping], coef_log: np.ndarray,
+             coef_ins: np.ndarray, draws: int, seed: Optional[int] = None,
+             parallel: Optional[bool] = None, formulas=None) -> Dict[str, object]:
+    ss, sizes, seeds = shards(draws, seed)
+    if parallel is None:
+        parallel = len(sizes) > 1
+    if parallel:
+        pool = _get_pool()
+        # le formule viaggiano come testo (FormulaTerms / Formula sono picklable)
+        futures = [pool.submit(run_shard, dict(base), dict(spec), coef_log, coef_ins, n, sq, formulas)
+                   for n, sq in zip(sizes, seeds)]
+        results = [f.result() for f in futures]
+    else:
+        results = [run_shard(base, spec, coef_log, coef_ins, n, sq, formulas) for n, sq in zip(sizes, seeds)]
+    return summarise(results, ss.entropy, len(sizes))
+
+
+def summarise(results: List[Tuple[np.ndarray, float]], entropy, n_shards: int) -> Dict[str, object]:
+    """Summary over the shards simulated so far (all of them for the final result)."""
+    net = np.concatenate([r[0] for r in results])
+    finance_sum = sum(r[1] for r in results)
+    draws = net.size
+    p5, p50, p95 = np.percentile(net, [5, 50, 95])
+    return {
+        "draws": int(draws),
+        "shards": n_shards,
+        "seed": entropy,
+        "net_margin": {
+            "mean": float(net.mean()),
+            "std": float(net.std()),
+            "p5": float(p5),
+            "p50": float(p50),
+            "p95": float(p95),
+            "min": float(net.min()),
+            "max": float(net.max()),
+        },
+        "prob_loss": float(np.count_nonzero(net < 0) / draws),
+        "expected_finance_cost": finance_sum / draws,
+    }
@@ -0,0 +1,170 @@
+"""Multi-leg route network and k-cheapest / k-fastest route search.
+
+Ogni tratta elenca i codici costo della tabella che la riguardano: le
+tariffe (per truck / container / ton / spedizione) vengono lette dallo
+snapshot costi, quindi una modifica via PUT /api/costs cambia subito i pesi
+del grafo. Il peso di una tratta per uno scenario usa il numero di truck e
+container gia' arrotondato per eccesso (funzioni a gradino).
+"""
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+import heapq
+import threading
+
+NODES: Dict[str, Dict[str, str]] = {
+    "DAR": {"name": "Dar es Salaam", "kind": "port"},
+    "KASUMBALESA": {"name": "Kasumbalesa", "kind": "border"},
+    "LUB": {"name": "Lubumbashi", "kind": "warehouse"},
+    "KOL": {"name": "Kolwezi", "kind": "warehouse"},
+    "MATADI": {"name": "Matadi", "kind": "port"},
+    "KIN": {"name": "Kinshasa", "kind": "warehouse"},
+}
+
+DRC_BORDER_CODES = ["DRC_SEGQUE_TRK", "DRC_DGDA_SEAL_TRK", "DRC_OPS_TRK", "DRC_DOSSIER_TRK",
+                    "DRC_AGENCY_TRK", "DRC_FERI_CNTR", "DRC_OGEFREM_TRK", "INSP_BIVAC"]
+
+# (from, to, transit_days, cost codes)
+LEGS: List[Tuple[str, str, float, List[str]]] = [
+    ("DAR", "KASUMBALESA", 8, ["TRK_TZ_DRC_LINEHAUL", "CLR_TZ_CNTR", "HND_TZ_CNTR"]),
+    ("KASUMBALESA", "LUB", 1, DRC_BORDER_CODES),
+    ("KASUMBALESA", "KOL", 3, [f"KOL_{c}" for c in DRC_BORDER_CODES] + ["KOL_INLAND_PER_MT"]),
+    ("LUB", "KOL", 2, ["HND_LUB_TON", "KOL_INLAND_PER_MT"]),
+    ("MATADI", "KIN", 3, ["TRN_MAT_KIN_CNTR", "HND_KIN_TCK_CNTR", "SHIP_LINE_CNTR", "MAIRF_CNTR",
+                          "AQUAI_CNTR", "FUMIG_CNTR", "FERI_CNTR", "ADM_FERI_CNTR", "AD_CERT_CNTR",
+                          "AD_ADMIN_CNTR", "LIQ_ESEAL_CNTR", "TECH_FEES_CNTR", "OPS_ADMIN_CNTR",
+                          "FILE_OPEN_CNTR", "BANK_FEES_CNTR", "SEGQUE_CNTR", "AGENCY_CNTR"]),
+]
+ORIGINS = tuple(n for n, v in NODES.items() if v["kind"] == "port")
+RATE_KEYS = {"per_truck": "per_truck", "per_container": "per_container", "per_ton": "per_ton",
+             "fixed_per_shipment": "fixed"}
+
+
+def leg_rates(items: Iterable) -> List[Dict]:
+    """Resolve each leg's codes against the (already as-of filtered) cost items."""
+    by_code: Dict[str, object] = {}
+    for it in items:
+        by_code.setdefault(it.code, it)
+    out = []
+    for frm, to, days, codes in LEGS:
+        rates = {"per_truck": 0.0, "per_container": 0.0, "per_ton": 0.0, "fixed": 0.0}
+        found, missing = [], []
+        for code in codes:
+            it = by_code.get(code)
+            key = RATE_KEYS.get(getattr(it, "behavior", None))
+            if it is None or key is None:
+                missing.append(code)
+                continue
+            rates[key] += float(it.unit_amount_usd)
+            found.append(code)
+        out.append({"from": frm, "to": to, "transit_days": float(days), **rates,
+                    "cost_codes": found, "unpriced_codes": missing})
+    return out
+
+
+def leg_cost(leg: Mapping, volume_mt: float, n_cntr: int, n_trk: int) -> float:
+    return (leg["per_truck"] * n_trk + leg["per_container"] * n_cntr
+            + leg["per_ton"] * volume_mt + leg["fixed"])
+
+
+def _dijkstra(adj: Mapping[str, List[Tuple[str, float, int]]], src: str, dst: str,
+              banned_nodes: set, banned_edges: set) -> Optional[Tuple[float, List[str], List[int]]]:
+    heap = [(0.0, src, [src], [])]
+    seen = set()
+    while heap:
+        w, node, path, legs = heapq.heappop(heap)
+        if node == dst:
+            return w, path, legs
+        if node in seen:
+            continue
+        seen.add(node)
+        for nxt, cost, leg_idx in adj.get(node, ()):
+            if nxt in banned_nodes or nxt in seen or (node, nxt) in banned_edges:
+                continue
+            heapq.heappush(heap, (w + cost, nxt, path + [nxt], legs + [leg_idx]))
+    return None
+
+
+def k_shortest(weights: Sequence[float], src: str, dst: str, k: int) -> List[Tuple[float, List[str], List[int]]]:
+    """Yen's k loopless shortest paths over LEGS with the given per-leg weights."""
+    adj: Dict[str, List[Tuple[str, float, int]]] = {}
+    for i, (frm, to, _, _) in enumerate(LEGS):
+        adj.setdefault(frm, []).append((to, weights[i], i))
+    first = _dijkstra(adj, src, dst, set(), set())
+    if first is None:
+        return []
+    found = [first]
+    candidates: List[Tuple[float, List[str], List[int]]] = []
+    while len(found) < k:
+        _, last_path, last_legs = found[-1]
+        for j in range(len(last_path) - 1):
+            spur, root, root_legs = last_path[j], last_path[:j + 1], last_legs[:j]
+            banned_edges = {(p[1][j], p[1][j + 1]) for p in found if p[1][:j + 1] == root and len(p[1]) > j + 1}
+            spur_res = _dijkstra(adj, spur, dst, set(root[:-1]), banned_edges)
+            if spur_res is None:
+                continue
+            cost = sum(weights[i] for i in root_legs) + spur_res[0]
+            cand = (cost, root[:-1] + spur_res[1], root_legs + spur_res[2])
+            if all(cand[1] != c[1] for c in candidates) and all(cand[1] != f[1] for f in found):
+                heapq.heappush(candidates, cand)
+        if not candidates:
+            break
+        found.append(heapq.heappop(candidates))
+    return found
+
+
+class RouteOptimizer:
+    """k-best routes with a small LRU of results, dropped on every cost version."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._version = None
+        self._rates: Dict[int, List[Dict]] = {}
+        self._results: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+
+    def _check_version(self, version) -> None:
+        if version != self._version:
+            self._version = version
+            self._rates = {}
+            self._results = OrderedDict()
+
+    def rates(self, version, segment: int, items_for_segment) -> List[Dict]:
+        with self._lock:
+            self._check_version(version)
+            rates = self._rates.get(segment)
+            if rates is None:
+                rates = self._rates[segment] = leg_rates(items_for_segment())
+            return rates
+
+    def best(self, version, segment: int, items_for_segment, origins: Sequence[str], dst: str,
+             volume_mt: float, n_cntr: int, n_trk: int, metric: str, k: int) -> List[Dict]:
+        key = (segment, tuple(origins), dst, volume_mt, n_cntr, n_trk, metric, k)
+        with self._lock:
+            self._check_version(version)
+            hit = self._results.get(key)
+            if hit is not None:
+                self._results.move_to_end(key)
+                return hit
+        legs = self.rates(version, segment, items_for_segment)
+        costs = [leg_cost(l, volume_mt, n_cntr, n_trk) for l in legs]
+        weights = costs if metric == "cost" else [l["transit_days"] for l in legs]
+        routes = []
+        for origin in origins:
+            for _, path, idx in k_shortest(weights, origin, dst, k):
+                routes.append({
+                    "path": path,
+                    "legs": [{"from": legs[i]["from"], "to": legs[i]["to"], "cost_usd": costs[i],
+                              "transit_days": legs[i]["transit_days"]} for i in idx],
+                    "cost_usd": sum(costs[i] for i in idx),
+                    "transit_days": sum(legs[i]["transit_days"] for i in idx),
+                    "cost_per_mt": (sum(costs[i] for i in idx) / volume_mt) if volume_mt else 0,
+                })
+        sort_key = "cost_usd" if metric == "cost" else "transit_days"
+        routes.sort(key=lambda r: (r[sort_key], r["cost_usd"], r["transit_days"]))
+        routes = routes[:k]
+        with self._lock:
+            if version == self._version:
+                self._results[key] = routes
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        return routes
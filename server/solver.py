@@ -0,0 +1,136 @@
+"""Break-even / target-margin solvers on top of the compiled cost plans.
+
+A volume fissato (quindi container e truck fissi) il modello e' affine nel
+prezzo di vendita e in quello di acquisto, a parte il finance NWC che e'
+rate * max(0, u) con u affine. Ricaviamo i coefficienti con due valutazioni
+del modello vettoriale e risolviamo in forma chiusa sui due tratti; se la
+verifica sul modello vero fallisce (costi non lineari) si ripiega sulla
+bisezione.
+"""
+from typing import Callable, Dict, Mapping, Optional, Tuple
+import numpy as np
+
+import vector_engine as vec
+
+PROBES = np.array([1.0, 2.0])
+REL_TOL = 1e-9
+
+
+def _evaluate(cols: Mapping[str, float], field: str, x: np.ndarray, coef_log, coef_ins, finance: bool = True,
+              formulas=None):
+    c = {f: np.asarray(v, dtype=float) for f, v in cols.items()}
+    c[field] = np.asarray(x, dtype=float)
+    if not finance:
+        c["annual_finance_rate_pct"] = np.asarray(0.0)
+    return vec.evaluate(c, coef_log, coef_ins, formulas=formulas)
+
+
+def _residual(res, target_pct: float):
+    """net_margin - target * revenue: zero when net_margin_pct == target."""
+    return res["net_margin"] - target_pct * res["gross_revenue"]
+
+
+def _affine(y: np.ndarray) -> Tuple[float, float]:
+    slope = float(y[1] - y[0]) / float(PROBES[1] - PROBES[0])
+    return float(y[0]) - slope * float(PROBES[0]), slope
+
+
+def _finance_arg(res, cols: Mapping[str, float]):
+    inv_days = max(0.0, float(cols["storage_months"]) * 30.0)
+    return (res["gross_revenue"] * (float(cols["dso_sell_days"]) / 365.0)
+            + res["cogs"] * ((inv_days - float(cols["dpo_buy_days"])) / 365.0))
+
+
+def _roots(h: Tuple[float, float], u: Tuple[float, float], rate: float):
+    """Roots of g(x) = h(x) - rate * max(0, u(x)) with h, u affine (intercept, slope)."""
+    out = []
+    pieces = ((h, False), ((h[0] - rate * u[0], h[1] - rate * u[1]), True))
+    for (a, b), active in pieces:
+        if b == 0:
+            continue
+        x = -a / b
+        ux = u[0] + u[1] * x
+        tol = 1e-9 * max(1.0, abs(u[0]), abs(u[1] * x))
+        if (active and ux >= -tol) or (not active and ux <= tol):
+            out.append(x)
+    return sorted(set(out))
+
+
+def _bisect(fn: Callable[[float], float], lo: float, hi: float, iters: int = 200) -> Optional[float]:
+    flo, fhi = fn(lo), fn(hi)
+    if flo == 0:
+        return lo
+    if np.sign(flo) == np.sign(fhi):
+        return None
+    for _ in range(iters):
+        mid = 0.5 * (lo + hi)
+        fm = fn(mid)
+        if fm == 0 or hi - lo <= 1e-12 * max(1.0, abs(mid)):
+            return mid
+        if np.sign(fm) == np.sign(flo):
+            lo, flo = mid, fm
+        else:
+            hi = mid
+    return 0.5 * (lo + hi)
+
+
+def solve_price(cols: Mapping[str, float], field: str, target_pct: float, coef_log, coef_ins,
+                increasing: bool, upper: float = 1e7, formulas=None) -> Dict[str, object]:
+    """Solve net_margin_pct == target_pct for `field` (a per-MT price).
+
+    `increasing=True` returns the lowest price at which the target is reached
+    (sell side); `increasing=False` the highest price that still reaches it
+    (buy side). Formula lines (`formulas`, plan.terms) may make the model
+    non-affine: the closed form then fails its check and bisection takes over.
+    """
+    rate = float(cols["annual_finance_rate_pct"]) / 100.0
+    res_nf = _evaluate(cols, field, PROBES, coef_log, coef_ins, finance=False, formulas=formulas)
+    h = _affine(_residual(res_nf, target_pct))
+    u = _affine(_finance_arg(res_nf, cols))
+
+    def g(x: float) -> float:
+        return float(_residual(_evaluate(cols, field, np.asarray(x), coef_log, coef_ins, formulas=formulas), target_pct))
+
+    roots = [x for x in _roots(h, u, rate) if x > 0]
+    if increasing:
+        roots = [x for x in roots if g(x * (1 + 1e-6) + 1e-6) >= 0]
+        x = roots[0] if roots else None
+    else:
+        roots = [x for x in roots if g(max(0.0, x * (1 - 1e-6) - 1e-6)) >= 0]
+        x = roots[-1] if roots else None
+
+    if x is not None:
+        scale = max(1.0, float(np.max(np.abs(res_nf["gross_revenue"]))) * x)
+        if abs(g(x)) <= 1e-6 * scale:
+            return {"value": x, "method": "closed_form"}
+
+    # fallback: il modello non e' affine a tratti (o nessuna radice valida)
+    x = _bisect(g, 1e-9, upper)
+    return {"value": x, "method": "bisection" if x is not None else "no_solution"}
+
+
+def step_thresholds(cols: Mapping[str, float], coef_log, coef_ins) -> Dict[str, float]:
+    """Current container/truck counts and how much volume they still carry.
+
+    `containers_full_at_mt` (n * capacity) is the last volume that fits in the
+    current containers: any volume above it adds one (ceil), the boundary
+    itself doesn't. `container_headroom_mt` is the distance to it. Same for
+    trucks.
+    """
+    V = float(cols["volume_mt"])
+    cap_c = max(float(cols["mt_per_container"]), 0.0001)
+    cap_t = max(float(cols["mt_per_truck"]), 0.0001)
+    n_c, n_t = (int(x) for x in vec.unit_counts(np.asarray(V), cap_c, cap_t))
+    # coefficienti per_container / per_truck (indice 1 e 2 in BEHAVIORS)
+    step_c = float(coef_log[1] + coef_ins[1])
+    step_t = float(coef_log[2] + coef_ins[2])
+    return {
+        "containers": n_c,
+        "containers_full_at_mt": n_c * cap_c,
+        "container_headroom_mt": n_c * cap_c - V,
+        "container_step_cost_usd": step_c,
+        "trucks": n_t,
+        "trucks_full_at_mt": n_t * cap_t,
+        "truck_headroom_mt": n_t * cap_t - V,
+        "truck_step_cost_usd": step_t,
+    }
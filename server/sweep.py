@@ -0,0 +1,77 @@
+"""Sensitivity grids over up to three numeric ScenarioIn fields.
+
+Ogni asse resta un array 1-D rimodellato sulla propria dimensione, quindi il
+lavoro che dipende da un solo campo (es. ceil di container/truck su volume_mt)
+viene fatto una volta per valore dell'asse e poi broadcastato sulla griglia.
+"""
+from typing import Dict, Iterator, List, Mapping, Sequence, Tuple
+import numpy as np
+
+import vector_engine as vec
+
+MAX_AXES = 3
+
+
+def axis_values(values: Sequence[float] | None, start: float | None, stop: float | None,
+                steps: int | None) -> np.ndarray:
+    if values is not None:
+        if start is not None or stop is not None or steps is not None:
+            raise ValueError("Give either 'values' or 'start'/'stop'/'steps', not both")
+        arr = np.asarray(values, dtype=float)
+    else:
+        if start is None or stop is None or steps is None:
+            raise ValueError("Range axes need 'start', 'stop' and 'steps'")
+        if steps < 1:
+            raise ValueError("'steps' must be >= 1")
+        arr = np.linspace(start, stop, steps)
+    if arr.ndim != 1 or arr.size == 0:
+        raise ValueError("Axis values must be a non-empty list")
+    return arr
+
+
+def grid_columns(base: Mapping, axes: Sequence[Tuple[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """Scenario columns where axis i varies along dimension i only."""
+    fields = [f for f, _ in axes]
+    if not 1 <= len(axes) <= MAX_AXES:
+        raise ValueError(f"Between 1 and {MAX_AXES} axes are supported")
+    bad = [f for f in fields if f not in vec.NUMERIC_FIELDS]
+    if bad:
+        raise ValueError(f"Cannot sweep over {bad}; allowed: {list(vec.NUMERIC_FIELDS)}")
+    if len(set(fields)) != len(fields):
+        raise ValueError("Each field can be swept only once")
+    ndim = len(axes)
+    cols = {f: np.asarray(vec._num(base.get(f)), dtype=float) for f in vec.NUMERIC_FIELDS}
+    for i, (f, values) in enumerate(axes):
+        shape = [1] * ndim
+        shape[i] = values.size
+        cols[f] = values.reshape(shape)
+    return cols
+
+
+def _slice_first_axis(cols: Mapping[str, np.ndarray], i0: int, i1: int) -> Dict[str, np.ndarray]:
+    out = {}
+    for f, v in cols.items():
+        out[f] = v[i0:i1] if v.ndim and v.shape[0] > 1 else v
+    return out
+
+
+def evaluate_grid(cols: Mapping[str, np.ndarray], coef_log: np.ndarray, coef_ins: np.ndarray,
+                  kpis: Sequence[str], formulas=None) -> Dict[str, np.ndarray]:
+    res = vec.evaluate(cols, coef_log, coef_ins, formulas=formulas)
+    return {k: res[k] for k in kpis}
+
+
+def iter_chunks(cols: Mapping[str, np.ndarray], shape: Tuple[int, ...], coef_log: np.ndarray,
+                coef_ins: np.ndarray, kpis: Sequence[str], chunk_cells: int,
+                formulas=None) -> Iterator[Tuple[int, Dict[str, np.ndarray]]]:
+    """Yield (first-axis offset, kpi blocks) covering the grid in ~chunk_cells pieces."""
+    inner = int(np.prod(shape[1:])) if len(shape) > 1 else 1
+    step = max(1, chunk_cells // inner)
+    for i0 in range(0, shape[0], step):
+        i1 = min(shape[0], i0 + step)
+        block = _slice_first_axis(cols, i0, i1)
+        yield i0, evaluate_grid(block, coef_log, coef_ins, kpis, formulas)
+
+
+def to_lists(kpis: Mapping[str, np.ndarray]) -> Dict[str, List]:
+    return {k: v.tolist() for k, v in kpis.items()}
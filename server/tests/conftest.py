@@ -0,0 +1,38 @@
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# DB usa-e-getta: main.py inizializza lo store all'import
+os.environ["COSTS_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="trade-tests-"), "costs.db")
+os.environ["JOBS_DIR"] = os.path.join(os.path.dirname(os.environ["COSTS_DB_PATH"]), "jobs")
+os.environ.setdefault("JOBS_WORKERS", "1")
+
+from reference_model import EXTRA_ITEMS, GOLDEN_PATH  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app_main():
+    import main
+    for row in EXTRA_ITEMS:
+        main.COST_STORE.insert(main.CostItem(**row).model_dump())
+    main.COSTS.reload()
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app_main):
+    from fastapi.testclient import TestClient
+    return TestClient(app_main.app)
+
+
+@pytest.fixture(scope="session")
+def golden():
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        return json.load(f)["cases"]
@@ -0,0 +1,199 @@
+"""Reference model: the original per-item loop of _compute_internal, kept verbatim.
+
+Serve solo a generare e verificare i golden: qualunque motore piu' veloce
+deve dare gli stessi numeri al centesimo.
+
+    python tests/reference_model.py     # rigenera tests/golden/compute.json
+"""
+from typing import Dict, List, Mapping, Sequence
+import json
+import math
+import os
+import random
+import tempfile
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "golden", "compute.json")
+GOLDEN_SEED = 20240601
+N_CASES = 240
+DESTINATIONS = ("LUB", "KIN", "KOL", "TST")
+
+# voci aggiuntive per la destinazione di test TST: coprono ogni behavior
+# (anche sconosciuto) e le categorie che non entrano nei totali
+EXTRA_ITEMS: List[Dict] = [
+    {"code": "TST_TON", "name": "Test per ton", "behavior": "per_ton", "unit_amount_usd": 12.5,
+     "unit": "MT", "qty_source": "Volume_MT", "dest_scope": "TST*", "category": "logistics"},
+    {"code": "TST_CNTR", "name": "Test per container", "behavior": "per_container", "unit_amount_usd": 310.0,
+     "unit": "Container", "qty_source": "Containers", "dest_scope": "TST*", "category": "logistics"},
+    {"code": "TST_TRK", "name": "Test per truck", "behavior": "per_truck", "unit_amount_usd": 4150.0,
+     "unit": "Truck", "qty_source": "Trucks", "dest_scope": "TST*", "category": "logistics"},
+    {"code": "TST_MONTH", "name": "Test per month", "behavior": "per_month", "unit_amount_usd": 875.0,
+     "unit": "Month", "qty_source": "Storage_Months", "dest_scope": "TST*", "category": "logistics"},
+    {"code": "TST_TON_MONTH", "name": "Test per ton per month", "behavior": "per_ton_per_month",
+     "unit_amount_usd": 1.75, "unit": "MT-Month", "qty_source": "Volume_MT", "dest_scope": "TST*",
+     "category": "logistics"},
+    {"code": "TST_FIXED", "name": "Test fixed", "behavior": "fixed_per_shipment", "unit_amount_usd": 1999.99,
+     "unit": "Shipment", "qty_source": "1", "dest_scope": "TST*", "category": "logistics"},
+    {"code": "TST_VALUE_LOG", "name": "Test % of value (logistics)", "behavior": "percent_of_value",
+     "unit_amount_usd": 0.0035, "unit": "%", "qty_source": "Value_USD", "dest_scope": "TST*", "category": "logistics"},
+    {"code": "TST_COGS_INS", "name": "Test % of COGS (insurance)", "behavior": "percent_of_cogs",
+     "unit_amount_usd": 0.0021, "unit": "%", "qty_source": "COGS_USD", "dest_scope": "TST*", "category": "insurance"},
+    {"code": "TST_CNTR_INS", "name": "Test per container (insurance)", "behavior": "per_container",
+     "unit_amount_usd": 45.0, "unit": "Container", "qty_source": "Containers", "dest_scope": "TST*",
+     "category": "insurance"},
+    {"code": "TST_FINANCE_TON", "name": "Test line outside totals", "behavior": "per_ton", "unit_amount_usd": 3.0,
+     "unit": "MT", "qty_source": "Volume_MT", "dest_scope": "TST*", "category": "finance"},
+    {"code": "TST_UNKNOWN", "name": "Test unknown behavior", "behavior": "per_pallet", "unit_amount_usd": 99.0,
+     "unit": "Pallet", "qty_source": "1", "dest_scope": "TST*", "category": "logistics"},
+    {"code": "COGS_BITUMEN_TST", "name": "Bitumen purchase", "behavior": "per_ton", "unit_amount_usd": 0.0,
+     "unit": "MT", "qty_source": "Volume_MT", "dest_scope": "TST*", "category": "product"},
+]
+
+
+def reference_compute(s: Mapping, items: Sequence[Mapping]) -> Dict:
+    sell_unit = s["sell_price_per_mt"] if s.get("sell_price_per_mt") not in (None, 0) else s["buy_price_per_mt"]
+    buy_unit = s["buy_price_per_mt"]
+    volume = s["volume_mt"]
+
+    n_cntr = int(math.ceil(volume / max(s["mt_per_container"], 0.0001)))
+    n_trk = int(math.ceil(volume / max(s["mt_per_truck"], 0.0001)))
+    revenue = volume * sell_unit
+    cogs_total = volume * buy_unit
+
+    lines: List[Dict] = []
+    total_log = 0.0
+    total_ins = 0.0
+    for item in items:
+        if not item["dest_scope"].startswith(s["destination"]):
+            continue
+        if item["category"] == "product" and item["code"].startswith("COGS_"):
+            continue
+        b, amt = item["behavior"], item["unit_amount_usd"]
+        if b == "per_ton":
+            qty = volume
+            cost = qty * amt
+        elif b == "per_container":
+            qty = n_cntr
+            cost = qty * amt
+        elif b == "per_truck":
+            qty = n_trk
+            cost = qty * amt
+        elif b == "per_month":
+            qty = s["storage_months"]
+            cost = qty * amt
+        elif b == "per_ton_per_month":
+            qty = volume * s["storage_months"]
+            cost = qty * amt
+        elif b == "fixed_per_shipment":
+            qty = 1
+            cost = amt
+        elif b == "percent_of_value":
+            qty = 1
+            cost = revenue * amt
+        elif b == "percent_of_cogs":
+            qty = 1
+            cost = cogs_total * amt
+        else:
+            qty = 0
+            cost = 0
+        lines.append({"code": item["code"], "qty": qty, "cost_usd": cost})
+        if item["category"] == "logistics":
+            total_log += cost
+        elif item["category"] == "insurance":
+            total_ins += cost
+
+    shrink_loss = (s["shrinkage_pct"] / 100.0) * cogs_total
+    partner_profit = (s["partner_profit_pct"] / 100.0) * sell_unit * volume
+    rate = s["annual_finance_rate_pct"] / 100.0
+    inv_days = max(0.0, s["storage_months"] * 30.0)
+    AR = revenue * (s["dso_sell_days"] / 365.0)
+    INV = cogs_total * (inv_days / 365.0)
+    AP = cogs_total * (s["dpo_buy_days"] / 365.0)
+    finance_cost = rate * max(0.0, AR + INV - AP)
+
+    total_cost = cogs_total + total_log + total_ins + shrink_loss + finance_cost + partner_profit
+    net_margin = revenue - total_cost
+    return {
+        "kpis": {
+            "gross_revenue": revenue,
+            "total_cost": total_cost,
+            "net_margin": net_margin,
+            "net_margin_pct": (net_margin / revenue) if revenue else 0,
+            "net_margin_per_mt": (net_margin / volume) if volume else 0,
+            "break_even_sell_per_mt": (total_cost / volume) if volume else 0,
+        },
+        "breakdown": {
+            "cogs": cogs_total,
+            "logistics_excl_cogs_ins": total_log,
+            "insurance": total_ins,
+            "shrinkage": shrink_loss,
+            "finance": finance_cost,
+            "partner_profit": partner_profit,
+            "lines": lines,
+        },
+    }
+
+
+def golden_scenarios(n: int = N_CASES, seed: int = GOLDEN_SEED) -> List[Dict]:
+    """Deterministic mix of realistic and edge-case scenarios."""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        cntr = rnd.choice([40, 40, 25])
+        trk = rnd.choice([58, 58, 34])
+        volume = rnd.choice([
+            round(rnd.uniform(20, 3000), 1), rnd.randint(1, 40) * cntr, rnd.randint(1, 30) * trk,
+            rnd.randint(1, 30) * trk + 1, 0.5, 0,
+        ])
+        out.append({
+            "destination": DESTINATIONS[i % len(DESTINATIONS)],
+            "incoterm": rnd.choice(["CFR", "FOB"]),
+            "volume_mt": volume,
+            "buy_price_per_mt": round(rnd.uniform(300, 650), 2),
+            "sell_price_per_mt": rnd.choice([None, 0, round(rnd.uniform(450, 1100), 2)]),
+            "shrinkage_pct": rnd.choice([0.0, 0.5, round(rnd.uniform(0, 3), 2)]),
+            "storage_months": rnd.choice([0, 1, 2, 0.5, 3.25]),
+            "dpo_buy_days": rnd.choice([0, 30, 60, rnd.randint(0, 120)]),
+            "dso_sell_days": rnd.choice([0, 30, 45, rnd.randint(0, 120)]),
+            "annual_finance_rate_pct": rnd.choice([0.0, 8.5, 12.0, round(rnd.uniform(0, 25), 2)]),
+            "partner_profit_pct": rnd.choice([0.0, 5.0, round(rnd.uniform(0, 10), 2)]),
+            "mt_per_container": cntr,
+            "mt_per_truck": trk,
+        })
+    return out
+
+
+def _cents(x: float) -> float:
+    return round(float(x), 2)
+
+
+def build_golden(items: Sequence[Mapping]) -> List[Dict]:
+    cases = []
+    for s in golden_scenarios():
+        ref = reference_compute(s, items)
+        b = ref["breakdown"]
+        cases.append({
+            "scenario": s,
+            # importi (anche per MT) al centesimo; net_margin_pct e' una frazione
+            "kpis": {k: (round(v, 8) if k == "net_margin_pct" else _cents(v)) for k, v in ref["kpis"].items()},
+            "totals": {k: _cents(v) for k, v in b.items() if k != "lines"},
+            "lines": [[l["code"], l["qty"], _cents(l["cost_usd"])] for l in b["lines"]],
+        })
+    return cases
+
+
+def seed_items() -> List[Dict]:
+    """Seed cost table of main.py plus EXTRA_ITEMS, in table order."""
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from main import seed_costs
+    return [c.model_dump() for c in seed_costs()] + [dict(it) for it in EXTRA_ITEMS]
+
+
+if __name__ == "__main__":
+    os.makedirs(os.path.dirname(GOLDEN_PATH), exist_ok=True)
+    os.environ.setdefault("COSTS_DB_PATH", os.path.join(tempfile.mkdtemp(), "golden.db"))
+    golden = build_golden(seed_items())
+    with open(GOLDEN_PATH, "w", encoding="utf-8") as f:
+        json.dump({"seed": GOLDEN_SEED, "cases": golden}, f, indent=0, separators=(",", ":"))
+        f.write("\n")
+    print(f"wrote {len(golden)} cases to {GOLDEN_PATH}")
@@ -0,0 +1,28 @@
+"""Cash-flow timeline: events add up to the margin, portfolio netting vs deals financed one by one."""
+import pytest
+
+DEAL = {"destination": "LUB", "volume_mt": 580, "buy_price_per_mt": 420, "sell_price_per_mt": 900,
+        "dpo_buy_days": 30, "dso_sell_days": 45, "storage_months": 1.5, "annual_finance_rate_pct": 10,
+        "start_date": "2026-11-02"}
+
+
+def test_single_deal_timeline(client):
+    out = client.post("/api/cashflow", json={"scenarios": [DEAL], "per_deal": True}).json()
+    computed = client.post("/api/compute", json=DEAL).json()
+    assert out["net_cash"] == pytest.approx(computed["kpis"]["net_margin"] + computed["breakdown"]["finance"])
+    assert sum(out["events"].values()) == pytest.approx(out["net_cash"])
+    assert out["start"] == "2026-11-02" and out["end"] == "2027-01-31"   # 45 giorni di stock + 45 di DSO
+    assert out["peak_date"] == "2026-12-17"                              # ultimo mese di storage, prima dell'incasso
+    assert out["interest_cost"] == pytest.approx(out["standalone"]["interest_cost"])
+    assert out["per_deal"]["peak_funding"] == [out["peak_funding"]]
+
+
+def test_portfolio_nets_receipts_against_payments(client):
+    later = dict(DEAL, start_date="2026-12-20")   # i picchi dei due deal non cadono lo stesso giorno
+    week = client.post("/api/cashflow", json={"scenarios": [DEAL, later], "resolution": "week"}).json()
+    day = client.post("/api/cashflow", json={"scenarios": [DEAL, later]}).json()
+    assert day["peak_funding"] < day["standalone"]["peak_funding"]
+    assert max(week["curve"]["funding"]) == pytest.approx(day["peak_funding"])
+    assert week["curve"]["balance"][-1] == pytest.approx(day["curve"]["balance"][-1])
+    assert len(week["curve"]["date"]) == -(-len(day["curve"]["date"]) // 7)
+    assert client.post("/api/cashflow", json={"scenarios": [DEAL], "saved": True}).status_code == 422
@@ -0,0 +1,28 @@
+"""Destination compare: each row equals /api/compute for that destination."""
+import pytest
+
+SCENARIO = {"destination": "LUB", "volume_mt": 580, "buy_price_per_mt": 420, "sell_price_per_mt": 700,
+            "dpo_buy_days": 30, "dso_sell_days": 45, "annual_finance_rate_pct": 10, "storage_months": 1}
+
+
+def test_rows_match_per_destination_compute(client):
+    dests = [{"destination": "LUB"}, {"destination": "KIN", "sell_usd_per_mt": 820}, {"destination": "KOL"}]
+    r = client.post("/api/compare", json={"scn": SCENARIO, "dests": dests}).json()
+    assert r["base_destination"] == "LUB" and sorted(row["destination"] for row in r["results"]) == ["KIN", "KOL", "LUB"]
+
+    margins = [row["kpis"]["net_margin"] for row in r["results"]]
+    assert [row["rank"] for row in r["results"]] == [1, 2, 3] and margins == sorted(margins, reverse=True)
+    assert r["best_destination"] == r["results"][0]["destination"]
+    for row in r["results"]:
+        sell = 820 if row["destination"] == "KIN" else SCENARIO["sell_price_per_mt"]
+        out = client.post("/api/compute", json=dict(SCENARIO, destination=row["destination"],
+                                                   sell_price_per_mt=sell)).json()
+        assert row["kpis"] == pytest.approx(out["kpis"])
+        assert row["totals"]["logistics_excl_cogs_ins"] == pytest.approx(out["breakdown"]["logistics_excl_cogs_ins"])
+        assert row["delta_vs_best"]["net_margin"] == pytest.approx(row["kpis"]["net_margin"] - margins[0])
+
+
+def test_default_destinations_and_empty_list(client):
+    r = client.post("/api/compare", json={"scn": SCENARIO}).json()
+    assert {row["destination"] for row in r["results"]} == {"LUB", "KIN", "KOL"}
+    assert client.post("/api/compare", json={"scn": SCENARIO, "dests": []}).status_code == 422
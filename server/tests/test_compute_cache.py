@@ -0,0 +1,43 @@
+"""/api/compute response cache: ETag per (scenario, plan version, segment, detail, media)."""
+from compute_cache import scenario_key
+
+SCENARIO = {"destination": "KIN", "volume_mt": 870, "buy_price_per_mt": 455, "sell_price_per_mt": 810}
+
+
+def test_etag_round_trip(client):
+    r = client.post("/api/compute", json=SCENARIO)
+    assert "Accept" in r.headers["vary"]
+    again = client.post("/api/compute", json=SCENARIO, headers={"If-None-Match": r.headers["etag"]})
+    assert again.status_code == 304
+    kpis = client.post("/api/compute?detail=kpis", json=SCENARIO)
+    assert kpis.headers["etag"] != r.headers["etag"] and set(kpis.json()) == {"kpis"}
+
+
+def test_key_and_body_come_from_the_same_plan(client, app_main, monkeypatch):
+    # reload che arriva mentre la richiesta e' in corso: la chiave deve essere quella del piano usato
+    plans = app_main.PLANS
+    version = plans.version
+    real_get = plans.get
+
+    def reload_then_get(*args, **kwargs):
+        if plans.version == version:
+            plans.invalidate(version + 1)
+        return real_get(*args, **kwargs)
+
+    monkeypatch.setattr(plans, "get", reload_then_get)
+    try:
+        payload = dict(SCENARIO, volume_mt=871)
+        r = client.post("/api/compute", json=payload)
+        full = app_main.ScenarioIn(**payload).model_dump(mode="json")
+        segment = real_get("KIN").segment
+        assert r.headers["etag"] == f'"{scenario_key(full, f"{version + 1}.{segment}.full.application/json")}"'
+    finally:
+        monkeypatch.undo()
+        plans.invalidate(version)
+
+
+def test_openapi_declares_every_detail_shape(client):
+    schema = client.get("/openapi.json").json()
+    ok = schema["paths"]["/api/compute"]["post"]["responses"]["200"]["content"]["application/json"]["schema"]
+    refs = {s["$ref"].rsplit("/", 1)[-1] for s in ok["anyOf"]}
+    assert refs == {"ComputeOut", "ComputeKpisOut"}
@@ -0,0 +1,38 @@
+"""Cost catalogue: version ETag / 304 and `?since=` deltas."""
+
+
+def test_etag_not_modified(client, app_main):
+    r = client.get("/api/costs")
+    etag = r.headers["etag"]
+    version = app_main.COSTS.version
+    assert etag == f'"costs-{version}-all-json"' and isinstance(r.json(), list)
+    assert "Accept" in r.headers["vary"]
+    again = client.get("/api/costs", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.content == b""
+    # stesso validatore solo per la stessa rappresentazione
+    delta = client.get(f"/api/costs?since={version}", headers={"If-None-Match": etag})
+    assert delta.status_code == 200 and delta.headers["etag"] == f'"costs-{version}-{version}-json"'
+
+
+def test_since_returns_only_touched_codes(client):
+    full = client.get("/api/costs?since=-1").json()
+    assert full["full"] and full["items"] == client.get("/api/costs").json()
+    version = full["cost_version"]
+    exported = client.get("/api/costs/export?format=json").content      # ordine tabella: lo ripristiniamo identico
+    assert client.get(f"/api/costs?since={version}").json()["items"] == []
+
+    row = next(c for c in full["items"] if c["code"] == "TRK_TZ_DRC_LINEHAUL" and c["effective_to"] is None)
+    extra = dict(row, code="TST_CATALOG_EXTRA", dest_scope="TST")
+    try:
+        assert client.put(f"/api/costs/{row['code']}", json=dict(row, unit_amount_usd=row["unit_amount_usd"] + 1)).status_code == 200
+        assert client.patch("/api/costs", json={"ops": [{"op": "add", "item": extra}]}).status_code == 200
+        delta = client.get(f"/api/costs?since={version}").json()
+        assert not delta["full"] and delta["cost_version"] == version + 2
+        assert {c["code"] for c in delta["items"]} == {"TRK_TZ_DRC_LINEHAUL", "TST_CATALOG_EXTRA"}
+        assert delta["removed"] == []
+    finally:
+        client.post("/api/costs/import?format=json&mode=replace", files={"file": ("costs.json", exported, "application/json")})
+
+    delta = client.get(f"/api/costs?since={version + 2}").json()
+    assert delta["removed"] == ["TST_CATALOG_EXTRA"]                  # la replace tocca tutti i codici
+    assert delta["items"] == full["items"]
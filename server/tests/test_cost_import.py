@@ -0,0 +1,86 @@
+"""Bulk cost-table import/export and atomic PATCH batches."""
+SCENARIO = {"destination": "KIN", "volume_mt": 870, "buy_price_per_mt": 455, "sell_price_per_mt": 810,
+            "storage_months": 1, "dso_sell_days": 45, "annual_finance_rate_pct": 10}
+
+
+def _costs(client):
+    return {c["code"]: c for c in client.get("/api/costs").json()}
+
+
+def test_export_replace_round_trip(client, app_main):
+    before = client.post("/api/compute", json=SCENARIO).json()
+    exported = client.get("/api/costs/export?format=csv")
+    assert exported.headers["content-type"].startswith("text/csv")
+
+    version = app_main.COSTS.version
+    r = client.post("/api/costs/import?mode=replace", files={"file": ("costs.csv", exported.content, "text/csv")})
+    assert r.status_code == 200
+    assert r.json()["cost_version"] == version + 1                  # un solo bump per tutto il file
+    assert r.json()["added"] == len(app_main.COSTS.items)
+    after = client.post("/api/compute", json=SCENARIO).json()
+    assert after["kpis"] == before["kpis"]
+
+
+def test_patch_is_all_or_nothing(client, app_main):
+    costs = _costs(client)
+    version = app_main.COSTS.version
+    row = dict(costs["TRK_TZ_DRC_LINEHAUL"], unit_amount_usd=1.0)
+    r = client.patch("/api/costs", json={"ops": [{"op": "update", "item": row},
+                                                 {"op": "update", "item": dict(row, code="NO_SUCH_CODE")}]})
+    assert r.status_code == 404
+    assert app_main.COSTS.version == version
+    assert _costs(client)["TRK_TZ_DRC_LINEHAUL"]["unit_amount_usd"] == costs["TRK_TZ_DRC_LINEHAUL"]["unit_amount_usd"]
+
+
+def test_overlapping_add_and_bad_rows_are_rejected(client, app_main):
+    row = _costs(client)["TRK_TZ_DRC_LINEHAUL"]
+    assert client.post("/api/costs", json=row).status_code == 409
+    bad = ("code,name,behavior,unit_amount_usd,unit,qty_source,dest_scope,category\n"
+           "X1,ok,per_ton,1,MT,Volume_MT,TST,logistics\n"
+           "X2,bad,per_ton,abc,MT,Volume_MT,TST,logistics\n").encode()
+    r = client.post("/api/costs/import", files={"file": ("x.csv", bad, "text/csv")})
+    assert r.status_code == 422 and [e["row"] for e in r.json()["detail"]] == [2]
+    assert "X1" not in _costs(client)
+
+
+def test_update_cannot_rename_onto_an_existing_code(client, app_main):
+    costs = _costs(client)
+    version = app_main.COSTS.version
+    renamed = dict(costs["CLR_TZ_CNTR"], code="HND_TZ_CNTR")
+    assert client.put("/api/costs/CLR_TZ_CNTR", json=renamed).status_code == 409
+    for op in ("update", "upsert"):
+        r = client.patch("/api/costs", json={"ops": [{"op": op, "code": "CLR_TZ_CNTR", "item": renamed}]})
+        assert r.status_code == 409
+    assert app_main.COSTS.version == version
+    lines = client.post("/api/compute", json=dict(SCENARIO, destination="LUB")).json()["breakdown"]["lines"]
+    assert [l["code"] for l in lines].count("HND_TZ_CNTR") == 1
+
+
+def test_effective_dates_switch_rates(client, app_main):
+    lub = dict(SCENARIO, destination="LUB")
+
+    def rate(as_of=None):
+        scn = dict(lub, as_of=as_of) if as_of else lub
+        lines = client.post("/api/compute", json=scn).json()["breakdown"]["lines"]
+        return next(l["unit_amount_usd"] for l in lines if l["code"] == "TRK_TZ_DRC_LINEHAUL")
+
+    exported = client.get("/api/costs/export?format=json").content
+    row = _costs(client)["TRK_TZ_DRC_LINEHAUL"]
+    try:
+        r = client.put("/api/costs/TRK_TZ_DRC_LINEHAUL",
+                       json=dict(row, unit_amount_usd=row["unit_amount_usd"] + 100, effective_from="2030-01-01"))
+        assert r.status_code == 200
+        versions = sorted((c["effective_from"] or "", c["effective_to"]) for c in client.get("/api/costs").json()
+                          if c["code"] == "TRK_TZ_DRC_LINEHAUL")
+        assert versions == [("", "2030-01-01"), ("2030-01-01", None)]
+        assert rate() == rate("2029-12-31") == row["unit_amount_usd"]
+        assert rate("2030-01-01") == rate("2031-06-30") == row["unit_amount_usd"] + 100
+
+        # retrodatare la corrente la sovrapporrebbe allo storico
+        version = app_main.COSTS.version
+        r = client.put("/api/costs/TRK_TZ_DRC_LINEHAUL", json=dict(row, effective_from="2029-06-01"))
+        assert r.status_code == 409 and app_main.COSTS.version == version
+        assert rate("2029-12-31") == row["unit_amount_usd"]
+    finally:
+        client.post("/api/costs/import?format=json&mode=replace", files={"file": ("costs.json", exported, "application/json")})
+    assert rate("2030-01-01") == row["unit_amount_usd"]
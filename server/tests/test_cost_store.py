@@ -0,0 +1,47 @@
+"""Runtime cost DB: copied from the tracked template, which is never written."""
+import hashlib
+import os
+import sqlite3
+import subprocess
+import sys
+from contextlib import closing
+
+from cost_store import CostStore
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE = os.path.join(SERVER_DIR, "data.db")
+ROW = {"code": "X", "name": "x", "behavior": "per_ton", "unit_amount_usd": 1.0, "unit": "MT", "qty_source": "Volume_MT",
+       "dest_scope": "LUB*", "category": "logistics", "effective_from": None, "effective_to": None, "formula": None}
+
+
+def _digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_runtime_db_is_a_copy_of_the_template(tmp_path):
+    before = _digest(TEMPLATE)
+    store = CostStore(str(tmp_path / "var" / "costs.db"), template=TEMPLATE)
+    store.init(lambda: [ROW])
+    store.insert(dict(ROW, code="Y"))
+    assert [r["code"] for r in store.load()[1]] == ["X", "Y"]
+    with closing(sqlite3.connect(store.path)) as conn:
+        legacy = conn.execute("SELECT COUNT(*) FROM cost_items").fetchone()[0]
+    assert legacy > 0                                                  # tabelle legacy portate nella copia
+    assert _digest(TEMPLATE) == before
+    assert not os.path.exists(TEMPLATE + "-wal")
+
+
+def test_concurrent_first_boot(tmp_path):
+    # uvicorn --workers N su un COSTS_DB_PATH nuovo: tutti i worker fanno init insieme
+    script = ("import sys; from cost_store import CostStore; from deal_store import DealStore; "
+              f"s = CostStore(sys.argv[1], template={TEMPLATE!r}); s.init(lambda: [{ROW!r}]); DealStore(s.path).init()")
+    for trial in range(3):
+        path = str(tmp_path / str(trial) / "costs.db")
+        procs = [subprocess.Popen([sys.executable, "-c", script, path], cwd=SERVER_DIR, stderr=subprocess.PIPE)
+                 for _ in range(4)]
+        errors = [p.communicate(timeout=60)[1].decode() for p in procs]
+        assert [p.returncode for p in procs] == [0] * 4, errors
+        store = CostStore(path)
+        assert store.version() == 1 and [r["code"] for r in store.load()[1]] == ["X"]
+        assert not [f for f in os.listdir(os.path.dirname(path)) if f.endswith(".tmp")]
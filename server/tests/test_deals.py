@@ -0,0 +1,84 @@
+"""Saved deals: materialized KPIs, indexed queries, repricing limited to the deals a cost change touches."""
+import copy
+from datetime import date, timedelta
+
+import cost_plan
+
+DEALS = [
+    {"name": "kin-1", "deal_date": "2026-03-02", "scenario": {"destination": "KIN", "volume_mt": 400,
+     "buy_price_per_mt": 450, "sell_price_per_mt": 820, "storage_months": 1, "dso_sell_days": 30}},
+    {"name": "kin-closed", "deal_date": "2026-01-15", "status": "closed", "scenario": {"destination": "KIN",
+     "volume_mt": 200, "buy_price_per_mt": 450, "sell_price_per_mt": 800}},
+    {"name": "lub-1", "deal_date": "2026-02-10", "scenario": {"destination": "LUB", "volume_mt": 580,
+     "buy_price_per_mt": 420, "sell_price_per_mt": 700, "dso_sell_days": 45}},
+]
+
+
+def test_cost_change_reprices_only_affected_deals(client, app_main):
+    ids = client.post("/api/deals/bulk", json=DEALS).json()["ids"]
+    app_main.DEAL_REPRICER.sync()
+    before = {i: client.get(f"/api/deals/{i}").json() for i in ids}
+    for i, d in zip(ids, DEALS):
+        expected = client.post("/api/compute", json=d["scenario"]).json()["kpis"]
+        assert abs(before[i]["kpis"]["net_margin"] - expected["net_margin"]) < 1e-6
+
+    item = next(c for c in client.get("/api/costs").json() if c["code"] == "TRN_MAT_KIN_CNTR")
+    try:
+        client.put("/api/costs/TRN_MAT_KIN_CNTR", json=dict(item, unit_amount_usd=item["unit_amount_usd"] + 100))
+        assert app_main.DEAL_REPRICER.sync() == 1      # solo il deal KIN aperto
+        after = {i: client.get(f"/api/deals/{i}").json() for i in ids}
+    finally:
+        client.put("/api/costs/TRN_MAT_KIN_CNTR", json=item)
+        app_main.DEAL_REPRICER.sync()
+
+    kin, kin_closed, lub = ids
+    containers = -(-400 // 40)
+    assert after[kin]["kpis"]["net_margin"] == before[kin]["kpis"]["net_margin"] - 100 * containers
+    assert after[kin]["cost_version"] > before[kin]["cost_version"]
+    assert after[kin_closed] == before[kin_closed] and after[lub] == before[lub]
+
+
+def test_deal_queries(client):
+    ids = client.post("/api/deals/bulk", json=copy.deepcopy(DEALS)).json()["ids"]
+    r = client.get("/api/deals", params={"destination": "KIN", "status": "open", "date_from": "2026-03-01",
+                                         "min_margin_pct": 0.05, "limit": 1000}).json()
+    assert ids[0] in [d["id"] for d in r["deals"]] and not {ids[1], ids[2]} & {d["id"] for d in r["deals"]}
+    assert all(d["kpis"]["net_margin_pct"] >= 0.05 for d in r["deals"])
+
+    updated = client.put(f"/api/deals/{ids[2]}", json=dict(DEALS[2], status="closed")).json()
+    assert updated["status"] == "closed"
+    assert client.delete(f"/api/deals/{ids[2]}").json() == {"ok": True}
+    assert client.get(f"/api/deals/{ids[2]}").status_code == 404
+    assert client.get("/api/deals", params={"order": "scenario"}).status_code == 422
+
+
+def test_undated_deal_is_repriced_when_a_future_rate_takes_effect(client, app_main, monkeypatch):
+    today = date.today()
+    surcharge = {"code": "TST_DEAL_SURCHARGE", "name": "Port surcharge from next month", "category": "logistics",
+                 "behavior": "fixed_per_shipment", "unit_amount_usd": 5000, "unit": "Shipment",
+                 "qty_source": "1", "dest_scope": "KIN", "effective_from": (today + timedelta(days=30)).isoformat()}
+    exported = client.get("/api/costs/export?format=json").content
+    try:
+        assert client.post("/api/costs", json=surcharge).status_code == 200
+        deal_id = client.post("/api/deals", json=DEALS[0]).json()["id"]
+        app_main.DEAL_REPRICER.sync()
+        before = client.get(f"/api/deals/{deal_id}").json()
+        assert before["priced_on"] == today.isoformat()
+        assert app_main.DEAL_REPRICER.sync() == 0          # stesso segmento, niente da fare
+
+        class Later(date):
+            @classmethod
+            def today(cls):
+                return today + timedelta(days=31)
+
+        monkeypatch.setattr(app_main, "date", Later)
+        monkeypatch.setattr(cost_plan, "date", Later)
+        assert app_main.DEAL_REPRICER.sync() >= 1          # nessun cambio versione, solo il segmento di oggi
+        after = client.get(f"/api/deals/{deal_id}").json()
+        assert after["priced_on"] == Later.today().isoformat() and not after["stale"]
+        assert after["cost_version"] == before["cost_version"]
+        assert after["kpis"]["net_margin"] == before["kpis"]["net_margin"] - 5000
+    finally:
+        monkeypatch.undo()
+        client.post("/api/costs/import?format=json&mode=replace", files={"file": ("costs.json", exported, "application/json")})
+        app_main.DEAL_REPRICER.sync()
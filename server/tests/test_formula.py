@@ -0,0 +1,51 @@
+"""Cost items with behavior "formula": language, save-time validation, pricing paths."""
+import numpy as np
+import pytest
+
+import formula
+
+DEMURRAGE = {"code": "FRM_DEMURRAGE", "name": "Demurrage after 14 free days", "behavior": "formula",
+             "formula": "containers * max(0, storage_days - 14)", "unit_amount_usd": 2.0, "unit": "Cntr-day",
+             "qty_source": "Containers", "dest_scope": "FRM", "category": "logistics"}
+SCENARIO = {"destination": "FRM", "volume_mt": 870, "buy_price_per_mt": 455, "sell_price_per_mt": 810,
+            "storage_months": 1, "mt_per_container": 20}
+
+
+def test_formula_scalar_and_vector_agree():
+    f = formula.check("min(volume_mt, 1000) + 0.8 * max(volume_mt - 1000, 0) if 0 < volume_mt <= 5000 else 0")
+    v = np.array([0.0, 500.0, 2000.0, 9000.0])
+    expected = [f({"volume_mt": x}) for x in v]
+    assert f({"volume_mt": v}).tolist() == expected == [0.0, 500.0, 1800.0, 0.0]
+
+
+@pytest.mark.parametrize("text", ["__import__('os')", "volume_mt.real", "price * 2", "[1, 2]", "max()",
+                                  "volume_mt if True else 1", "10 ** 10 ** 10", "volume_mt +"])
+def test_formula_rejects(text):
+    with pytest.raises(formula.FormulaError):
+        formula.check(text)
+
+
+def test_bad_formula_is_rejected_at_save_time(client):
+    assert client.post("/api/costs", json=dict(DEMURRAGE, formula="containers * days")).status_code == 422
+    assert client.post("/api/costs", json=dict(DEMURRAGE, behavior="per_ton")).status_code == 422
+
+
+def test_formula_cost_in_compute_batch_and_sweep(client):
+    exported = client.get("/api/costs/export?format=json").content
+    assert client.post("/api/costs", json=DEMURRAGE).status_code == 200
+    try:
+        b = client.post("/api/compute", json=SCENARIO).json()["breakdown"]
+        line = next(l for l in b["lines"] if l["code"] == "FRM_DEMURRAGE")
+        assert line["qty"] == 44 * (30 - 14) and line["cost_usd"] == 2.0 * line["qty"]
+        assert b["logistics_excl_cogs_ins"] == pytest.approx(line["cost_usd"])
+
+        rows = client.post("/api/compute/batch", json={"scenarios": [SCENARIO, dict(SCENARIO, storage_months=0.2)],
+                                                       "detail": "full"}).json()["results"]
+        assert [r["breakdown"]["logistics_excl_cogs_ins"] for r in rows] == pytest.approx([line["cost_usd"], 0.0])
+        assert [l["qty"] for r in rows for l in r["breakdown"]["lines"]] == [line["qty"], 0.0]
+
+        sweep = client.post("/api/sweep", json={"base": SCENARIO, "kpis": ["logistics_excl_cogs_ins"],
+                                                "axes": [{"field": "storage_months", "values": [0.2, 1, 2]}]}).json()
+        assert sweep["kpis"]["logistics_excl_cogs_ins"] == pytest.approx([0.0, 2.0 * 44 * 16, 2.0 * 44 * 46])
+    finally:
+        client.post("/api/costs/import?format=json&mode=replace", files={"file": ("costs.json", exported, "application/json")})
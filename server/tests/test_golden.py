@@ -0,0 +1,102 @@
+"""Golden outputs of the original per-item model: every engine must match them to the cent."""
+import pytest
+
+from reference_model import build_golden, golden_scenarios, seed_items
+
+CENT = 0.005 + 1e-9
+
+
+def _check(case, kpis, totals, lines):
+    for k, exp in case["kpis"].items():
+        tol = 1e-8 if k == "net_margin_pct" else CENT
+        assert kpis[k] == pytest.approx(exp, abs=tol), k
+    for k, exp in case["totals"].items():
+        assert totals[k] == pytest.approx(exp, abs=CENT), k
+    if lines is not None:
+        assert [l[0] for l in lines] == [l[0] for l in case["lines"]]
+        for got, (code, qty, cost) in zip(lines, case["lines"]):
+            assert got[1] == pytest.approx(qty, abs=1e-9), code
+            assert got[2] == pytest.approx(cost, abs=CENT), code
+
+
+def _lines(breakdown):
+    return [(l["code"], l["qty"], l["cost_usd"]) for l in breakdown["lines"]]
+
+
+def test_golden_file_is_current(app_main, golden):
+    # il file deve corrispondere al modello di riferimento sulla tabella seed + voci TST
+    assert build_golden(seed_items()) == golden
+    assert len(golden) == len(golden_scenarios())
+
+
+def test_golden_covers_every_behavior(app_main):
+    from cost_plan import BEHAVIORS
+    seen = {it["behavior"] for it in seed_items()}
+    assert set(BEHAVIORS) <= seen
+    assert seen - set(BEHAVIORS), "an unknown behavior must be covered too"
+
+
+def test_compute_internal(app_main, golden):
+    for case in golden:
+        out = app_main._compute_internal(app_main.ScenarioIn(**case["scenario"]))
+        _check(case, out.kpis, out.breakdown, _lines(out.breakdown))
+
+
+def test_http_compute(client, golden):
+    for case in golden:
+        r = client.post("/api/compute", json=case["scenario"])
+        assert r.status_code == 200
+        body = r.json()
+        _check(case, body["kpis"], body["breakdown"], _lines(body["breakdown"]))
+
+
+def test_http_compute_compact(client, golden):
+    for case in golden[:40]:
+        b = client.post("/api/compute?detail=compact", json=case["scenario"]).json()["breakdown"]
+        lines = list(zip(b["lines"]["code"], b["lines"]["qty"], b["lines"]["cost_usd"]))
+        _check(case, client.post("/api/compute?detail=kpis", json=case["scenario"]).json()["kpis"], b, lines)
+
+
+def test_batch_full(client, golden):
+    body = client.post("/api/compute/batch", json={"scenarios": [c["scenario"] for c in golden],
+                                                   "detail": "full"}).json()
+    assert body["count"] == len(golden)
+    for case, res in zip(golden, body["results"]):
+        _check(case, res["kpis"], res["breakdown"], _lines(res["breakdown"]))
+
+
+def test_batch_columns(client, golden):
+    scenarios = [c["scenario"] for c in golden]
+    columns = {f: [s[f] for s in scenarios] for f in scenarios[0]}
+    body = client.post("/api/compute/batch", json={"columns": columns, "detail": "totals"}).json()
+    for i, case in enumerate(golden):
+        _check(case, {k: v[i] for k, v in body["kpis"].items()}, {k: v[i] for k, v in body["totals"].items()}, None)
+
+
+def test_live_session(client, golden):
+    with client.websocket_connect("/api/ws/pricing") as ws:
+        prev = {}
+        for i, case in enumerate(golden):
+            diff = {k: v for k, v in case["scenario"].items() if prev.get(k, object()) != v}
+            ws.send_json({"seq": i, "set": diff})
+            frame = ws.receive_json()
+            assert frame["seq"] == i
+            _check(case, frame["kpis"], frame["totals"], None)
+            prev = case["scenario"]
+
+
+def test_live_session_survives_bad_messages(client, app_main, golden, monkeypatch):
+    # col poller attivo la sessione non tocca il DB
+    monkeypatch.setattr(type(app_main.COSTS), "polling", property(lambda self: True))
+    monkeypatch.setattr(app_main.COSTS, "maybe_refresh", lambda: pytest.fail("refresh on the event loop"))
+    with client.websocket_connect("/api/ws/pricing") as ws:
+        for bad in ({"seq": 1, "set": [1, 2]}, {"seq": 2, "set": "volume_mt"}, [1, 2]):
+            ws.send_json(bad)
+            frame = ws.receive_json()
+            assert frame["error"][0]["type"] == "invalid_message" and "kpis" not in frame
+        ws.send_text("{not json")
+        assert ws.receive_json()["error"][0]["type"] == "invalid_message"
+        ws.send_json({"seq": 3, "set": golden[0]["scenario"]})
+        frame = ws.receive_json()
+        assert frame["seq"] == 3
+        _check(golden[0], frame["kpis"], frame["totals"], None)
@@ -0,0 +1,96 @@
+"""Background jobs: same numbers as the synchronous endpoints, cancellation, persisted state."""
+import json
+import os
+import socket
+import tempfile
+import time
+
+import jobs
+
+BASE = {"destination": "KIN", "volume_mt": 870, "buy_price_per_mt": 455, "sell_price_per_mt": 810,
+        "storage_months": 1, "dso_sell_days": 45, "annual_finance_rate_pct": 10}
+
+
+def _wait(client, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state = client.get(f"/api/jobs/{job_id}").json()
+        if state["status"] in ("done", "failed", "cancelled"):
+            return state
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} still {state['status']}")
+
+
+def test_sweep_job_matches_inline_sweep(client):
+    req = {"base": BASE, "kpis": ["net_margin", "net_margin_pct"], "chunk_size": 40,
+           "axes": [{"field": "sell_price_per_mt", "start": 600, "stop": 900, "steps": 25},
+                    {"field": "volume_mt", "values": [100, 580, 1160]}]}
+    r = client.post("/api/jobs/sweep", json=req)
+    assert r.status_code == 202 and r.headers["location"] == f"/api/jobs/{r.json()['id']}"
+    state = _wait(client, r.json()["id"])
+    assert state["status"] == "done", state["error"]
+    assert state["progress"] == {"done": 75, "total": 75}
+
+    lines = [json.loads(l) for l in client.get(f"/api/jobs/{state['id']}/result").text.splitlines()]
+    inline = client.post("/api/sweep", json=dict(req, chunk_size=None)).json()
+    assert lines[0]["shape"] == inline["shape"] == [25, 3]
+    for k in req["kpis"]:
+        assert sum((block["kpis"][k] for block in lines[1:]), []) == inline["kpis"][k]
+
+
+def test_simulate_job_and_events(client):
+    req = {"base": BASE, "draws": 5000, "seed": 3,
+           "distributions": {"sell_price_per_mt": {"dist": "normal", "mean": 810, "sd": 25}}}
+    job_id = client.post("/api/jobs/simulate", json=req).json()["id"]
+    with client.stream("GET", f"/api/jobs/{job_id}/events?interval=0.1") as events:
+        states = [json.loads(l) for l in events.iter_lines() if l]
+    assert states[-1]["status"] == "done"
+    result = client.get(f"/api/jobs/{job_id}/result").json()
+    assert result["net_margin"] == client.post("/api/simulate", json=req).json()["net_margin"]
+
+
+def test_cancel_and_errors(client, app_main):
+    req = {"base": BASE, "kpis": ["net_margin"], "chunk_size": 1,
+           "axes": [{"field": "sell_price_per_mt", "start": 600, "stop": 900, "steps": 100_000}]}
+    job_id = client.post("/api/jobs/sweep", json=req).json()["id"]
+    assert client.get(f"/api/jobs/{job_id}/result").status_code == 409
+    client.delete(f"/api/jobs/{job_id}")
+    state = _wait(client, job_id)
+    assert state["status"] == "cancelled" and state["progress"]["done"] < 100_000
+    assert app_main.JOBS.recover() == 0
+    assert client.get("/api/jobs/0123abcd").status_code == 404
+    assert client.delete("/api/jobs/0123abcd").status_code == 404
+
+
+def test_orphaned_jobs_are_recovered_by_lease(monkeypatch):
+    queue = jobs.JobQueue(tempfile.mkdtemp(prefix="trade-jobs-"), ttl_seconds=3600)
+    try:
+        owners = {
+            "restarted": [socket.gethostname(), os.getpid(), "0ld800t"],    # stesso host/pid, altro boot
+            "other_host_dead": ["elsewhere", 1, "gone"],                     # nessun lease
+            "other_host_alive": ["elsewhere", 1, "live"],
+            "ours": [socket.gethostname(), os.getpid(), jobs.BOOT_ID],
+        }
+        ids = {}
+        for name, owner in owners.items():
+            ids[name] = queue.create("simulate")
+            state = queue.get(ids[name])
+            jobs._write_json(os.path.join(queue.dir(ids[name]), "job.json"), dict(state, owner=owner))
+        with open(os.path.join(queue.leases, "live"), "w"):
+            pass
+        old = queue.create("simulate")
+        jobs._write_json(os.path.join(queue.dir(old), "job.json"),
+                         dict(queue.get(old), status="done", finished=time.time() - 7200))
+
+        assert queue.scan() == {"recovered": 2, "purged": 1}
+        status = {name: queue.get(job_id)["status"] for name, job_id in ids.items()}
+        assert status == {"restarted": "failed", "other_host_dead": "failed",
+                          "other_host_alive": "queued", "ours": "queued"}
+        assert queue.counts()[("queued",)] == 2 and queue.counts()[("failed",)] == 2
+
+        os.utime(os.path.join(queue.leases, "live"), (time.time() - 120, time.time() - 120))
+        assert queue.recover() == 1                                          # lease scaduto
+        queue.create("simulate")
+        assert queue.counts()[("queued",)] == 1                              # nessuna lettura fino al prossimo giro
+    finally:
+        queue.shutdown()
@@ -0,0 +1,44 @@
+"""Load planning: the best option is never worse than the current plan, allocations match /api/compute."""
+import pytest
+
+SCENARIO = {"destination": "LUB", "volume_mt": 410, "buy_price_per_mt": 420, "sell_price_per_mt": 700,
+            "dpo_buy_days": 30, "dso_sell_days": 45, "annual_finance_rate_pct": 10, "storage_months": 1,
+            "mt_per_container": 20, "mt_per_truck": 30}
+
+
+@pytest.mark.parametrize("volume", [300, 410, 599.5])
+def test_best_is_no_worse_than_current(client, volume):
+    scenario = dict(SCENARIO, volume_mt=volume)
+    r = client.post("/api/loadplan", json={"scenario": scenario, "min_volume_mt": 300, "max_volume_mt": 600}).json()
+    current = client.post("/api/compute", json=scenario).json()["kpis"]
+    assert r["current"]["net_margin_per_mt"] == pytest.approx(current["net_margin_per_mt"])
+    assert r["best"] == r["plans"][0]
+    assert r["best"]["net_margin_per_mt"] >= current["net_margin_per_mt"] - 1e-9
+    per_mt = [p["net_margin_per_mt"] for p in r["plans"]]
+    assert per_mt == sorted(per_mt, reverse=True)
+
+
+def test_allocations_match_compute(client):
+    req = {"scenario": SCENARIO, "min_volume_mt": 600, "max_volume_mt": 900, "max_splits": 2, "top": 10,
+           "dests": [{"destination": "LUB"}, {"destination": "KOL", "sell_usd_per_mt": 760}],
+           "modes": [{"mt_per_container": 20, "mt_per_truck": 30}, {"mt_per_container": 25, "mt_per_truck": 34}]}
+    r = client.post("/api/loadplan", json=req).json()
+    assert len(r["plans"]) == 10
+    for p in r["plans"]:
+        assert 600 <= p["volume_mt"] <= 900
+        assert len({a["destination"] for a in p["allocations"]}) == len(p["allocations"])
+        assert p["net_margin"] == pytest.approx(sum(a["net_margin"] for a in p["allocations"]))
+        for a in p["allocations"]:
+            out = client.post("/api/compute", json=dict(
+                SCENARIO, destination=a["destination"], volume_mt=a["volume_mt"], sell_price_per_mt=a["sell_price_per_mt"],
+                mt_per_container=a["mt_per_container"], mt_per_truck=a["mt_per_truck"])).json()["kpis"]
+            assert a["net_margin"] == pytest.approx(out["net_margin"])
+
+    assert client.post("/api/loadplan", json=dict(req, min_volume_mt=0)).status_code == 422
+    assert client.post("/api/loadplan", json=dict(req, max_splits=4)).status_code == 422
+
+
+def test_candidate_limit_is_checked_before_allocating(client):
+    req = {"scenario": dict(SCENARIO, mt_per_container=0.001), "min_volume_mt": 300, "max_volume_mt": 1e9}
+    r = client.post("/api/loadplan", json=req)
+    assert r.status_code == 422 and "Too many candidate volumes" in r.json()["detail"]
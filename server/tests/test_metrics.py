@@ -0,0 +1,70 @@
+"""/metrics: valid Prometheus text format, latency per route template, Server-Timing on request."""
+import re
+from collections import defaultdict
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{((?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+SCENARIO = {"destination": "LUB", "volume_mt": 580, "buy_price_per_mt": 420, "sell_price_per_mt": 700}
+
+
+def _parse(text):
+    """{metric family: type}, [(sample name, labels, value)]; asserts every line is well formed."""
+    types, samples = {}, []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert kind in ("counter", "gauge", "histogram") and name not in types
+            types[name] = kind
+        elif line.startswith("# HELP "):
+            assert line.split(" ")[2] not in types          # HELP prima di TYPE
+        else:
+            m = SAMPLE.match(line)
+            assert m, line
+            labels = dict(LABEL.findall(m.group(2) or ""))
+            samples.append((m.group(1), labels, float(m.group(3))))
+            assert re.sub(r"_(bucket|sum|count)$", "", m.group(1)) in types, line
+    return types, samples
+
+
+def test_metrics_parse_and_carry_route_labels(client):
+    assert client.post("/api/compute", json=SCENARIO).status_code == 200
+    deal_id = client.post("/api/deals", json={"scenario": SCENARIO}).json()["id"]
+    assert client.get(f"/api/deals/{deal_id}").status_code == 200
+    assert client.get("/api/no-such-route").status_code == 404
+
+    types, samples = _parse(client.get("/metrics").text)
+    assert types["trade_http_request_duration_seconds"] == "histogram"
+    routes = {(s[1]["method"], s[1]["route"], s[1]["status"]) for s in samples
+              if s[0] == "trade_http_request_duration_seconds_count"}
+    assert {("POST", "/api/compute", "200"), ("GET", "/api/deals/{deal_id}", "200"),
+            ("GET", "unmatched", "404")} <= routes
+    assert not any(str(deal_id) in r for _, r, _ in routes)          # template, non il path con l'id
+    assert any(s[0] == "trade_computes_total" and s[1] == {"destination": "LUB"} and s[2] >= 1 for s in samples)
+
+    # istogrammi: bucket cumulativi, +Inf == _count
+    buckets, counts = defaultdict(list), {}
+    for name, labels, value in samples:
+        key = (name.rsplit("_", 1)[0], tuple(sorted((k, v) for k, v in labels.items() if k != "le")))
+        if name.endswith("_bucket"):
+            buckets[key].append((labels["le"], value))
+        elif name.endswith("_count"):
+            counts[key] = value
+    assert buckets
+    for key, series in buckets.items():
+        values = [v for _, v in series]
+        assert values == sorted(values) and series[-1] == ("+Inf", counts[key])
+
+
+def test_destination_label_is_bounded(client):
+    batch = [dict(SCENARIO, destination=f"X{i}") for i in range(5)] + [dict(SCENARIO, destination="kin")]
+    assert client.post("/api/compute/batch", json={"scenarios": batch, "detail": "totals"}).status_code == 200
+    client.post("/api/compute", json=dict(SCENARIO, destination="NOWHERE"))
+    _, samples = _parse(client.get("/metrics").text)
+    labels = {s[1]["destination"] for s in samples if s[0] == "trade_computes_total"}
+    assert labels <= {"LUB", "KIN", "KOL", "other"} and {"KIN", "other"} <= labels
+
+
+def test_server_timing_on_request(client):
+    assert "server-timing" not in client.post("/api/compute", json=SCENARIO).headers
+    timing = client.post("/api/compute", json=SCENARIO, headers={"X-Profile": "1"}).headers["server-timing"]
+    assert {p.split(";")[0].strip() for p in timing.split(",")} >= {"refresh", "total"}
@@ -0,0 +1,143 @@
+"""Cost-table sync between replicas sharing one SQLite file."""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+from conftest import SERVER_DIR
+
+SCENARIO = {"destination": "LUB", "volume_mt": 580, "buy_price_per_mt": 420, "sell_price_per_mt": 700,
+            "dpo_buy_days": 30, "dso_sell_days": 45, "annual_finance_rate_pct": 10, "storage_months": 1}
+
+
+def _replica(app_main, path):
+    from cost_plan import PlanRegistry
+    from cost_store import CostSnapshot, CostStore
+
+    store = CostStore(path)
+    store.init(lambda: [c.model_dump() for c in app_main.seed_costs()])
+    holder = {}
+    plans = PlanRegistry(lambda: holder["snap"].items)
+    snap = holder["snap"] = CostSnapshot(store, lambda row: app_main.CostItem(**row), plans.invalidate,
+                                         refresh_interval=0)
+    snap.reload()
+    return snap, plans
+
+
+def test_two_snapshots_share_a_store(app_main):
+    path = os.path.join(tempfile.mkdtemp(prefix="trade-sync-"), "costs.db")
+    replicas = [_replica(app_main, path) for _ in range(2)]
+
+    (a, plans_a), (b, plans_b) = replicas
+    old = plans_b.get("LUB")
+    row = next(c for c in a.items if c.code == "TRK_TZ_DRC_LINEHAUL").model_dump()
+    row["unit_amount_usd"] = 10_000.0
+    a.store.update(row["code"], row)
+    a.reload()
+
+    assert b.maybe_refresh()
+    new = plans_b.get("LUB")
+    assert new.version == a.version == b.version
+    assert new is not old and old.version < new.version   # chi aveva il piano vecchio lo tiene intatto
+    assert new.amounts[new.codes.index("TRK_TZ_DRC_LINEHAUL")] == 10_000.0
+
+
+def test_version_header_reload_runs_off_the_event_loop(app_main):
+    from cost_store import VersionHeaderMiddleware
+
+    path = os.path.join(tempfile.mkdtemp(prefix="trade-sync-"), "costs.db")
+    (a, _), (b, _) = [_replica(app_main, path) for _ in range(2)]
+    row = next(c for c in a.items if c.code == "TRK_TZ_DRC_LINEHAUL").model_dump()
+    a.store.update(row["code"], dict(row, unit_amount_usd=10_000.0))
+    a.reload()
+
+    on_loop = []
+    check = b.check
+    b.check = lambda: (on_loop.append(_has_running_loop()), check())[1]
+    sent = []
+
+    async def inner(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"x-cost-version", str(a.version).encode())]}
+    asyncio.run(VersionHeaderMiddleware(inner, snapshot=b)(scope, None, send))
+    assert on_loop == [False] and b.version == a.version
+    assert (b"x-cost-version", str(a.version).encode()) in sent[0]["headers"]
+
+
+def _has_running_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def workers():
+    httpx = pytest.importorskip("httpx")
+    port = _free_port()
+    env = dict(os.environ, COSTS_DB_PATH=os.path.join(tempfile.mkdtemp(prefix="trade-workers-"), "costs.db"),
+               COSTS_SNAPSHOT_PATH=os.devnull, COSTS_POLL_SECONDS="0.2", STARTUP_BUDGET_SECONDS="30")
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", "2",
+                             "--log-level", "warning"], cwd=SERVER_DIR, env=env)
+    base = f"http://127.0.0.1:{port}"
+    client = httpx.Client(base_url=base, limits=httpx.Limits(max_keepalive_connections=0), timeout=10)
+    try:
+        ready = 0
+        deadline = time.monotonic() + 60
+        while ready < 10 and time.monotonic() < deadline:   # tutti e due i worker pronti
+            try:
+                ready = ready + 1 if client.get("/api/ready").status_code == 200 else 0
+            except httpx.TransportError:
+                ready = 0
+            time.sleep(0.05)
+        assert ready >= 10, "uvicorn workers did not become ready"
+        yield client
+    finally:
+        client.close()
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def _set_linehaul(client, amount):
+    row = next(c for c in client.get("/api/costs").json() if c["code"] == "TRK_TZ_DRC_LINEHAUL")
+    row["unit_amount_usd"] = amount
+    r = client.put(f"/api/costs/{row['code']}", json=row)
+    assert r.status_code == 200
+    return r.json()["cost_version"]
+
+
+def _linehaul_costs(client, n, headers=None):
+    seen = set()
+    for _ in range(n):
+        r = client.post("/api/compute", json=SCENARIO, headers=headers or {})
+        line = next(l for l in r.json()["breakdown"]["lines"] if l["code"] == "TRK_TZ_DRC_LINEHAUL")
+        seen.add((int(r.headers["x-cost-version"]), line["unit_amount_usd"]))
+    return seen
+
+
+def test_workers_converge_by_polling(workers):
+    version = _set_linehaul(workers, 9_500.0)
+    time.sleep(1.0)
+    assert _linehaul_costs(workers, 30) == {(version, 9_500.0)}
+
+
+def test_version_header_reads_own_write(workers):
+    version = _set_linehaul(workers, 9_800.0)
+    seen = _linehaul_costs(workers, 30, headers={"X-Cost-Version": str(version)})
+    assert seen == {(version, 9_800.0)}
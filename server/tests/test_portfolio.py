@@ -0,0 +1,88 @@
+"""Portfolio file evaluation: same numbers as /api/compute/batch, chunk by chunk."""
+import csv
+import io
+import json
+
+import pytest
+
+import portfolio
+
+ROWS = [
+    {"deal_id": "a", "destination": "LUB", "volume_mt": 580, "buy_price_per_mt": 420, "sell_price_per_mt": 700,
+     "dso_sell_days": 45, "storage_months": 1},
+    {"deal_id": "b", "destination": "kin", "volume_mt": 870, "buy_price_per_mt": 455, "sell_price_per_mt": 810},
+    {"deal_id": "c", "destination": "KOL", "volume_mt": 401, "buy_price_per_mt": 430, "sell_price_per_mt": 760,
+     "storage_months": 0.5, "as_of": "2024-01-01"},
+    {"deal_id": "d", "destination": "LUB", "volume_mt": 0, "buy_price_per_mt": 420, "sell_price_per_mt": 700},
+    {"deal_id": "e", "destination": "TSTX", "volume_mt": 120, "buy_price_per_mt": 400, "sell_price_per_mt": 650,
+     "dpo_buy_days": 30},
+]
+FIELDS = ["deal_id", "destination", "volume_mt", "buy_price_per_mt", "sell_price_per_mt", "dso_sell_days",
+          "dpo_buy_days", "storage_months", "as_of"]
+
+
+def _csv() -> bytes:
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, FIELDS)
+    w.writeheader()
+    w.writerows(ROWS)
+    return buf.getvalue().encode()
+
+
+def _batch(client):
+    scenarios = [{k: v for k, v in r.items() if k != "deal_id"} for r in ROWS]
+    scenarios[1]["destination"] = "KIN"
+    return client.post("/api/compute/batch", json={"scenarios": scenarios, "detail": "totals"}).json()
+
+
+def test_csv_matches_batch(client):
+    r = client.post("/api/portfolio/evaluate?chunk_rows=2", files={"file": ("deals.csv", _csv(), "text/csv")})
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/csv")
+    out = list(csv.DictReader(io.StringIO(r.text)))
+    assert list(out[0]) == list(portfolio.OUTPUT_FIELDS)
+    assert [(o["row"], o["deal_id"], o["destination"]) for o in out] == \
+        [(str(i), r["deal_id"], r["destination"]) for i, r in enumerate(ROWS)]
+
+    batch = _batch(client)
+    for field, values in {**batch["kpis"], **batch["totals"]}.items():
+        got = [float(o[field]) if o[field] not in ("", "nan") else None for o in out]
+        assert got == pytest.approx([None if v is None or v != v else v for v in values]), field
+
+
+def test_ndjson_output_and_errors(client):
+    r = client.post("/api/portfolio/evaluate?format=ndjson&chunk_rows=3", files={"file": ("deals.csv", _csv(), "text/csv")})
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert [l["deal_id"] for l in lines] == [r["deal_id"] for r in ROWS]
+    assert [l["net_margin"] for l in lines[:3]] == pytest.approx(_batch(client)["kpis"]["net_margin"][:3])
+
+    bad = b"destination,volume_mt\nLUB,abc\n"
+    r = client.post("/api/portfolio/evaluate", files={"file": ("deals.csv", bad, "text/csv")})
+    assert r.status_code == 422 and "rows 0-0" in r.json()["detail"]
+
+
+def test_bad_cells_after_the_first_chunk_are_marked_per_row(client):
+    rows = [dict(r) for r in ROWS[:3]] * 2
+    rows[4] = dict(rows[4], volume_mt="abc")
+    rows[5] = dict(rows[5], as_of="2024-13-45")
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, FIELDS)
+    w.writeheader()
+    w.writerows(rows)
+    data = buf.getvalue().encode()
+
+    r = client.post("/api/portfolio/evaluate?format=ndjson&chunk_rows=2", files={"file": ("deals.csv", data, "text/csv")})
+    assert r.status_code == 200
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert [l["row"] for l in lines] == list(range(6))               # nessun troncamento
+    assert [l["error"] is None for l in lines] == [True] * 4 + [False] * 2
+    assert "volume_mt" in lines[4]["error"] and "as_of" in lines[5]["error"]
+    assert lines[4]["net_margin"] is None and lines[5]["net_margin"] is None
+    assert lines[3]["net_margin"] == pytest.approx(lines[0]["net_margin"])
+
+    out = list(csv.DictReader(io.StringIO(client.post(
+        "/api/portfolio/evaluate?chunk_rows=2", files={"file": ("deals.csv", data, "text/csv")}).text)))
+    assert [o["row"] for o in out] == [str(i) for i in range(6)] and out[4]["error"] and not out[3]["error"]
+
+    # stesso file in un solo blocco: errore prima dello stream
+    r = client.post("/api/portfolio/evaluate?chunk_rows=6", files={"file": ("deals.csv", data, "text/csv")})
+    assert r.status_code == 422 and r.json()["detail"].startswith("rows 4-5: volume_mt")
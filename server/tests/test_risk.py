@@ -0,0 +1,35 @@
+"""Monte Carlo risk: seeded runs are reproducible, bad specs are rejected, large runs go to jobs."""
+import pytest
+
+BASE = {"destination": "LUB", "volume_mt": 580, "buy_price_per_mt": 420, "sell_price_per_mt": 700,
+        "dpo_buy_days": 30, "dso_sell_days": 45, "annual_finance_rate_pct": 10, "storage_months": 1}
+DISTRIBUTIONS = {"sell_price_per_mt": {"dist": "normal", "mean": 700, "sd": 30},
+                 "fx_multiplier": {"dist": "triangular", "low": 0.95, "mode": 1.0, "high": 1.1}}
+
+
+def test_seeded_runs_are_reproducible(client):
+    req = {"base": BASE, "distributions": DISTRIBUTIONS, "draws": 300_000, "seed": 42}   # 2 shard: process pool
+    first = client.post("/api/simulate", json=req).json()
+    assert first["shards"] == 2 and first["draws"] == 300_000
+    assert client.post("/api/simulate", json=req).json() == first
+    other = client.post("/api/simulate", json=dict(req, seed=43)).json()
+    assert other["seed"] == 43 and other["net_margin"] != first["net_margin"]
+
+
+@pytest.mark.parametrize("distributions, draws", [
+    ({"sell_price_per_mt": {"dist": "normal", "mean": 700}}, 1000),             # manca sd
+    ({"sell_price_per_mt": {"dist": "uniform", "low": 800, "high": 600}}, 1000),
+    ({"destination": {"dist": "fixed", "value": 1}}, 1000),                     # campo non numerico
+    ({"sell_price_per_mt": {"dist": "poisson", "mean": 700}}, 1000),
+    (DISTRIBUTIONS, 0),
+])
+def test_invalid_spec_is_422(client, distributions, draws):
+    r = client.post("/api/simulate", json={"base": BASE, "distributions": distributions, "draws": draws})
+    assert r.status_code == 422
+
+
+def test_large_runs_are_sent_to_jobs(client, app_main, monkeypatch):
+    monkeypatch.setattr(app_main, "MAX_SIMULATE_DRAWS_INLINE", 1000)
+    r = client.post("/api/simulate", json={"base": BASE, "distributions": DISTRIBUTIONS, "draws": 1001})
+    assert r.status_code == 413 and "/api/jobs/simulate" in r.json()["detail"]
+    assert client.post("/api/simulate", json={"base": BASE, "distributions": DISTRIBUTIONS, "draws": 1000}).status_code == 200
@@ -0,0 +1,53 @@
+"""Route network: k-shortest ordering, and leg weights that follow the cost table."""
+import pytest
+
+import routes
+
+SCENARIO = {"destination": "KOL", "volume_mt": 580, "buy_price_per_mt": 420, "sell_price_per_mt": 760,
+            "mt_per_truck": 30}
+
+
+def test_k_shortest_is_ordered_and_loopless():
+    # tratte: DAR-KAS, KAS-LUB, KAS-KOL, LUB-KOL, MATADI-KIN
+    found = routes.k_shortest([1, 1, 10, 2, 0], "DAR", "KOL", k=5)
+    assert [(cost, path) for cost, path, _ in found] == [(4, ["DAR", "KASUMBALESA", "LUB", "KOL"]),
+                                                          (11, ["DAR", "KASUMBALESA", "KOL"])]
+    assert routes.k_shortest([1, 1, 10, 2, 0], "DAR", "KOL", k=1)[0][0] == 4
+    assert routes.k_shortest([1, 1, 10, 2, 0], "MATADI", "KOL", k=3) == []
+
+
+def test_optimize_orders_by_metric(client):
+    r = client.post("/api/routes/optimize", json={"scenario": SCENARIO, "k": 3}).json()
+    assert r["trucks"] == 20 and len(r["routes"]) == 2
+    costs = [route["cost_usd"] for route in r["routes"]]
+    assert costs == sorted(costs)
+    for route in r["routes"]:
+        assert route["cost_usd"] == pytest.approx(sum(leg["cost_usd"] for leg in route["legs"]))
+        assert [route["path"][0]] + [leg["to"] for leg in route["legs"]] == route["path"]
+
+    by_time = client.post("/api/routes/optimize", json={"scenario": SCENARIO, "k": 3, "metric": "time"}).json()
+    days = [route["transit_days"] for route in by_time["routes"]]
+    assert days == sorted(days)
+    assert client.post("/api/routes/optimize", json={"scenario": SCENARIO, "origins": ["NOWHERE"]}).status_code == 422
+
+
+def test_route_costs_follow_a_cost_put(client):
+    before = client.post("/api/routes/optimize", json={"scenario": SCENARIO, "k": 3}).json()
+    dar_rate = next(l for l in client.get("/api/routes/network").json()["legs"] if l["from"] == "DAR")["per_truck"]
+    exported = client.get("/api/costs/export?format=json").content
+    row = next(c for c in client.get("/api/costs").json()
+               if c["code"] == "TRK_TZ_DRC_LINEHAUL" and c["effective_to"] is None)
+    try:
+        r = client.put(f"/api/costs/{row['code']}", json=dict(row, unit_amount_usd=row["unit_amount_usd"] + 100))
+        assert r.status_code == 200
+        after = client.post("/api/routes/optimize", json={"scenario": SCENARIO, "k": 3}).json()
+    finally:
+        client.post("/api/costs/import?format=json&mode=replace", files={"file": ("costs.json", exported, "application/json")})
+
+    assert after["cost_version"] > before["cost_version"]
+    # la linehaul e' sulla tratta DAR -> KASUMBALESA, comune a tutte le rotte verso KOL
+    assert {tuple(x["path"]): x["cost_usd"] for x in after["routes"]} == pytest.approx(
+        {tuple(x["path"]): x["cost_usd"] + 100 * before["trucks"] for x in before["routes"]})
+    network = client.get("/api/routes/network").json()            # dopo il ripristino: tariffa originale
+    assert network["cost_version"] > after["cost_version"]
+    assert next(l for l in network["legs"] if l["from"] == "DAR")["per_truck"] == dar_rate
@@ -0,0 +1,55 @@
+"""Solvers: solved prices round-trip through /api/compute; no-solution, bisection, step thresholds."""
+import numpy as np
+import pytest
+
+import vector_engine as vec
+
+SCENARIO = {"destination": "LUB", "volume_mt": 580, "buy_price_per_mt": 420, "sell_price_per_mt": 700,
+            "dpo_buy_days": 30, "dso_sell_days": 45, "annual_finance_rate_pct": 10, "storage_months": 1}
+CURVED = {"code": "SLV_CURVED_FEE", "name": "Fee growing with the square root of the invoice", "behavior": "formula",
+          "formula": "100 * value ** 0.5", "unit_amount_usd": 1.0, "unit": "Shipment", "qty_source": "1",
+          "dest_scope": "SLV", "category": "logistics"}
+
+
+def _margin_pct(client, scenario, **prices):
+    return client.post("/api/compute", json=dict(scenario, **prices)).json()["kpis"]["net_margin_pct"]
+
+
+def test_solved_prices_round_trip(client):
+    r = client.post("/api/solve", json={"scenario": SCENARIO, "target_net_margin_pct": 0.08}).json()
+    assert set(r["methods"].values()) == {"closed_form"}
+    assert _margin_pct(client, SCENARIO, sell_price_per_mt=r["break_even_sell_per_mt"]) == pytest.approx(0, abs=1e-9)
+    assert _margin_pct(client, SCENARIO, sell_price_per_mt=r["target_sell_per_mt"]) == pytest.approx(0.08)
+    assert _margin_pct(client, SCENARIO, buy_price_per_mt=r["max_buy_per_mt"]) == pytest.approx(0.08)
+    assert r["break_even_sell_per_mt"] < r["target_sell_per_mt"]
+
+
+def test_unreachable_target_has_no_solution(client):
+    r = client.post("/api/solve", json={"scenario": SCENARIO, "target_net_margin_pct": 1.5}).json()
+    assert r["target_sell_per_mt"] is None and r["max_buy_per_mt"] is None
+    assert r["methods"]["target_sell"] == r["methods"]["max_buy"] == "no_solution"
+    assert r["methods"]["break_even_sell"] == "closed_form"
+
+
+def test_non_affine_costs_fall_back_to_bisection(client):
+    exported = client.get("/api/costs/export?format=json").content
+    assert client.post("/api/costs", json=CURVED).status_code == 200
+    try:
+        scenario = dict(SCENARIO, destination="SLV")
+        r = client.post("/api/solve", json={"scenario": scenario, "target_net_margin_pct": 0.05}).json()
+        # la fee dipende dal ricavo: non affine nel prezzo di vendita, ancora affine in quello di acquisto
+        assert r["methods"] == {"break_even_sell": "bisection", "target_sell": "bisection", "max_buy": "closed_form"}
+        assert _margin_pct(client, scenario, sell_price_per_mt=r["break_even_sell_per_mt"]) == pytest.approx(0, abs=1e-9)
+        assert _margin_pct(client, scenario, sell_price_per_mt=r["target_sell_per_mt"]) == pytest.approx(0.05)
+        assert _margin_pct(client, scenario, buy_price_per_mt=r["max_buy_per_mt"]) == pytest.approx(0.05)
+    finally:
+        client.post("/api/costs/import?format=json&mode=replace", files={"file": ("costs.json", exported, "application/json")})
+
+
+def test_step_thresholds_are_the_last_volume_that_fits(client):
+    scenario = dict(SCENARIO, volume_mt=400, mt_per_container=20, mt_per_truck=30)
+    t = client.post("/api/solve", json={"scenario": scenario}).json()["thresholds"]
+    assert (t["containers"], t["containers_full_at_mt"], t["container_headroom_mt"]) == (20, 400, 0)
+    assert (t["trucks"], t["trucks_full_at_mt"], t["truck_headroom_mt"]) == (14, 420, 20)
+    for volume, (n_c, n_t) in ((400, (20, 14)), (400.001, (21, 14)), (420, (21, 14)), (420.001, (22, 15))):
+        assert [int(n) for n in vec.unit_counts(np.asarray(volume), 20, 30)] == [n_c, n_t]
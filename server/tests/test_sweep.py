@@ -0,0 +1,48 @@
+"""Sensitivity sweep: grid cells match /api/compute, NDJSON chunks, size limits."""
+import itertools
+import json
+
+import pytest
+
+BASE = {"destination": "LUB", "volume_mt": 580, "buy_price_per_mt": 420, "sell_price_per_mt": 700,
+        "dpo_buy_days": 30, "dso_sell_days": 45, "annual_finance_rate_pct": 10, "storage_months": 1}
+AXES = [{"field": "volume_mt", "values": [390, 400, 401, 1200]},
+        {"field": "sell_price_per_mt", "start": 650, "stop": 750, "steps": 3}]
+KPIS = ["net_margin", "net_margin_pct", "logistics_excl_cogs_ins"]
+
+
+def test_grid_cells_match_compute(client):
+    r = client.post("/api/sweep", json={"base": BASE, "axes": AXES, "kpis": KPIS}).json()
+    assert r["shape"] == [4, 3] and r["axes"][1]["values"] == [650, 700, 750]
+    for (i, volume), (j, price) in itertools.product(enumerate(r["axes"][0]["values"]),
+                                                     enumerate(r["axes"][1]["values"])):
+        out = client.post("/api/compute", json=dict(BASE, volume_mt=volume, sell_price_per_mt=price)).json()
+        expected = {**out["kpis"], **out["breakdown"]}
+        assert {k: r["kpis"][k][i][j] for k in KPIS} == pytest.approx({k: expected[k] for k in KPIS})
+
+
+def test_ndjson_chunks_cover_the_grid(client):
+    inline = client.post("/api/sweep", json={"base": BASE, "axes": AXES, "kpis": KPIS}).json()
+    r = client.post("/api/sweep", json={"base": BASE, "axes": AXES, "kpis": KPIS, "chunk_size": 5})
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    header, *chunks = [json.loads(line) for line in r.text.splitlines()]
+    assert header["shape"] == [4, 3] and "kpis" not in header
+    assert [c["offset"] for c in chunks] == [0, 1, 2, 3]              # 5 celle // 3 per riga -> una riga a blocco
+    assert {k: [row for c in chunks for row in c["kpis"][k]] for k in KPIS} == inline["kpis"]
+
+
+def test_size_limits(client, app_main, monkeypatch):
+    monkeypatch.setattr(app_main, "MAX_SWEEP_CELLS_INLINE", 10)
+    r = client.post("/api/sweep", json={"base": BASE, "axes": AXES})
+    assert r.status_code == 413 and "chunk_size" in r.json()["detail"]
+    assert client.post("/api/sweep", json={"base": BASE, "axes": AXES, "chunk_size": 6}).status_code == 200
+
+    monkeypatch.setattr(app_main, "MAX_SWEEP_CELLS", 10)
+    assert client.post("/api/sweep", json={"base": BASE, "axes": AXES, "chunk_size": 6}).status_code == 413
+    assert client.post("/api/sweep", json={"base": BASE, "axes": AXES[:1], "kpis": ["nope"]}).status_code == 422
+
+    # la griglia si misura prima di allocarla
+    huge = [{"field": "sell_price_per_mt", "start": 600, "stop": 900, "steps": 10**9}]
+    for path in ("/api/sweep", "/api/jobs/sweep"):
+        r = client.post(path, json={"base": BASE, "axes": huge, "chunk_size": 6})
+        assert r.status_code == 413 and str(10**9) in r.json()["detail"]
@@ -0,0 +1,236 @@
+"""Vectorized (NumPy) version of the _compute_internal model.
+
+Tutte le funzioni lavorano su array broadcastabili: una colonna per campo di
+ScenarioIn, oppure assi diversi per campi diversi (griglie di sensitivita').
+I costi vengono presi dai CostPlan compilati (vedi cost_plan.py); le righe
+a formula non stanno nei coefficienti e arrivano a evaluate come `formulas`
+(plan.terms per un piano solo, plan_terms per righe con piani diversi).
+"""
+from typing import Dict, List, Mapping, Sequence, Tuple
+import numpy as np
+
+from cost_plan import BEHAVIORS, CostPlan, formula_vars
+
+NUMERIC_FIELDS: Tuple[str, ...] = (
+    "volume_mt",
+    "buy_price_per_mt",
+    "sell_price_per_mt",
+    "shrinkage_pct",
+    "storage_months",
+    "dpo_buy_days",
+    "dso_sell_days",
+    "annual_finance_rate_pct",
+    "partner_profit_pct",
+    "mt_per_container",
+    "mt_per_truck",
+)
+KPI_FIELDS: Tuple[str, ...] = (
+    "gross_revenue",
+    "total_cost",
+    "net_margin",
+    "net_margin_pct",
+    "net_margin_per_mt",
+    "break_even_sell_per_mt",
+)
+TOTAL_FIELDS: Tuple[str, ...] = (
+    "cogs",
+    "logistics_excl_cogs_ins",
+    "insurance",
+    "shrinkage",
+    "finance",
+    "partner_profit",
+)
+N_SLOTS = len(BEHAVIORS) + 1
+PCT_SLOT = BEHAVIORS.index("percent_of_value")  # primo slot a percentuale
+
+
+def stack_plans(plans: Sequence[CostPlan]) -> Tuple[np.ndarray, np.ndarray]:
+    """(logistics, insurance) coefficient matrices, shape (len(plans), N_SLOTS)."""
+    log = np.array([p.logistics for p in plans], dtype=float).reshape(len(plans), N_SLOTS)
+    ins = np.array([p.insurance for p in plans], dtype=float).reshape(len(plans), N_SLOTS)
+    return log, ins
+
+
+def columns_from_records(records: Sequence[Mapping], defaults: Mapping) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Row records (dicts) -> (destinations, numeric columns)."""
+    dest = np.array([r["destination"] for r in records], dtype=object)
+    cols = {}
+    for f in NUMERIC_FIELDS:
+        d = defaults.get(f)
+        cols[f] = np.array([_num(r.get(f, d)) for r in records], dtype=float)
+    return dest, cols
+
+
+def columns_from_payload(columns: Mapping[str, Sequence], defaults: Mapping) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Columnar payload -> (destinations, numeric columns). Raises ValueError."""
+    unknown = set(columns) - set(NUMERIC_FIELDS) - {"destination", "incoterm", "as_of"}
+    if unknown:
+        raise ValueError(f"Unknown columns: {sorted(unknown)}")
+    if "destination" not in columns:
+        raise ValueError("Missing column: destination")
+    dest = np.asarray(columns["destination"], dtype=object)
+    n = len(dest)
+    cols = {}
+    for f in NUMERIC_FIELDS:
+        if f in columns:
+            vals = columns[f]
+            if len(vals) != n:
+                raise ValueError(f"Column {f} has {len(vals)} values, expected {n}")
+            try:
+                cols[f] = np.array([_num(v) for v in vals], dtype=float)
+            except (TypeError, ValueError):
+                raise ValueError(f"Column {f} must be numeric")
+        elif f in defaults:
+            cols[f] = np.full(n, _num(defaults[f]), dtype=float)
+        else:
+            raise ValueError(f"Missing column: {f}")
+    return dest, cols
+
+
+def _num(v) -> float:
+    return np.nan if v is None else float(v)
+
+
+def evaluate(cols: Mapping[str, np.ndarray], coef_log: np.ndarray, coef_ins: np.ndarray,
+             fx_multiplier=None, formulas=None) -> Dict[str, np.ndarray]:
+    """Evaluate KPIs and breakdown totals for broadcastable scenario columns.
+
+    `coef_log` / `coef_ins` are either one plan's coefficients (shape
+    (N_SLOTS,)) or one row per scenario (shape (..., N_SLOTS)).
+    `fx_multiplier`, if given, scales the rate-based logistics lines (everything
+    except percent_of_value / percent_of_cogs; formula lines count as rate-based).
+    `formulas` (plan.terms or plan_terms(...)) adds the formula lines.
+    """
+    V = cols["volume_mt"]
+    buy = cols["buy_price_per_mt"]
+    sell = cols["sell_price_per_mt"]
+    sell_unit = np.where(np.isnan(sell) | (sell == 0), buy, sell)
+
+    n_cntr, n_trk = unit_counts(V, cols["mt_per_container"], cols["mt_per_truck"])
+    revenue = V * sell_unit
+    cogs_total = V * buy
+    months = cols["storage_months"]
+
+    mult = (V, n_cntr, n_trk, months, V * months, 1.0, revenue, cogs_total)
+    if fx_multiplier is None:
+        total_log = _dot(coef_log, mult)
+    else:
+        total_log = _dot(coef_log, mult[:PCT_SLOT]) * fx_multiplier + _dot(coef_log[..., PCT_SLOT:], mult[PCT_SLOT:])
+    total_ins = _dot(coef_ins, mult)
+    if formulas is not None:
+        f_log, f_ins = formulas(formula_vars(mult))
+        total_log = total_log + (f_log if fx_multiplier is None else f_log * fx_multiplier)
+        total_ins = total_ins + f_ins
+
+    shrink_loss = (cols["shrinkage_pct"] / 100.0) * cogs_total
+    partner_profit = (cols["partner_profit_pct"] / 100.0) * sell_unit * V
+    finance_cost = finance_nwc(revenue, cogs_total, months, cols["dso_sell_days"],
+                               cols["dpo_buy_days"], cols["annual_finance_rate_pct"])
+
+    total_cost = cogs_total + total_log + total_ins + shrink_loss + finance_cost + partner_profit
+    net_margin = revenue - total_cost
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(revenue != 0, net_margin / revenue, 0.0)
+        per_mt = np.where(V != 0, net_margin / V, 0.0)
+        be = np.where(V != 0, total_cost / V, 0.0)
+    shape = np.broadcast_shapes(*(np.shape(c) for c in cols.values()), np.shape(coef_log)[:-1],
+                                np.shape(fx_multiplier) if fx_multiplier is not None else ())
+    out = {
+        "gross_revenue": revenue,
+        "total_cost": total_cost,
+        "net_margin": net_margin,
+        "net_margin_pct": pct,
+        "net_margin_per_mt": per_mt,
+        "break_even_sell_per_mt": be,
+        "cogs": cogs_total,
+        "logistics_excl_cogs_ins": total_log,
+        "insurance": total_ins,
+        "shrinkage": shrink_loss,
+        "finance": finance_cost,
+        "partner_profit": partner_profit,
+        "containers": n_cntr,
+        "trucks": n_trk,
+        "sell_unit": sell_unit,
+    }
+    return {k: np.broadcast_to(v, shape) for k, v in out.items()}
+
+
+def unit_counts(V, mt_per_container, mt_per_truck):
+    n_cntr = np.ceil(V / np.maximum(mt_per_container, 0.0001))
+    n_trk = np.ceil(V / np.maximum(mt_per_truck, 0.0001))
+    return n_cntr, n_trk
+
+
+def finance_nwc(revenue, cogs_total, storage_months, dso, dpo, annual_rate_pct):
+    inv_days = np.maximum(0.0, storage_months * 30.0)
+    AR = revenue * (dso / 365.0)
+    INV = cogs_total * (inv_days / 365.0)
+    AP = cogs_total * (dpo / 365.0)
+    return (annual_rate_pct / 100.0) * np.maximum(0.0, AR + INV - AP)
+
+
+def _dot(coef: np.ndarray, mult: Sequence) -> np.ndarray:
+    total = 0.0
+    for k, m in enumerate(mult):
+        c = coef[..., k]
+        if not np.any(c):
+            continue
+        total = total + c * m
+    return total
+
+
+def evaluate_mixed(dest: np.ndarray, cols: Mapping[str, np.ndarray], plan_for,
+                   segments: np.ndarray | None = None) -> Tuple[Dict[str, np.ndarray], List[CostPlan], np.ndarray]:
+    """Evaluate rows with mixed destinations (and validity segments) in one pass.
+
+    `plan_for(destination, segment=...)` returns the compiled plan; rows are
+    grouped by (destination, segment) so each plan is looked up once.
+    Returns (results, plans, inverse) where plans[inverse[i]] is row i's plan.
+    """
+    dests, d_idx = np.unique(dest.astype(str), return_inverse=True)
+    if segments is None:
+        segments = np.zeros(len(dest), dtype=np.int64)
+    keys, inverse = np.unique(segments.astype(np.int64) * len(dests) + d_idx, return_inverse=True)
+    plans = [plan_for(str(dests[k % len(dests)]), segment=int(k // len(dests))) for k in keys]
+    log, ins = stack_plans(plans)
+    return evaluate(cols, log[inverse], ins[inverse], formulas=plan_terms(plans, inverse)), plans, inverse
+
+
+def plan_terms(plans: Sequence[CostPlan], inverse: np.ndarray):
+    """Formula totals for rows priced with plans[inverse[i]]; None if no plan has formula lines."""
+    groups = [(inverse == g, p.terms) for g, p in enumerate(plans) if p.terms is not None]
+    if not groups:
+        return None
+
+    def terms(q):
+        log = np.zeros(inverse.shape)
+        ins = np.zeros(inverse.shape)
+        for rows, t in groups:
+            f_log, f_ins = t({k: np.broadcast_to(v, inverse.shape)[rows] for k, v in q.items()})
+            log[rows] = f_log
+            ins[rows] = f_ins
+        return log, ins
+    return terms
+
+
+def line_costs(plan: CostPlan, res: Mapping[str, np.ndarray], rows: np.ndarray, cols: Mapping[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """(qty, cost) matrices, shape (len(rows), len(plan)), for plan's lines."""
+    V = cols["volume_mt"][rows]
+    months = cols["storage_months"][rows]
+    ones = np.ones_like(V)
+    zeros = np.zeros_like(V)
+    n_cntr = res["containers"][rows]
+    n_trk = res["trucks"][rows]
+    mult = np.stack([V, n_cntr, n_trk, months, V * months, ones,
+                     res["gross_revenue"][rows], res["cogs"][rows], zeros], axis=-1)
+    qty = np.stack([V, n_cntr, n_trk, months, V * months, ones, ones, ones, zeros], axis=-1)
+    idx = np.asarray(plan.behavior_idx, dtype=int)
+    amounts = np.asarray(plan.amounts, dtype=float)
+    qty, cost = qty[:, idx], mult[:, idx] * amounts
+    if any(plan.formulas):
+        q = formula_vars(tuple(mult[:, k] for k in range(8)))
+        for j, f in enumerate(plan.formulas):
+            if f is not None:
+                qty[:, j] = f(q)
+                cost[:, j] = qty[:, j] * amounts[j]
+    return qty, cost